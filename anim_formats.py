@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Animated WebP and APNG output of the radar frames, next to GIF.
+
+GIF codes the pixels with LZW only. Lossless WebP predicts every pixel from its neighbors and
+codes the residuals with a palette transform and entropy coding, which suits the small patches
+of few colors of the radar echoes. APNG (deflate with the PNG row filters) is there for clients
+without WebP; on the noisy radar frames it is larger than GIF. Every current browser shows both.
+The output format is picked per run:
+    gif    radar_anim.gif, as before
+    webp   radar_anim.webp, lossless animated WebP
+    apng   radar_anim.png, animated PNG
+Both keep the exact colors of the RIDGE palette. The frames are mapped to one palette of the
+colors in use (gif_delta.shared_palette), with the transparent color at index 0:
+* APNG keeps that palette (PLTE with tRNS), so its pixels are the palette indices and Pillow
+  writes only the rectangle of each frame that changed,
+* WebP has no palette in its container, so the frames are given as RGBA. Every visible pixel
+  keeps its color; the color under a fully transparent pixel may change.
+Consecutive identical frames become one frame that is shown longer.
+WebP needs Pillow built with libwebp (PIL.features.check('webp')).
+
+Usage: python anim_formats.py -f webp [-o radar_anim.webp] frame.gif ...
+'''
+
+ANIM_FORMATS={'gif': '.gif', 'webp': '.webp', 'apng': '.png'}  # output formats and their file extension
+WEBP_METHOD=4           # 0 (fast) to 6 (small); lossless WebP is exact at every method
+WEBP_QUALITY=50         # effort of lossless WebP; 80 (Pillow's default) is twice as slow for 0.2% smaller
+
+import io
+import os
+
+import numpy as np
+from PIL import Image, features
+
+from gif_delta import decode_indices, shared_palette, merge_identical
+from gif_splice import SPLICE_LOOP
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def anim_filename(filename, anim_format):
+    '''
+    :param filename: output filename, e.g., radar_anim.gif
+    :return: filename with the extension of anim_format, e.g., radar_anim.webp
+    '''
+    return os.path.splitext(filename)[0] + ANIM_FORMATS[anim_format]
+
+def palette_frames(ims_bytes, duration):
+    '''
+    Decode the frames to one shared palette and merge the repeated ones.
+    :return: tuple (uint8 array of shape (frames, height, width), palette bytes, transparent index
+        or None, list of seconds per frame)
+    '''
+    durations = list(duration) if isinstance(duration, (list, tuple)) else [duration] * len(ims_bytes)
+    stack, palette, transparency = shared_palette([decode_indices(img_bytes) for img_bytes in ims_bytes])
+    stack, secs = merge_identical(stack, durations)
+    return (stack, palette, transparency, secs)
+
+def rgba_palette(palette, transparency):
+    '''
+    :return: uint8 array of shape (colors, 4), the palette with alpha 0 for the transparent color.
+    '''
+    rgba = np.full((len(palette) // 3, 4), 255, dtype=np.uint8)
+    rgba[:, :3] = np.frombuffer(palette, dtype=np.uint8).reshape(-1, 3)
+    if transparency is not None:
+        rgba[transparency, 3] = 0
+    return rgba
+
+def encode_webp(ims_bytes, duration, loop=SPLICE_LOOP):
+    '''
+    :param ims_bytes: list of GIF bytes of the frames, in display order.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :param loop: number of loops, 0 for ever.
+    :return: bytes of the lossless animated WebP.
+    '''
+    return webp_frames(*palette_frames(ims_bytes, duration), loop=loop)
+
+def webp_frames(stack, palette, transparency, secs, loop=SPLICE_LOOP):
+    '''
+    The work of encode_webp, on frames that are already decoded (palette_frames).
+    '''
+    if not features.check('webp'):
+        raise RuntimeError('webp_frames: Pillow was built without WebP support')
+    rgba = rgba_palette(palette, transparency)
+    frames = [Image.fromarray(rgba[indices]) for indices in stack]
+    buf = io.BytesIO()
+    frames[0].save(buf, 'WEBP', save_all=True, append_images=frames[1:], duration=[int(round(s * 1000)) for s in secs],
+                   loop=loop, lossless=True, exact=True, method=WEBP_METHOD, quality=WEBP_QUALITY)
+    return buf.getvalue()
+
+def encode_apng(ims_bytes, duration, loop=SPLICE_LOOP):
+    '''
+    :param ims_bytes: list of GIF bytes of the frames, in display order.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :param loop: number of loops, 0 for ever.
+    :return: bytes of the animated PNG.
+    '''
+    return apng_frames(*palette_frames(ims_bytes, duration), loop=loop)
+
+def apng_frames(stack, palette, transparency, secs, loop=SPLICE_LOOP):
+    '''
+    The work of encode_apng, on frames that are already decoded (palette_frames).
+    '''
+    frames = []
+    for indices in stack:
+        im = Image.frombytes('P', (indices.shape[1], indices.shape[0]), np.ascontiguousarray(indices).tobytes())
+        im.putpalette(palette)
+        frames.append(im)
+    params = {} if transparency is None else {'transparency': transparency}
+    buf = io.BytesIO()
+    frames[0].save(buf, 'PNG', save_all=True, append_images=frames[1:], duration=[int(round(s * 1000)) for s in secs],
+                   loop=loop, **params)
+    return buf.getvalue()
+
+def encode_anim(ims_bytes, anim_format, duration, loop=SPLICE_LOOP):
+    '''
+    :param anim_format: 'webp' or 'apng'. GIF is written by create_anim_gif.
+    :return: bytes of the animation.
+    '''
+    if anim_format == 'webp':
+        return encode_webp(ims_bytes, duration, loop)
+    elif anim_format == 'apng':
+        return encode_apng(ims_bytes, duration, loop)
+    raise ValueError('encode_anim: unknown format %s' %(anim_format))
+
+def main(files, anim_format='webp', anim_out=None, duration=0.5):
+    ims_bytes = []
+    for fname in files:
+        with open(fname, 'rb') as f:
+            ims_bytes.append(f.read())
+    anim_out = anim_out or anim_filename('radar_anim', anim_format)
+    anim_bytes = encode_anim(ims_bytes, anim_format, duration)
+    with open(anim_out, 'wb') as f:
+        f.write(anim_bytes)
+    print('%s: %d frames, %d bytes (frames %d bytes)' %(anim_out, len(files), len(anim_bytes), sum([len(b) for b in ims_bytes])))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hf:o:'
+    longOpts  = ['help', 'format=', 'out=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    anim_format = 'webp'
+    anim_out = None
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-f','--format'):
+            anim_format = val.lower()
+        elif arg in ('-o','--out'):
+            anim_out = val
+    if not values or anim_format not in ('webp', 'apng'):
+        print(__doc__)
+        sys.exit(2)
+    main(values, anim_format, anim_out)
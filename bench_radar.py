@@ -0,0 +1,765 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Benchmarks for the radar animation pipeline.
+
+The network benchmarks run against a local HTTP server that serves the bundled MUX_*.gif sample
+frames the same way as the RIDGE directory https://radar.weather.gov/ridge/RadarImg/N0R/MUX/
+The server adds a delay when a connection is opened (like a TCP and TLS handshake) and a delay
+for every request (like the round trip to radar.weather.gov), so the results show the effect of
+connection reuse and concurrency rather than the speed of localhost.
+
+Usage: python bench_radar.py [-c connect_ms] [-l latency_ms] [benchmark ...]
+With no benchmark names, all benchmarks are run.
+'''
+
+SAMPLE_STATION='MUX'
+SAMPLE_PRODUCT='N0R'
+CONNECT_MS=50       # simulated handshake per new connection
+LATENCY_MS=30       # simulated round trip per request
+
+import io
+import os
+import sys
+import math
+import glob
+import time
+import random
+import shutil
+import tempfile
+import datetime
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import asyncio
+
+import numpy as np
+import imageio
+import aiohttp
+
+from radar_fetch import FrameFetcher
+from radar_async import AsyncRadarEngine
+from host_guard import set_host_limits
+from radar_sched import StationCadence
+from radar_batch import build_batch
+from nws_radar_gif import RadarAnimator, MyHTMLParser
+from ridge_listing import ListingParser, LISTING_CHUNK
+from frame_times import FrameTuples
+from frame_archive import FrameArchive
+from radar_timelapse import TimeLapse
+from level2_index import Level2Index, LocalBucket
+from radar_sites import SiteCatalog
+from frame_catalog import FrameCatalog
+from radar_async import encode_animation
+from radar_publish import publish_atomic
+from gif_splice import splice_gif, RollingGif
+from gif_delta import delta_gif
+from anim_formats import encode_webp, encode_apng
+from radar_outputs import write_outputs, output_paths, OUTPUT_ENCODERS
+from anim_formats import palette_frames
+from nws_radar_gif import FRAME_DURATION
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))    # holds the MUX_*.gif samples
+
+def sample_files():
+    '''
+    :return: sorted list of paths of the bundled sample frames.
+    '''
+    return sorted(glob.glob(os.path.join(SAMPLE_DIR, SAMPLE_STATION + '_*_' + SAMPLE_PRODUCT + '.gif')))
+
+class RidgeHandler(SimpleHTTPRequestHandler):
+    '''
+    Serves a directory tree like radar.weather.gov/ridge, with simulated network delays.
+    '''
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real server
+    connect_delay = CONNECT_MS / 1000.0
+    request_delay = LATENCY_MS / 1000.0
+    tail_prob = 0.0     # fraction of requests that are slow
+    tail_delay = 0.0    # extra seconds for a slow request
+    rng = random.Random(1)
+
+    def setup(self):
+        time.sleep(self.connect_delay)
+        SimpleHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        delay = self.request_delay
+        if self.tail_prob and self.rng.random() < self.tail_prob:
+            delay += self.tail_delay
+        time.sleep(delay)
+        try:
+            SimpleHTTPRequestHandler.do_GET(self)
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # the client cancelled the request, e.g., the loser of a hedged pair
+
+    def log_message(self, format, *args):
+        pass
+
+class RidgeServer:
+    '''
+    Local RIDGE look-alike. Use as a context manager; base_url is the RadarImg/ URL,
+    root_url the RadarImg/<product>/ URL of the sample product.
+    '''
+    def __init__(self, files=None, connect_ms=CONNECT_MS, latency_ms=LATENCY_MS, tail_prob=0.0, tail_ms=0,
+                 stations=(SAMPLE_STATION,), products=(SAMPLE_PRODUCT,)):
+        '''
+        :param tail_prob: fraction of requests that get tail_ms of extra delay.
+        :param stations: station directories to serve, each with a renamed copy of the samples.
+        :param products: product directories to serve, each with all the stations.
+        '''
+        self.files = files if files is not None else sample_files()
+        self.stations = stations
+        self.products = products
+        self.connect_ms = connect_ms
+        self.latency_ms = latency_ms
+        self.tail_prob = tail_prob
+        self.tail_ms = tail_ms
+
+    def __enter__(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='ridge_')
+        for product in self.products:
+            for station in self.stations:
+                sta_dir = os.path.join(self.tmp_dir, 'RadarImg', product, station)
+                os.makedirs(sta_dir)
+                for f in self.files:
+                    name = os.path.basename(f).replace(SAMPLE_STATION + '_', station + '_', 1)
+                    name = name.replace('_' + SAMPLE_PRODUCT + '.gif', '_' + product + '.gif')
+                    shutil.copy(f, os.path.join(sta_dir, name))
+        handler = type('Handler', (RidgeHandler,), {
+            'connect_delay': self.connect_ms / 1000.0,
+            'request_delay': self.latency_ms / 1000.0,
+            'tail_prob': self.tail_prob,
+            'tail_delay': self.tail_ms / 1000.0,
+            'rng': random.Random(1)})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=self.tmp_dir))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d/RadarImg/' %(self.httpd.server_port)
+        self.root_url = self.base_url + SAMPLE_PRODUCT + '/'
+        self.dir_url = self.root_url + SAMPLE_STATION + '/'
+        set_host_limits(self.root_url, rate=10000, burst=10000)    # measure the fetchers, not the limiter
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+def timed(func, *args, **kwargs):
+    '''
+    :return: tuple (seconds, return value of func)
+    '''
+    t0 = time.perf_counter()
+    retval = func(*args, **kwargs)
+    return (time.perf_counter() - t0, retval)
+
+def report(name, secs, note=''):
+    print('%-40s %8.3f s  %s' %(name, secs, note))
+
+def bench_fetch(opts):
+    '''
+    Serial urlopen per frame (old fetch_img_gifs) against FrameFetcher with 1 to 8 workers,
+    and against AsyncRadarEngine with the same concurrency.
+    '''
+    files = sample_files()
+    with RidgeServer(connect_ms=opts['connect_ms'], latency_ms=opts['latency_ms']) as srv:
+        urls = [srv.dir_url + os.path.basename(f) for f in files]
+        secs, serial = timed(lambda: [imageio.core.urlopen(url).read() for url in urls])
+        report('fetch urlopen serial', secs, '%d frames' %(len(urls)))
+        for workers in (1, 2, 4, 8):
+            fetcher = FrameFetcher(workers)
+            secs, pooled = timed(fetcher.fetch_all, urls)
+            fetcher.close()
+            assert pooled == serial, 'frames out of order'
+            report('fetch FrameFetcher workers=%d' %(workers), secs, '%d frames' %(len(urls)))
+        img_tuples = [(None, None, os.path.basename(f)) for f in files]
+        for workers in (1, 2, 4, 8):
+            engine = AsyncRadarEngine(SAMPLE_STATION, concurrency=workers)
+            engine.anim.img_dir_url = srv.dir_url
+            async def fetch_async():
+                async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=workers)) as session:
+                    return await engine.fetch_img_bytes_list(session, img_tuples)
+            secs, fetched = timed(asyncio.run, fetch_async())
+            assert fetched == serial, 'frames out of order'
+            report('fetch AsyncRadarEngine concurrency=%d' %(workers), secs, '%d frames' %(len(urls)))
+
+def bench_hedge(opts):
+    '''
+    AsyncRadarEngine with and without hedged requests (at the 90th percentile), on a server where
+    5% of the requests are one second slower. Each build fetches all frames again (no cache).
+    Two warm-up builds fill the latency history first.
+    '''
+    files = sample_files()
+    img_tuples = [(None, None, os.path.basename(f)) for f in files]
+    warmup = 2
+    builds = 20
+    for hedge in (False, True):
+        with RidgeServer(connect_ms=opts['connect_ms'], latency_ms=opts['latency_ms'], tail_prob=0.05, tail_ms=1000) as srv:
+            engine = AsyncRadarEngine(SAMPLE_STATION, concurrency=8, hedge=hedge, hedge_percentile=90)
+            engine.anim.img_dir_url = srv.dir_url
+            async def fetch_async():
+                async with aiohttp.ClientSession() as session:
+                    return await engine.fetch_img_bytes_list(session, img_tuples)
+            for n in range(warmup):
+                asyncio.run(fetch_async())
+            times = []
+            hedges = 0
+            for n in range(builds):
+                engine.hedges = 0
+                secs, fetched = timed(asyncio.run, fetch_async())
+                times.append(secs)
+                hedges += engine.hedges
+            times.sort()
+            report('hedge=%s median build' %(hedge), times[builds // 2], '%d frames' %(len(files)))
+            report('hedge=%s slowest build' %(hedge), times[-1], 'hedges=%d' %(hedges))
+
+def simulate_polls(publish, frame_times, next_poll, t_end):
+    '''
+    Replay a station's publication times against a polling policy.
+    :param publish: wall clock times when the frames appear in the listing.
+    :param frame_times: datetimes in the frame filenames.
+    :param next_poll: function(now, frame_times visible now) -> time of the next poll.
+    :return: tuple (number of polls, mean seconds from publication to the poll that saw the frame)
+    '''
+    polls = 0
+    stale = []
+    seen = 0
+    now = publish[0]
+    while now < t_end:
+        polls += 1
+        visible = 0
+        while visible < len(publish) and publish[visible] <= now:
+            visible += 1
+        for idx in range(seen, visible):
+            stale.append(now - publish[idx])
+        seen = max(seen, visible)
+        now = next_poll(now, frame_times[:visible])
+    return (polls, sum(stale) / max(1, len(stale)))
+
+def bench_sched(opts):
+    '''
+    Fixed interval polling (cron every 10, 5, 2 and 1 minutes) against StationCadence, on 3 hours of precipitation mode
+    (frames every 4 to 6 minutes) followed by 3 hours of clear-air mode (every 10 minutes).
+    Frames show up in the listing 60 to 90 seconds after their timestamp.
+    '''
+    import datetime as dt
+    rng = random.Random(2)
+    t0 = dt.datetime(2019, 5, 19, 0, 0)
+    frame_times = []
+    t = t0
+    while t < t0 + dt.timedelta(hours=6):
+        frame_times.append(t)
+        precip = t < t0 + dt.timedelta(hours=3)
+        t += dt.timedelta(minutes=rng.choice((4, 5, 6)) if precip else 10)
+    epoch0 = 1558224000.0   # wall clock of t0, any value works
+    publish = [epoch0 + (ft - t0).total_seconds() + rng.uniform(60, 90) for ft in frame_times]
+    t_end = publish[-1] + 60
+    for minutes in (10, 5, 2, 1):
+        polls, stale = simulate_polls(publish, frame_times, lambda now, seen: now + minutes * 60, t_end)
+        report('sched cron %d min' %(minutes), stale, 'mean staleness (s), polls=%d frames=%d' %(polls, len(frame_times)))
+    cadence = StationCadence('SIM')
+    def adaptive(now, seen):
+        cadence.observe(seen, now)
+        return cadence.next_poll(now)
+    polls, stale = simulate_polls(publish, frame_times, adaptive, t_end)
+    report('sched StationCadence', stale, 'mean staleness (s), polls=%d frames=%d' %(polls, len(frame_times)))
+
+def bench_batch(opts):
+    '''
+    Eight stations built one after another with AsyncRadarEngine.run, each with its own session
+    (like one process per station, without the interpreter start), against build_batch.
+    '''
+    stations = ('MUX', 'ATX', 'RTX', 'OTX', 'PDT', 'MAX', 'BHX', 'DAX')
+    out_dir = tempfile.mkdtemp(prefix='batch_')
+    anim_out = os.path.join(out_dir, 'radar_{station}.gif')
+    base_url = RadarAnimator.img_base_url
+    try:
+        with RidgeServer(connect_ms=opts['connect_ms'], latency_ms=opts['latency_ms'], stations=stations) as srv:
+            RadarAnimator.img_base_url = srv.base_url
+            def sequential():
+                for station in stations:
+                    AsyncRadarEngine(station).run(anim_out.format(station=station))
+            secs, _ = timed(sequential)
+            report('batch sequential %d stations' %(len(stations)), secs)
+            secs, rows = timed(asyncio.run, build_batch(stations, anim_out))
+            assert all([row['status'] == 'ok' for row in rows]), str(rows)
+            slowest = max([row['total'] for row in rows])
+            report('batch build_batch %d stations' %(len(stations)), secs, 'slowest station %.3f s' %(slowest))
+    finally:
+        RadarAnimator.img_base_url = base_url
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def bench_products(opts):
+    '''
+    A dashboard of three products of two stations: the products built one after another with
+    AsyncRadarEngine.run, against one build_batch over all stations and products.
+    '''
+    stations = ('MUX', 'ATX')
+    products = ('N0R', 'N0V', 'NCR')
+    out_dir = tempfile.mkdtemp(prefix='products_')
+    anim_out = os.path.join(out_dir, 'radar_{station}_{product}.gif')
+    base_url = RadarAnimator.img_base_url
+    try:
+        with RidgeServer(connect_ms=opts['connect_ms'], latency_ms=opts['latency_ms'], stations=stations,
+                         products=products) as srv:
+            RadarAnimator.img_base_url = srv.base_url
+            def sequential():
+                for station in stations:
+                    for product in products:
+                        AsyncRadarEngine(station, product=product).run(anim_out.format(station=station, product=product))
+            secs, _ = timed(sequential)
+            report('products sequential %d builds' %(len(stations) * len(products)), secs)
+            secs, rows = timed(asyncio.run, build_batch(stations, anim_out, products=list(products)))
+            assert all([row['status'] == 'ok' for row in rows]), str(rows)
+            slowest = max([row['total'] for row in rows])
+            report('products build_batch %d builds' %(len(rows)), secs, 'slowest build %.3f s' %(slowest))
+    finally:
+        RadarAnimator.img_base_url = base_url
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def synthetic_listing(entries, products=('N0R', 'N0S', 'N0V', 'NCR'), newest_first=False):
+    '''
+    Apache style listing of a directory with frames of several products every 5 minutes.
+    :param entries: number of frames listed.
+    :return: the listing as bytes.
+    '''
+    t0 = datetime.datetime(2020, 12, 14, 0, 0)
+    lines = ['<html><head><title>Index of /ridge/RadarImg/N0R/MUX</title></head><body>',
+             '<h1>Index of /ridge/RadarImg/N0R/MUX</h1><pre><img src="/icons/blank.gif" alt="Icon "> '
+             '<a href="?C=N;O=D">Name</a> <a href="?C=M;O=A">Last modified</a> <a href="?C=S;O=A">Size</a><hr>',
+             '<img src="/icons/back.gif" alt="[PARENTDIR]"> <a href="/ridge/RadarImg/N0R/">Parent Directory</a>']
+    names = []
+    for n in range(entries):
+        t = t0 + datetime.timedelta(minutes=5 * (n // len(products)))
+        names.append('%s_%s_%s.gif' %(SAMPLE_STATION, t.strftime('%Y%m%d_%H%M'), products[n % len(products)]))
+    if newest_first:
+        names.reverse()
+    for name in names:
+        lines.append('<img src="/icons/image2.gif" alt="[IMG]"> <a href="%s">%s</a>  2020-12-14 00:05   21K' %(name, name))
+    lines.append('<hr></pre></body></html>')
+    return '\n'.join(lines).encode('utf-8')
+
+def bench_listing(opts):
+    '''
+    MyHTMLParser against ListingParser on a listing of several products, keeping the N0R frames
+    of a 70 minute window. With the listing newest first, ListingParser stops early.
+    '''
+    anim = RadarAnimator(SAMPLE_STATION)
+    for entries in (1000, 10000, 50000):
+        html = synthetic_listing(entries)
+        def html_parser():
+            hparse = MyHTMLParser(SAMPLE_STATION)
+            hparse.feed(html.decode('utf-8'))
+            img_list = [f for f in hparse.get_img_list() if f.endswith('_' + SAMPLE_PRODUCT + '.gif')]
+            img_tuples = anim.make_img_tuples(img_list)
+            anim.calc_time_bounds(img_tuples)
+            return [t[2] for t in anim.filter_img_tuples(img_tuples)]
+        secs, expected = timed(html_parser)
+        report('listing MyHTMLParser %d entries' %(entries), secs, '%d frames' %(len(expected)))
+        def stream(listing):
+            parser = ListingParser(SAMPLE_STATION, SAMPLE_PRODUCT, twindow=anim.twindow)
+            for idx in range(0, len(listing), LISTING_CHUNK):
+                if parser.done:
+                    break
+                parser.feed(listing[idx:idx + LISTING_CHUNK])
+            return parser
+        secs, parser = timed(stream, html)
+        assert parser.get_img_list() == expected, 'listing parsers disagree'
+        report('listing ListingParser %d entries' %(entries), secs, '%d frames' %(len(expected)))
+        html = synthetic_listing(entries, newest_first=True)
+        secs, parser = timed(stream, html)
+        assert parser.get_img_list() == expected, 'listing parsers disagree'
+        report('listing ListingParser newest first', secs, 'read %d of %d bytes' %(parser.nbytes, len(html)))
+
+def bench_times(opts):
+    '''
+    img_name_tuple per frame with a linear filter (the old make_img_tuples and filter_img_tuples)
+    against FrameTuples with a binary search, for archives of 1k to 100k frames every 5 minutes.
+    The 70 minute window at the end is then formatted, as when the frames are rendered.
+    '''
+    anim = RadarAnimator(SAMPLE_STATION)
+    t0 = datetime.datetime(2020, 12, 14, 0, 0)
+    for count in (1000, 10000, 100000):
+        img_list = ['%s_%s_%s.gif' %(SAMPLE_STATION, (t0 + datetime.timedelta(minutes=5 * n)).strftime('%Y%m%d_%H%M'),
+                    SAMPLE_PRODUCT) for n in range(count)]
+        def per_frame():
+            img_tuples = [anim.img_name_tuple(img) for img in img_list]
+            anim.calc_time_bounds(img_tuples)
+            return [a for a in img_tuples if a[0] >= anim.start_time and a[0] <= anim.end_time]
+        secs, expected = timed(per_frame)
+        report('times img_name_tuple %d frames' %(count), secs, '%d in window' %(len(expected)))
+        def batch():
+            img_tuples = anim.make_img_tuples(img_list)
+            anim.calc_time_bounds(img_tuples)
+            return list(anim.filter_img_tuples(img_tuples))
+        secs, window = timed(batch)
+        assert window == expected, 'frame tuples differ'
+        report('times FrameTuples %d frames' %(count), secs, '%d in window' %(len(window)))
+
+def fill_archive(archive_dir, count):
+    '''
+    Make a FrameArchive of count frames every 5 minutes, cycling through the samples.
+    :return: tuple (seconds taken, FrameArchive)
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    archive = FrameArchive(SAMPLE_STATION, SAMPLE_PRODUCT, archive_dir)
+    t0 = datetime.datetime(2020, 12, 14, 0, 0)
+    secs, _ = timed(lambda: [archive.append(t0 + datetime.timedelta(minutes=5 * n), ims_bytes[n % len(ims_bytes)])
+                             for n in range(count)])
+    return (secs, archive)
+
+def bench_archive(opts):
+    '''
+    A 24 hour loop of 288 frames: decoding the GIFs with imageio against slicing the
+    memory-mapped FrameArchive, and palette_to_rgba of the slices.
+    '''
+    files = sample_files()
+    ims_bytes = [open(f, 'rb').read() for f in files]
+    count = 24 * 12
+    archive_dir = tempfile.mkdtemp(prefix='archive_')
+    try:
+        secs, archive = fill_archive(archive_dir, count)
+        report('archive append %d frames' %(count), secs, '%d MB' %(archive.data.size // (1024 * 1024)))
+        secs, _ = timed(lambda: [imageio.imread(ims_bytes[n % len(ims_bytes)], format='GIF-PIL') for n in range(count)])
+        report('archive imageio.imread %d GIFs' %(count), secs)
+        archive = FrameArchive(SAMPLE_STATION, SAMPLE_PRODUCT, archive_dir)
+        secs, frames = timed(archive.last, 24 * 60)
+        report('archive slice last 24 hours', secs, '%d frames' %(len(frames)))
+        secs, _ = timed(lambda: [f.rgba() for f in frames])
+        report('archive palette_to_rgba %d frames' %(len(frames)), secs)
+    finally:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+
+def bench_timelapse(opts):
+    '''
+    Time-lapse loops of 30 frames from windows of 1 to 24 hours: the time should stay flat as
+    the window grows. For comparison, every frame of the 1 and 3 hour windows is encoded.
+    '''
+    archive_dir = tempfile.mkdtemp(prefix='timelapse_')
+    try:
+        secs, archive = fill_archive(archive_dir, 24 * 12)
+        lapse = TimeLapse(archive)
+        for hours in (1, 3):
+            secs, gif = timed(lapse.render, imageio.RETURN_BYTES, hours * 60, count=10000)
+            report('timelapse all frames %d h' %(hours), secs, '%d frames, %d KB' %(len(lapse.selected), len(gif) // 1024))
+        for hours in (1, 3, 6, 12, 24):
+            secs, gif = timed(lapse.render, imageio.RETURN_BYTES, hours * 60, count=30)
+            report('timelapse even %d h' %(hours), secs, '%d frames, %d KB' %(len(lapse.selected), len(gif) // 1024))
+        for hours in (6, 24):
+            secs, gif = timed(lapse.render, imageio.RETURN_BYTES, hours * 60, count=30, weighted=True)
+            report('timelapse weighted %d h' %(hours), secs, '%d frames, %d KB' %(len(lapse.selected), len(gif) // 1024))
+    finally:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+
+def fill_bucket(root, radars, days, start=datetime.datetime(2019, 5, 10)):
+    '''
+    Make a stand-in of the Level II bucket: empty volume files every 5 minutes.
+    '''
+    for n in range(days):
+        day = start + datetime.timedelta(days=n)
+        for radar in radars:
+            radar_dir = os.path.join(root, day.strftime('%Y'), day.strftime('%m'), day.strftime('%d'), radar)
+            os.makedirs(radar_dir)
+            for minute in range(0, 24 * 60, 5):
+                scan = day + datetime.timedelta(minutes=minute, seconds=26)
+                open(os.path.join(radar_dir, scan.strftime(radar + '%Y%m%d_%H%M%S_V06')), 'wb').close()
+
+def bench_level2(opts):
+    '''
+    Ten historical jobs doing the Tutorial.py queries (years, months, days, radars, scans of 7 hours
+    over a day boundary) against a bucket with the configured latency per listing: a fresh index
+    every job, which lists everything like nexradaws does, against one persistent SQLite index.
+    '''
+    root = tempfile.mkdtemp(prefix='level2_')
+    radars = ('KMUX', 'KDAX', 'KBHX')
+    jobs = 10
+    try:
+        fill_bucket(root, radars, 7)
+        start = datetime.datetime(2019, 5, 12, 20, 0)
+        end = start + datetime.timedelta(hours=7)
+        def job(index):
+            index.get_avail_years()
+            index.get_avail_months('2019')
+            index.get_avail_days('2019', '05')
+            index.get_avail_radars('2019', '05', '12')
+            return index.get_avail_scans_in_range(start, end, 'KMUX')
+        bucket = LocalBucket(root, latency=opts['latency_ms'] / 1000.0)
+        def uncached():
+            return [job(Level2Index(':memory:', bucket)) for n in range(jobs)]
+        secs, results = timed(uncached)
+        report('level2 listing per job', secs / jobs, 'per job, %d listings in total' %(bucket.requests))
+        db_path = os.path.join(root, 'level2_index.sqlite')
+        bucket = LocalBucket(root, latency=opts['latency_ms'] / 1000.0)
+        def persistent():
+            return [job(Level2Index(db_path, bucket)) for n in range(jobs)]
+        secs, indexed = timed(persistent)
+        assert indexed == results and len(results[0]) == 7 * 12, len(results[0])
+        report('level2 Level2Index per job', secs / jobs, 'per job, %d listings in total' %(bucket.requests))
+        index = Level2Index(db_path, bucket)
+        secs, _ = timed(index.get_avail_scans_in_range, start, end, 'KMUX')
+        report('level2 range query, warm index', secs)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def bench_sites(opts):
+    '''
+    Nearest radar of 100000 random locations in the US: a great circle distance to every site
+    per location in Python, against one SiteCatalog.nearest batch.
+    '''
+    catalog = SiteCatalog()
+    rng = np.random.default_rng(1)
+    count = 100000
+    lats = rng.uniform(25, 49, count)
+    lons = rng.uniform(-125, -67, count)
+    sites = list(zip(np.radians(catalog.lats), np.radians(catalog.lons)))
+    def per_location(n):
+        nearest = []
+        for lat, lon in zip(np.radians(lats[:n]).tolist(), np.radians(lons[:n]).tolist()):
+            dists = [math.acos(min(1.0, math.sin(lat) * math.sin(slat) + math.cos(lat) * math.cos(slat) * math.cos(lon - slon)))
+                     for slat, slon in sites]
+            nearest.append(dists.index(min(dists)))
+        return nearest
+    loop_count = 2000
+    secs, expected = timed(per_location, loop_count)
+    report('sites loop %d locations' %(loop_count), secs, '%.1f us per location' %(secs / loop_count * 1e6))
+    secs, (positions, km) = timed(catalog.nearest, lats, lons)
+    assert (positions[:loop_count, 0] == expected).all()
+    report('sites SiteCatalog.nearest %d locations' %(count), secs, '%.1f us per location' %(secs / count * 1e6))
+    secs, _ = timed(catalog.covering, lats[:10000], lons[:10000])
+    report('sites SiteCatalog.covering 10000 locations', secs, '%.1f us per location' %(secs / 10000 * 1e6))
+
+def bench_catalog(opts):
+    '''
+    A FrameCatalog with 30 days of frames of 10 stations (86400 frames): time to record them,
+    and time of the latest-N and time range queries that replace a listing or a directory scan.
+    '''
+    root = tempfile.mkdtemp(prefix='catalog_')
+    try:
+        catalog = FrameCatalog(os.path.join(root, 'frame_catalog.sqlite'))
+        stations = ('MUX', 'ATX', 'RTX', 'OTX', 'PDT', 'MAX', 'BHX', 'DAX', 'BGM', 'ENX')
+        t0 = datetime.datetime(2020, 11, 14, 0, 0)
+        names = [(t0 + datetime.timedelta(minutes=5 * n)).strftime('_%Y%m%d_%H%M_N0R.gif') for n in range(30 * 288)]
+        secs, _ = timed(lambda: [catalog.seen(station, 'N0R', [station + name for name in names]) for station in stations])
+        report('catalog seen %d frames' %(len(names) * len(stations)), secs)
+        queries = 1000
+        secs, _ = timed(lambda: [catalog.latest('MUX', 'N0R', 13) for n in range(queries)])
+        report('catalog latest 13 frames x%d' %(queries), secs, '%.1f us per query' %(secs / queries * 1e6))
+        start = t0 + datetime.timedelta(days=15)
+        secs, rows = timed(lambda: [catalog.frames('MUX', 'N0R', start, start + datetime.timedelta(hours=6)) for n in range(queries)])
+        assert len(rows[0]) == 73, len(rows[0])
+        report('catalog 6 hour range x%d' %(queries), secs, '%.1f us per query' %(secs / queries * 1e6))
+        catalog.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def bench_splice(opts):
+    '''
+    Assembling the 13 sample frames: decode to RGBA and encode with imageio, against splicing
+    the frame bytes. Also checks that the spliced frames have the pixels of the samples.
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    secs, encoded = timed(encode_animation, SAMPLE_STATION, ims_bytes, imageio.RETURN_BYTES)
+    report('splice decode and encode %d frames' %(len(ims_bytes)), secs, '%d KB' %(len(encoded) // 1024))
+    secs, spliced = timed(encode_animation, SAMPLE_STATION, ims_bytes, imageio.RETURN_BYTES, True)
+    report('splice splice_gif %d frames' %(len(ims_bytes)), secs, '%d KB' %(len(spliced) // 1024))
+    frames = imageio.mimread(spliced, format='GIF-PIL')
+    assert all([np.array_equal(im, imageio.imread(b, format='GIF-PIL')) for im, b in zip(frames, ims_bytes)])
+
+def bench_rolling(opts):
+    '''
+    Refreshing an animation when one frame arrives and the oldest one leaves, for windows of
+    13 and 130 frames: splice and write the whole window, against RollingGif, which copies
+    the blocks it keeps from the published file and splices the new frame. Then a refresh by
+    AsyncRadarEngine with one new frame in the listing, with and without rolling.
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    refreshes = 10
+    out_dir = tempfile.mkdtemp(prefix='rolling_')
+    try:
+        for window in (len(ims_bytes), 10 * len(ims_bytes)):
+            names = ['frame_%04d.gif' %(n) for n in range(window + refreshes)]
+            frames = dict([(name, ims_bytes[n % len(ims_bytes)]) for n, name in enumerate(names)])
+            full_out = os.path.join(out_dir, 'full_%d.gif' %(window))
+            def full():
+                for lo in range(1, refreshes + 1):
+                    publish_atomic(full_out, splice_gif([frames[name] for name in names[lo:lo + window]], FRAME_DURATION))
+            publish_atomic(full_out, splice_gif([frames[name] for name in names[:window]], FRAME_DURATION))
+            secs, retval = timed(full)
+            report('rolling splice %d frames' %(window), secs / refreshes, 'per refresh')
+            rolling_out = os.path.join(out_dir, 'rolling_%d.gif' %(window))
+            RollingGif(rolling_out, FRAME_DURATION).update(names[:window], frames)
+            def rolling():
+                for lo in range(1, refreshes + 1):
+                    rolling_gif = RollingGif(rolling_out, FRAME_DURATION)
+                    window_names = names[lo:lo + window]
+                    kept = rolling_gif.retained(window_names)
+                    rolling_gif.update(window_names, dict([(name, frames[name]) for name in window_names if name not in kept]))
+                return rolling_gif
+            secs, rolling_gif = timed(rolling)
+            report('rolling RollingGif %d frames' %(window), secs / refreshes,
+                   'per refresh, %d blocks copied, %d added' %(rolling_gif.copied, rolling_gif.added))
+            assert sum([len(block['names']) for block in rolling_gif.index['blocks']]) == window
+        # a refresh through AsyncRadarEngine when one frame is new: only that frame is fetched
+        base_url = RadarAnimator.img_base_url
+        names = [os.path.basename(f) for f in sample_files()]
+        try:
+            with RidgeServer(connect_ms=opts['connect_ms'], latency_ms=opts['latency_ms']) as srv:
+                RadarAnimator.img_base_url = srv.base_url
+                for rolling in (False, True):
+                    anim_out = os.path.join(out_dir, 'engine_%s.gif' %(rolling))
+                    RollingGif(anim_out, FRAME_DURATION).update(names[:-1], dict(zip(names, ims_bytes)))
+                    engine = AsyncRadarEngine(SAMPLE_STATION, splice=True, rolling=rolling)
+                    secs, retval = timed(engine.run, anim_out)
+                    report('rolling engine refresh, rolling=%s' %(rolling), secs,
+                           'fetch %.3f s, encode %.3f s' %(engine.timings['fetch'], engine.timings['encode']))
+        finally:
+            RadarAnimator.img_base_url = base_url
+    finally:
+        shutil.rmtree(out_dir)
+
+def decode_frames(gif_bytes):
+    '''
+    Decode every frame of an animation to RGBA with Pillow, as a viewer does.
+    :return: list of arrays, one per frame shown, repeated for the frames that are shown longer.
+    '''
+    from PIL import Image, ImageSequence
+    frames = []
+    for im in ImageSequence.Iterator(Image.open(io.BytesIO(gif_bytes))):
+        frames += [np.asarray(im.convert('RGBA'))] * max(1, int(round(im.info['duration'] / (FRAME_DURATION * 1000))))
+    return frames
+
+def bench_delta(opts):
+    '''
+    The 13 sample frames encoded by imageio (mimwrite), spliced whole, and with only the changed
+    rectangle of every frame (gif_delta.py): size, encoding time and the time to decode all the
+    frames, which is what a viewer pays. Pillow can not read back the imageio output, so its
+    decode time is not measured. Also checks that every delta frame shows the source pixels.
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    secs, encoded = timed(encode_animation, SAMPLE_STATION, ims_bytes, imageio.RETURN_BYTES)
+    report('delta mimwrite encode', secs, '%d KB' %(len(encoded) // 1024))
+    secs, spliced = timed(splice_gif, ims_bytes, FRAME_DURATION)
+    report('delta splice_gif encode', secs, '%d KB' %(len(spliced) // 1024))
+    secs, delta = timed(delta_gif, ims_bytes, FRAME_DURATION)
+    report('delta delta_gif encode', secs, '%d KB, %.0f%% of mimwrite' %(len(delta) // 1024, 100.0 * len(delta) / len(encoded)))
+    secs, full_frames = timed(decode_frames, spliced)
+    report('delta decode full frames', secs)
+    secs, delta_frames = timed(decode_frames, delta)
+    report('delta decode delta frames', secs)
+    assert len(delta_frames) == len(full_frames)
+    for a, b in zip(delta_frames, full_frames):
+        assert ((a == b).all(axis=2) | ((a[..., 3] == 0) & (b[..., 3] == 0))).all()
+
+def bench_formats(opts):
+    '''
+    The 13 sample frames as GIF (imageio mimwrite, splice_gif, delta_gif), lossless animated WebP
+    and APNG: size, encoding time and Pillow decode time of all frames. Checks that every visible
+    pixel of the WebP and APNG frames has the color of the source frame.
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    secs, encoded = timed(encode_animation, SAMPLE_STATION, ims_bytes, imageio.RETURN_BYTES)
+    report('formats gif mimwrite', secs, '%d KB, not readable by Pillow' %(len(encoded) // 1024))
+    source = [np.asarray(im) for im in decode_frames(splice_gif(ims_bytes, FRAME_DURATION))]
+    for name, encode in (('gif splice_gif', splice_gif), ('gif delta_gif', delta_gif),
+                         ('webp lossless', encode_webp), ('apng', encode_apng)):
+        secs, anim_bytes = timed(encode, ims_bytes, FRAME_DURATION)
+        decode_secs, frames = timed(decode_frames, anim_bytes)
+        report('formats %s' %(name), secs, '%d KB, %.0f%% of mimwrite, decode %.3f s' %(
+               len(anim_bytes) // 1024, 100.0 * len(anim_bytes) / len(encoded), decode_secs))
+        assert len(frames) == len(source)
+        for a, b in zip(frames, source):
+            assert ((a == b).all(axis=2) | ((a[..., 3] == 0) & (b[..., 3] == 0))).all()
+
+def bench_outputs(opts):
+    '''
+    GIF, WebP, APNG and thumbnail outputs of the 13 sample frames: one run per format, each
+    decoding the frames, one decode for all formats in one process, and radar_outputs.write_outputs,
+    which decodes once and encodes the outputs in parallel processes. Checks that the GIF and WebP are the bytes that delta_gif
+    and encode_webp write. MP4 is added when imageio-ffmpeg is installed.
+    '''
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    outputs = ['gif', 'webp', 'apng', 'thumb']
+    try:
+        import imageio_ffmpeg
+        outputs.append('mp4')
+    except ImportError:
+        report('outputs mp4', 0.0, 'skipped, imageio-ffmpeg is not installed')
+    singles = {'gif': delta_gif, 'webp': encode_webp, 'apng': encode_apng}
+    out_dir = tempfile.mkdtemp(prefix='outputs_')
+    try:
+        paths = output_paths(os.path.join(out_dir, 'radar_anim.gif'), outputs)
+        def one_per_format():
+            for output, encode in singles.items():
+                publish_atomic(paths[output], encode(ims_bytes, FRAME_DURATION))
+        secs, retval = timed(one_per_format)
+        report('outputs one run per format', secs, ', '.join(singles))
+        single_bytes = dict([(output, open(paths[output], 'rb').read()) for output in singles])
+        def decode_once():
+            frames = palette_frames(ims_bytes, FRAME_DURATION)
+            for output in singles:
+                publish_atomic(paths[output], OUTPUT_ENCODERS[output](*frames))
+        secs, retval = timed(decode_once)
+        report('outputs decode once, one process', secs, ', '.join(singles))
+        with ProcessPoolExecutor(max_workers=len(outputs)) as pool:
+            # start the workers first, as a long-running batch would have them
+            list(pool.map(abs, range(len(outputs))))
+            secs, results = timed(write_outputs, ims_bytes, paths['gif'], outputs, FRAME_DURATION, pool)
+        report('outputs write_outputs', secs, '%d CPUs; ' %(os.cpu_count()) + ', '.join(
+               ['%s %d KB %.3f s' %(r['output'], r['size'] // 1024, r['secs']) for r in results]))
+        for output in ('gif', 'webp'):
+            assert open(paths[output], 'rb').read() == single_bytes[output]
+        assert len(decode_frames(open(paths['thumb'], 'rb').read())) == len(decode_frames(single_bytes['gif']))
+    finally:
+        shutil.rmtree(out_dir)
+
+BENCHMARKS = {
+    'fetch': bench_fetch,
+    'hedge': bench_hedge,
+    'sched': bench_sched,
+    'batch': bench_batch,
+    'listing': bench_listing,
+    'times': bench_times,
+    'archive': bench_archive,
+    'timelapse': bench_timelapse,
+    'products': bench_products,
+    'level2': bench_level2,
+    'sites': bench_sites,
+    'catalog': bench_catalog,
+    'splice': bench_splice,
+    'rolling': bench_rolling,
+    'delta': bench_delta,
+    'formats': bench_formats,
+    'outputs': bench_outputs,
+}
+
+def main(names=None, connect_ms=CONNECT_MS, latency_ms=LATENCY_MS):
+    opts = {'connect_ms': connect_ms, 'latency_ms': latency_ms}
+    for name in (names or list(BENCHMARKS.keys())):
+        print('== %s' %(name))
+        BENCHMARKS[name](opts)
+
+if __name__== "__main__":
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hc:l:'
+    longOpts  = ['help', 'connect=', 'latency=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    connect_ms = CONNECT_MS
+    latency_ms = LATENCY_MS
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-c','--connect'):
+            connect_ms = float(val)
+        elif arg in ('-l','--latency'):
+            latency_ms = float(val)
+    main(names=values, connect_ms=connect_ms, latency_ms=latency_ms)
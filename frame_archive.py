@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Append-only, memory-mapped archive of radar frames, for history beyond the NWS retention.
+
+NWS keeps the images for about one hour, so nws_radar_gif can never animate more than its
+70 minute window. The archive keeps every frame that was fetched, per station and product:
+* <STATION>_<PRODUCT>.<generation>.dat holds, for each frame, its 256 entry RGB palette and
+  its palette-index pixels, one byte per pixel, exactly as in the GIF.
+* <STATION>_<PRODUCT>.idx is a header and one fixed-size record per frame (time, offset in the
+  data file, size, transparent index, echo weight, hash of the palette and pixels), sorted by
+  time. The echo weight, the fraction of pixels with echoes, is computed when the frame is
+  added, so radar_timelapse.py can weigh a whole window from the index alone.
+  A frame with the same pixels as a frame already in the archive, e.g., one that NWS republished
+  under a new timestamp, only gets a record that points to the data of the first one.
+  A frame that arrives late, after newer frames were archived (a build that hit its deadline),
+  is put in its place in time: the index is rewritten with its record inserted and renamed over
+  the old one.
+Both files are read with mmap, so a 24 hour loop (about 300 frames) is a binary search on the
+record times and a slice of the data file: no GIF is decoded and nothing is read into memory
+until the pixels are used.
+Frames older than max_age are no longer returned. Once they take more than half of the data
+file, compact() writes the live frames to a new generation and switches the index to it with a
+rename. On Linux a reader that already has the old files mapped is not disturbed, and a reader
+that opens the files while compact() removes the old data file reads the new index again.
+Windows can not rename over or remove a file that is mapped, so the archive drops its own maps
+before it does (unmap). If another process has the index mapped, the rewrite is given up: a late
+frame is left out, and the compaction is done by a later append. A data file of an old generation
+that is still mapped is removed by a later compact().
+The archive has one writer at a time, the build that holds the BuildLock of the station.
+
+Usage: python frame_archive.py -s MUX [-a radar_archive] [-k]
+'''
+
+ARCHIVE_DIR='radar_archive'
+ARCHIVE_MAX_AGE=24*60   # minutes of frames kept, counted back from the newest
+PALETTE_BYTES=256*3
+WEIGHT_STEP=16          # echo weight sampled on every 16th row and column
+WEIGHT_SCALE=65535      # the echo weight is stored as a 16 bit fraction; 0 means not computed
+REFRESH_RETRIES=3       # times refresh reads the index again if its data file was just compacted away
+
+import io
+import os
+import datetime as dt
+
+import numpy as np
+from PIL import Image
+
+from frame_index import frame_digest, DIGEST_SIZE
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+INDEX_MAGIC=b'RADARIDX'
+INDEX_VERSION=1
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('generation', '<u4')])
+RECORD = np.dtype([('time', '<i8'),         # minutes since the epoch
+                   ('offset', '<i8'),       # of the palette in the data file; the pixels follow it
+                   ('width', '<u2'),
+                   ('height', '<u2'),
+                   ('transparency', '<i2'), # palette index of transparent pixels, -1 for none
+                   ('weight', '<u2'),       # echo fraction * WEIGHT_SCALE, at least 1; 0 in older archives
+                   ('digest', 'S%d' %(DIGEST_SIZE))])
+
+def decode_palette_frame(img_bytes):
+    '''
+    Decode a GIF to its palette and palette indices.
+    :param img_bytes: GIF bytes of a frame.
+    :return: tuple (indices as HxW uint8 array, palette as 256x3 uint8 array, transparent index or -1)
+    '''
+    im = Image.open(io.BytesIO(img_bytes))
+    if im.mode != 'P':
+        im = im.convert('RGB').quantize(256)
+    palette = np.zeros(PALETTE_BYTES, dtype=np.uint8)
+    colors = np.array(im.getpalette()[:PALETTE_BYTES], dtype=np.uint8)
+    palette[:len(colors)] = colors
+    transparency = im.info.get('transparency', -1)
+    if not isinstance(transparency, int):
+        transparency = -1
+    indices = np.frombuffer(im.tobytes(), dtype=np.uint8).reshape(im.size[1], im.size[0])
+    return (indices, palette.reshape(256, 3), transparency)
+
+def palette_to_rgba(indices, palette, transparency=-1):
+    '''
+    :return: HxWx4 uint8 array, like imageio.imread of the GIF.
+    '''
+    lut = np.full((256, 4), 255, dtype=np.uint8)
+    lut[:, :3] = palette
+    if transparency >= 0:
+        lut[transparency, 3] = 0
+    # one 32 bit lookup per pixel is much faster than indexing the 256x4 table
+    rgba = lut.view(np.uint32).reshape(256)[indices]
+    return rgba.view(np.uint8).reshape(indices.shape + (4,))
+
+def echo_fraction(indices, transparency, step=WEIGHT_STEP):
+    '''
+    :param indices: HxW palette indices of a frame.
+    :param transparency: transparent palette index, or -1.
+    :return: fraction of echo (not background) pixels on a grid of every step-th row and column.
+    '''
+    sample = indices[::step, ::step]
+    background = transparency if transparency >= 0 else 0
+    return float(np.count_nonzero(sample != background)) / sample.size
+
+def minutes_of(frame_time):
+    '''
+    :param frame_time: datetime or datetime64.
+    :return: minutes since the epoch, as stored in the records.
+    '''
+    return int(np.datetime64(frame_time, 'm').astype(np.int64))
+
+class ArchiveFrame:
+    '''
+    One frame of the archive. The arrays are views of the memory-mapped data file.
+    '''
+    def __init__(self, time, indices, palette, transparency, digest):
+        self.time = time            # datetime
+        self.indices = indices      # HxW uint8
+        self.palette = palette      # 256x3 uint8
+        self.transparency = transparency
+        self.digest = digest
+
+    def rgba(self):
+        return palette_to_rgba(self.indices, self.palette, self.transparency)
+
+class FrameArchive:
+    '''
+    Archive of one station and product.
+    '''
+    def __init__(self, station, product, archive_dir=ARCHIVE_DIR, max_age=ARCHIVE_MAX_AGE):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param product: product code, e.g., "N0R"
+        :param archive_dir: directory of the archive files. Created if it does not exist.
+        :param max_age: minutes of history kept. None to keep every frame.
+        '''
+        self.station = station.upper()
+        self.product = product.upper()
+        self.archive_dir = archive_dir
+        self.max_age = max_age
+        os.makedirs(archive_dir, exist_ok=True)
+        self.index_path = os.path.join(archive_dir, '%s_%s.idx' %(self.station, self.product))
+        self.records = np.zeros(0, dtype=RECORD)
+        self.data = np.zeros(0, dtype=np.uint8)
+        self.generation = 0
+        self.mapped = (None, 0, 0)  # (generation, index size, data size) of the maps
+        self.dedups = 0     # frames added that point to the data of an identical frame
+        if not os.path.exists(self.index_path):
+            self.write_index(self.index_path, 0, np.zeros(0, dtype=RECORD))
+        self.refresh()
+
+    def data_path(self, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.archive_dir, '%s_%s.%d.dat' %(self.station, self.product, generation))
+
+    def write_index(self, path, generation, records):
+        header = np.zeros(1, dtype=HEADER)
+        header[0] = (INDEX_MAGIC, INDEX_VERSION, generation)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(records.tobytes())
+        open(self.data_path(generation), 'ab').close()
+
+    def unmap(self):
+        '''
+        Drop the maps of the index and the data file, before they are replaced or removed.
+        A map is closed once no ArchiveFrame uses it any more.
+        '''
+        self.records = np.zeros(0, dtype=RECORD)
+        self.data = np.zeros(0, dtype=np.uint8)
+        self.mapped = (None, 0, 0)
+
+    def replace_index(self, tmp_path):
+        '''
+        Rename tmp_path over the index and map the files again.
+        :return: True if the index was replaced. False if another process has it mapped (Windows),
+            then tmp_path is removed and the index is unchanged.
+        '''
+        self.unmap()
+        try:
+            os.replace(tmp_path, self.index_path)
+            return True
+        except PermissionError as err:
+            logger.debug('replace_index: %s is in use (%s)' %(self.index_path, repr(err)))
+            os.remove(tmp_path)
+            return False
+        finally:
+            self.refresh()
+
+    def remove_old_data(self):
+        '''
+        Remove the data files of older generations. One that is still mapped (Windows) is left
+        for the next call.
+        :return: number of files removed.
+        '''
+        removed = 0
+        prefix = '%s_%s.' %(self.station, self.product)
+        for fname in os.listdir(self.archive_dir):
+            parts = fname[len(prefix):].split('.')
+            if not fname.startswith(prefix) or len(parts) != 2 or parts[1] != 'dat' or not parts[0].isdigit():
+                continue
+            if int(parts[0]) < self.generation:
+                try:
+                    os.remove(os.path.join(self.archive_dir, fname))
+                    removed += 1
+                except OSError as err:
+                    logger.debug('remove_old_data: %s kept (%s)' %(fname, repr(err)))
+        return removed
+
+    def refresh(self):
+        '''
+        Map the files again if another process (or this one) has appended or compacted.
+        '''
+        for attempt in range(REFRESH_RETRIES):
+            try:
+                return self.map_files()
+            except FileNotFoundError:
+                # compact() removed the data file named by the header we read: the index has
+                # been replaced by then, and names the new generation
+                if attempt == REFRESH_RETRIES - 1:
+                    raise
+                logger.debug('refresh: %s changed generation, reading it again' %(self.index_path))
+
+    def map_files(self):
+        '''
+        The work of refresh: read the header and map the index and the data file of its generation.
+        '''
+        header = np.fromfile(self.index_path, dtype=HEADER, count=1)
+        if len(header) != 1 or header[0]['magic'] != INDEX_MAGIC or header[0]['version'] != INDEX_VERSION:
+            raise IOError('FrameArchive: %s is not a frame archive index' %(self.index_path))
+        self.generation = int(header[0]['generation'])
+        index_size = os.path.getsize(self.index_path)
+        data_size = os.path.getsize(self.data_path())
+        if self.mapped == (self.generation, index_size, data_size):
+            return
+        count = (index_size - HEADER.itemsize) // RECORD.itemsize
+        self.records = np.memmap(self.index_path, dtype=RECORD, mode='r', offset=HEADER.itemsize,
+                                 shape=(count,)) if count else np.zeros(0, dtype=RECORD)
+        self.data = np.memmap(self.data_path(), dtype=np.uint8, mode='r') if data_size else np.zeros(0, dtype=np.uint8)
+        self.mapped = (self.generation, index_size, data_size)
+
+    def __len__(self):
+        return len(self.records) - self.first_live()
+
+    def newest(self):
+        '''
+        :return: datetime of the newest frame, or None.
+        '''
+        if not len(self.records):
+            return None
+        return np.datetime64(int(self.records[-1]['time']), 'm').astype(object)
+
+    def first_live(self):
+        '''
+        :return: position of the oldest record within max_age of the newest.
+        '''
+        if self.max_age is None or not len(self.records):
+            return 0
+        cutoff = int(self.records[-1]['time']) - self.max_age
+        return int(np.searchsorted(self.records['time'], cutoff, side='left'))
+
+    def append(self, frame_time, img_bytes):
+        '''
+        Add a frame. A frame older than the newest one is inserted in time order. Frames whose
+        time is already in the archive, or that are older than max_age, are ignored.
+        :param frame_time: datetime of the frame.
+        :param img_bytes: GIF bytes of the frame.
+        :return: True if the frame was added.
+        '''
+        self.refresh()
+        minutes = minutes_of(frame_time)
+        pos = int(np.searchsorted(self.records['time'], minutes, side='left'))
+        if pos < len(self.records) and int(self.records[pos]['time']) == minutes:
+            return False
+        if self.max_age is not None and len(self.records) and minutes < int(self.records[-1]['time']) - self.max_age:
+            return False
+        indices, palette, transparency = decode_palette_frame(img_bytes)
+        digest = frame_digest(palette.tobytes() + indices.tobytes())
+        offset = self.find_data(digest)
+        if offset is None:
+            with open(self.data_path(), 'ab') as f:
+                offset = f.tell()
+                f.write(palette.tobytes())
+                f.write(indices.tobytes())
+        else:
+            self.dedups += 1
+        record = np.zeros(1, dtype=RECORD)
+        weight = max(1, int(round(echo_fraction(indices, transparency) * WEIGHT_SCALE)))
+        record[0] = (minutes, offset, indices.shape[1], indices.shape[0], transparency, weight, digest)
+        # the data is written before its record, so a record always points to complete data
+        if pos == len(self.records):
+            with open(self.index_path, 'ab') as f:
+                f.write(record.tobytes())
+        else:
+            logger.debug('append: %s %s late frame %s inserted before %d newer frames' %(
+                self.station, self.product, str(frame_time), len(self.records) - pos))
+            records = np.concatenate([np.array(self.records[:pos], dtype=RECORD), record,
+                                      np.array(self.records[pos:], dtype=RECORD)])
+            tmp_path = self.index_path + '.tmp'
+            self.write_index(tmp_path, self.generation, records)
+            if not self.replace_index(tmp_path):
+                # the data written above is left unused
+                return False
+        self.refresh()
+        if self.dead_bytes() > self.data.size // 2:
+            self.compact()
+        return True
+
+    def find_data(self, digest):
+        '''
+        :param digest: hash of the palette and pixels of a frame.
+        :return: offset of the live data with this hash, or None.
+        '''
+        first = self.first_live()
+        same = np.nonzero(self.records['digest'][first:] == digest)[0]
+        return int(self.records[first + same[-1]]['offset']) if len(same) else None
+
+    def frame(self, pos):
+        '''
+        :param pos: position of the record.
+        :return: ArchiveFrame
+        '''
+        rec = self.records[pos]
+        offset = int(rec['offset'])
+        width, height = int(rec['width']), int(rec['height'])
+        palette = self.data[offset:offset + PALETTE_BYTES].reshape(256, 3)
+        indices = self.data[offset + PALETTE_BYTES:offset + PALETTE_BYTES + width * height].reshape(height, width)
+        return ArchiveFrame(np.datetime64(int(rec['time']), 'm').astype(object), indices, palette,
+                            int(rec['transparency']), bytes(rec['digest']))
+
+    def echo_fractions(self, lo, hi):
+        '''
+        :return: array of the echo fractions of the records lo to hi, from the index. Only
+            records written before the weight was stored are read from the data file.
+        '''
+        weights = np.array(self.records['weight'][lo:hi], dtype=np.float64) / WEIGHT_SCALE
+        for n in np.nonzero(weights == 0)[0]:
+            frame = self.frame(lo + int(n))
+            weights[n] = echo_fraction(frame.indices, frame.transparency)
+        return weights
+
+    def range_bounds(self, start_time, end_time):
+        '''
+        :return: tuple (lo, hi) of record positions of the frames in [start_time, end_time]
+        '''
+        self.refresh()
+        times = self.records['time']
+        lo = max(self.first_live(), int(np.searchsorted(times, minutes_of(start_time), side='left')))
+        hi = int(np.searchsorted(times, minutes_of(end_time), side='right'))
+        return (lo, max(lo, hi))
+
+    def frames(self, start_time, end_time):
+        '''
+        :return: list of ArchiveFrame in [start_time, end_time], oldest first.
+        '''
+        lo, hi = self.range_bounds(start_time, end_time)
+        return [self.frame(pos) for pos in range(lo, hi)]
+
+    def last(self, minutes):
+        '''
+        :return: list of ArchiveFrame of the last minutes before the newest frame.
+        '''
+        newest = self.newest()
+        if newest is None:
+            return []
+        return self.frames(newest - dt.timedelta(minutes=minutes), newest)
+
+    def dead_bytes(self):
+        '''
+        :return: bytes of the data file used by frames older than max_age.
+        '''
+        first = self.first_live()
+        if first == 0:
+            return 0
+        if first >= len(self.records):
+            return self.data.size
+        # a live record may point to the data of an older, identical frame
+        return int(self.records['offset'][first:].min())
+
+    def compact(self):
+        '''
+        Write the frames within max_age to a new generation of the data file and drop the rest.
+        :return: number of frames dropped.
+        '''
+        self.refresh()
+        first = self.first_live()
+        if first == 0:
+            return 0
+        generation = self.generation + 1
+        records = np.array(self.records[first:], dtype=RECORD)
+        start = int(records['offset'].min()) if len(records) else self.data.size
+        with open(self.data_path(generation), 'wb') as f:
+            f.write(self.data[start:].tobytes())
+        records['offset'] -= start
+        tmp_path = self.index_path + '.tmp'
+        self.write_index(tmp_path, generation, records)
+        if not self.replace_index(tmp_path):
+            os.remove(self.data_path(generation))
+            return 0
+        self.remove_old_data()
+        logger.debug('compact: %s %s dropped %d frames, kept %d' %(self.station, self.product, first, len(records)))
+        return first
+
+def archive_frames(archive, img_tuples, ims_bytes, catalog=None):
+    '''
+    Add the frames of a build that are not in the archive yet.
+    :param img_tuples: image tuples of the frames, oldest first.
+    :param ims_bytes: their GIF bytes; None for a frame that could not be fetched.
+    :param catalog: optional FrameCatalog, the added frames are marked as archived in it.
+    :return: number of frames added.
+    '''
+    added = []
+    for img_tuple, img_bytes in zip(img_tuples, ims_bytes):
+        if img_bytes is not None and archive.append(img_tuple[0], img_bytes):
+            added.append(img_tuple[2])
+    if catalog is not None and added:
+        catalog.archived(archive.station, archive.product, added)
+    return len(added)
+
+def main(station='MUX', product='N0R', archive_dir=ARCHIVE_DIR, compact=False):
+    archive = FrameArchive(station, product, archive_dir)
+    if compact:
+        print('dropped %d frames' %(archive.compact()))
+    lo = archive.first_live()
+    print('%s %s: %d frames, %d bytes of data, generation %d' %(
+          archive.station, archive.product, len(archive), archive.data.size, archive.generation))
+    if len(archive):
+        print('oldest %s, newest %s' %(archive.frame(lo).time, archive.newest()))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hs:p:a:k'
+    longOpts  = ['help', 'station=', 'product=', 'archive=', 'compact']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    station = 'MUX'
+    product = 'N0R'
+    archive_dir = ARCHIVE_DIR
+    compact = False
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-s','--station'):
+            station = val
+        elif arg in ('-p','--product'):
+            product = val
+        elif arg in ('-a','--archive'):
+            archive_dir = val
+        elif arg in ('-k','--compact'):
+            compact = True
+    main(station=station, product=product, archive_dir=archive_dir, compact=compact)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Persistent on-disk cache of NWS RIDGE radar frames.
+
+nws_radar_gif is run from cron every 10 minutes, but only one or two new frames are published
+between runs. The frames that were already downloaded are kept here so that a run only has
+to request the images it has not seen before.
+Frames are stored as the original GIF bytes, one file per frame:
+    <cache_dir>/<STATION>/<PRODUCT>/<RIDGE filename>, e.g., radar_cache/MUX/N0R/MUX_20190519_0446_N0R.gif
+NWS only keeps about one hour of images, so cached frames older than that are evicted.
+The cache also remembers what the last run saw of the station directory listing (ETag,
+Last-Modified and newest filename), for each output built from it, in
+<cache_dir>/<STATION>/<PRODUCT>/listing_<hash of the output>.json.
+Frames are hashed when they are stored. The bytes are kept once per content hash in
+<cache_dir>/objects/, and the frame files are hard links to them, so a frame that NWS republishes
+under a new timestamp, or the same frame stored by several runs, takes the disk space only once.
+An object is removed when no frame links to it any more. Where hard links are not supported,
+each frame file is a copy.
+'''
+
+CACHE_DIR='radar_cache'
+CACHE_MAX_AGE=70        # minutes, same as the default RadarAnimator time window
+CACHE_MAX_BYTES=64*1024*1024    # RIDGE GIFs are 10 to 40 KB each
+OBJECTS_DIR='objects'
+
+import os
+import json
+import errno
+import tempfile
+import datetime as dt
+
+from frame_index import frame_digest
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+# os.link errors that mean the file system cannot link the object: store a copy
+LINK_UNSUPPORTED=(errno.EPERM, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK)
+
+def parse_frame_name(imgfile):
+    '''
+    Split a RIDGE filename into its parts.
+    Filenames look like: MUX_20201214_2339_N0R.gif
+    :param imgfile: a filename from NWS radar.
+    :return: tuple (station, datetime, product)
+    '''
+    img_parse = os.path.splitext(os.path.basename(imgfile))[0].split('_')
+    dtobj = dt.datetime.strptime(img_parse[1] + img_parse[2], '%Y%m%d%H%M')
+    return (img_parse[0].upper(), dtobj, img_parse[3].upper())
+
+class FrameCache:
+    '''
+    Directory of radar GIF frames, keyed by station, product and RIDGE filename.
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, max_age=CACHE_MAX_AGE, max_bytes=CACHE_MAX_BYTES):
+        '''
+        :param cache_dir: top directory of the cache. Created if it does not exist.
+        :param max_age: minutes of history to keep, counted back from the newest frame of a station.
+        :param max_bytes: upper limit of the total cache size. Oldest frames are removed first.
+        '''
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.dedups = 0     # frames stored that were already in the cache under another name
+
+    def frame_dir(self, station, product):
+        return os.path.join(self.cache_dir, station.upper(), product.upper())
+
+    def frame_path(self, station, product, imgfile):
+        return os.path.join(self.frame_dir(station, product), os.path.basename(imgfile))
+
+    def object_path(self, digest):
+        '''
+        :param digest: content hash of a frame, from frame_index.frame_digest
+        :return: path of the bytes with that hash.
+        '''
+        name = digest.hex()
+        return os.path.join(self.cache_dir, OBJECTS_DIR, name[:2], name + '.gif')
+
+    def has(self, station, product, imgfile):
+        return os.path.isfile(self.frame_path(station, product, imgfile))
+
+    def get(self, station, product, imgfile):
+        '''
+        :param station: radar station name, e.g., "MUX"
+        :param product: RIDGE product, e.g., "N0R"
+        :param imgfile: RIDGE filename of the frame.
+        :return: GIF bytes, or None if the frame is not in the cache.
+        '''
+        try:
+            with open(self.frame_path(station, product, imgfile), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, station, product, imgfile, data):
+        '''
+        Store the GIF bytes of one frame.
+        The files are written under a temporary name and renamed, so that a concurrent run
+        never reads a partial frame.
+        :return: path of the cached frame.
+        '''
+        fdir = self.frame_dir(station, product)
+        os.makedirs(fdir, exist_ok=True)
+        fpath = self.frame_path(station, product, imgfile)
+        opath = self.object_path(frame_digest(data))
+        if os.path.exists(opath):
+            self.dedups += 1
+        else:
+            os.makedirs(os.path.dirname(opath), exist_ok=True)
+            self.write_new(opath, data)
+        # a unique name that does not exist, so the link or copy never goes through an old file
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(fpath) + '.', suffix='.tmp', dir=fdir)
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            try:
+                os.link(opath, tmp_path)
+                # the object may be old: make the frame count as just written for trim
+                os.utime(tmp_path)
+            except OSError as err:
+                # ENOENT: another run removed the object as an orphan since we checked it
+                if err.errno not in LINK_UNSUPPORTED and err.errno != errno.ENOENT:
+                    raise
+                # no hard links on this file system: store a copy
+                with open(tmp_path, 'xb') as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, fpath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return fpath
+
+    def write_new(self, path, data):
+        '''
+        Write data to path under a unique temporary name and rename it.
+        '''
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # mkstemp makes the file private
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def listing_path(self, station, product, output):
+        '''
+        :param output: string that identifies an output, e.g., its absolute path and format.
+        :return: path of the listing state of that output.
+        '''
+        name = 'listing_%s.json' %(frame_digest(output.encode())[:8].hex())
+        return os.path.join(self.frame_dir(station, product), name)
+
+    def load_listing_state(self, station, product, output):
+        '''
+        :param output: string that identifies the output, as for save_listing_state.
+        :return: dict saved by save_listing_state for output, empty if there is none.
+        '''
+        try:
+            with open(self.listing_path(station, product, output)) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        # a hash collision is harmless, but must not make another output look done
+        return state if state.get('output') == output else {}
+
+    def save_listing_state(self, station, product, output, state):
+        '''
+        :param output: string that identifies the output built from the listing. Each output has
+            its own state, so that building one output never makes another one look up to date.
+        :param state: dict with the listing validators, e.g., {'etag':..., 'last_modified':..., 'newest':...}
+        '''
+        fdir = self.frame_dir(station, product)
+        os.makedirs(fdir, exist_ok=True)
+        fpath = self.listing_path(station, product, output)
+        state = dict(state, output=output)
+        tmp_path = '%s.%d.tmp' %(fpath, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, fpath)
+
+    def list_frames(self, station, product):
+        '''
+        :return: sorted list of RIDGE filenames cached for station and product.
+        '''
+        fdir = self.frame_dir(station, product)
+        if not os.path.isdir(fdir):
+            return []
+        return sorted([f for f in os.listdir(fdir) if f.endswith('.gif')])
+
+    def evict(self, station, product, newest=None, catalog=None):
+        '''
+        Remove frames that NWS no longer keeps, then trim the whole cache to max_bytes.
+        :param newest: datetime of the most recent frame. Default is the newest cached frame.
+        :param catalog: optional FrameCatalog, whose locations of the removed frames are cleared.
+        :return: number of files removed.
+        '''
+        removed_paths = []
+        frames = self.list_frames(station, product)
+        if frames:
+            if newest is None:
+                newest = parse_frame_name(frames[-1])[1]
+            oldest = newest - dt.timedelta(minutes=self.max_age)
+            for imgfile in frames:
+                if parse_frame_name(imgfile)[1] < oldest:
+                    fpath = self.frame_path(station, product, imgfile)
+                    os.remove(fpath)
+                    removed_paths.append(fpath)
+        self.trim(removed_paths)
+        if removed_paths:
+            self.remove_orphans()
+            logger.debug('evict: %s/%s removed %d frames' %(station, product, len(removed_paths)))
+            if catalog is not None:
+                catalog.evicted(removed_paths)
+        return len(removed_paths)
+
+    def trim(self, removed_paths=None):
+        '''
+        Remove the least recently written frames until the cache is below max_bytes.
+        Frames that share their bytes are counted once.
+        :param removed_paths: optional list, the paths of the removed files are appended to it.
+        :return: number of files removed.
+        '''
+        files = []
+        total = 0
+        inodes = set()
+        for root, dirs, fnames in os.walk(self.cache_dir):
+            if root == self.cache_dir and OBJECTS_DIR in dirs:
+                dirs.remove(OBJECTS_DIR)
+            for fname in fnames:
+                if not fname.endswith('.gif'):
+                    continue
+                fpath = os.path.join(root, fname)
+                st = os.stat(fpath)
+                files.append((st.st_mtime, st.st_size, fpath))
+                if (st.st_dev, st.st_ino) not in inodes or st.st_nlink <= 1:
+                    inodes.add((st.st_dev, st.st_ino))
+                    total += st.st_size
+        removed = 0
+        for mtime, size, fpath in sorted(files):
+            if total <= self.max_bytes:
+                break
+            st = os.stat(fpath)
+            os.remove(fpath)
+            if st.st_nlink <= 2:
+                total -= size   # the last frame using these bytes
+            removed += 1
+            if removed_paths is not None:
+                removed_paths.append(fpath)
+        return removed
+
+    def remove_orphans(self):
+        '''
+        Remove the objects that no frame links to any more.
+        :return: number of objects removed.
+        '''
+        removed = 0
+        for root, dirs, fnames in os.walk(os.path.join(self.cache_dir, OBJECTS_DIR)):
+            for fname in fnames:
+                fpath = os.path.join(root, fname)
+                try:
+                    if fname.endswith('.gif') and os.stat(fpath).st_nlink == 1:
+                        os.remove(fpath)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
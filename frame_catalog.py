@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+SQLite catalog of the radar frames seen, fetched, archived and encoded, and of the builds.
+
+FrameIndex only lives as long as the process, so every run started again from the HTML listing
+and a scan of the cache directory, and nothing was kept about how the pipeline performed.
+FrameCatalog keeps one row per frame of every station and product:
+    station, product, name, time, size, digest, fetch_ms, location, seen_at, fetched_at,
+    archived, encoded_at
+indexed by (station, product, time) for time range and latest-N queries, and one row per build
+with its status and the seconds of each stage. RadarAnimator, AsyncRadarEngine (and so the
+batch and the scheduler), archive_frames and TimeLapse write to it when they are given one;
+the async engine reads the cached frames from it instead of listing the cache directory.
+The database is in WAL mode, so several processes can use it and readers do not wait.
+The async engine collects the rows of a build in a CatalogBatch and writes them in one
+transaction from a worker thread at the end of the build, so a busy database never stalls the
+event loop.
+
+Usage: python frame_catalog.py [-s MUX] [-p N0R] [-n frames] [-b builds] [-d frame_catalog.sqlite]
+'''
+
+CATALOG_DB='frame_catalog.sqlite'
+TIME_FORMAT='%Y-%m-%dT%H:%M'    # frame times as stored, same as numpy datetime64[m] strings
+CACHED_FRAMES=60        # newest frames checked by cached(), more than the cache keeps at a 3 minute cadence
+
+import os
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+from frame_times import parse_frame_times
+from frame_index import frame_digest
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS frames (
+    station TEXT NOT NULL,
+    product TEXT NOT NULL,
+    name TEXT NOT NULL,         -- RIDGE filename
+    time TEXT NOT NULL,         -- YYYY-MM-DDTHH:MM
+    size INTEGER,
+    digest BLOB,
+    fetch_ms REAL,              -- latency of the download, NULL if never downloaded by us
+    location TEXT,              -- cache path
+    seen_at REAL,               -- first listing with the frame, time.time()
+    fetched_at REAL,
+    archived INTEGER NOT NULL DEFAULT 0,
+    encoded_at REAL,            -- last animation with the frame
+    PRIMARY KEY (station, product, name)
+);
+CREATE INDEX IF NOT EXISTS frames_time ON frames (station, product, time);
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    station TEXT NOT NULL,
+    product TEXT NOT NULL,
+    started REAL NOT NULL,
+    anim_out TEXT,
+    status TEXT,
+    frames INTEGER,
+    listing REAL,
+    fetch REAL,
+    encode REAL,
+    total REAL
+);
+CREATE INDEX IF NOT EXISTS builds_started ON builds (station, product, started);
+'''
+
+class FrameCatalog:
+    '''
+    Frames and builds of all stations and products. Safe to share between threads.
+    '''
+    def __init__(self, db_path=CATALOG_DB):
+        '''
+        :param db_path: SQLite file, created if it does not exist.
+        '''
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def write(self, sql, rows):
+        '''
+        Run sql for every row in one transaction.
+        '''
+        with self.lock, self.db:
+            self.db.executemany(sql, rows)
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def seen(self, station, product, img_list):
+        '''
+        Record the frames of a listing. Frames already in the catalog are not changed.
+        :param img_list: list of RIDGE filenames.
+        '''
+        if not len(img_list):
+            return
+        times = np.datetime_as_string(parse_frame_times([str(name) for name in img_list]), unit='m')
+        now = time.time()
+        self.write('INSERT OR IGNORE INTO frames (station, product, name, time, seen_at) VALUES (?, ?, ?, ?, ?)',
+                   [(station, product, str(name), str(t), now) for name, t in zip(img_list, times)])
+
+    def fetched(self, station, product, imgfile, img_bytes, location=None, fetch_ms=None):
+        '''
+        Record a frame that was downloaded, or read from the cache (fetch_ms None).
+        :param location: cache path of the frame, if it is cached.
+        :param fetch_ms: milliseconds the download took.
+        '''
+        frame_time = np.datetime_as_string(parse_frame_times([imgfile])[0], unit='m')
+        now = time.time()
+        self.write('''INSERT INTO frames (station, product, name, time, size, digest, fetch_ms, location, seen_at, fetched_at)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (station, product, name) DO UPDATE SET
+                      size=excluded.size, digest=excluded.digest, location=COALESCE(excluded.location, location),
+                      fetch_ms=COALESCE(excluded.fetch_ms, fetch_ms), fetched_at=COALESCE(excluded.fetched_at, fetched_at)''',
+                   [(station, product, imgfile, str(frame_time), len(img_bytes), frame_digest(img_bytes), fetch_ms,
+                     location, now, now if fetch_ms is not None else None)])
+
+    def archived(self, station, product, names):
+        '''
+        Record the frames that were added to the FrameArchive.
+        '''
+        self.write('UPDATE frames SET archived=1 WHERE station=? AND product=? AND name=?',
+                   [(station, product, name) for name in names])
+
+    def evicted(self, paths):
+        '''
+        Record that these cache files were removed.
+        :param paths: cache paths, as given to fetched.
+        '''
+        self.write('UPDATE frames SET location=NULL WHERE location=?', [(path,) for path in paths])
+
+    def encoded(self, station, product, names):
+        '''
+        Record the frames of an animation that was written.
+        '''
+        now = time.time()
+        self.write('UPDATE frames SET encoded_at=? WHERE station=? AND product=? AND name=?',
+                   [(now, station, product, name) for name in names])
+
+    def record_build(self, station, product, anim_out, status, frames, timings, started=None):
+        '''
+        :param anim_out: output of the build, a filename, or None for bytes.
+        :param status: e.g., 'ok', 'unchanged', 'host down', 'error'.
+        :param timings: dict of seconds with keys listing, fetch, encode, total (any may be missing).
+        '''
+        started = started if started is not None else time.time() - timings.get('total', 0)
+        self.write('''INSERT INTO builds (station, product, started, anim_out, status, frames, listing, fetch, encode, total)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   [(station, product, started, anim_out if isinstance(anim_out, str) else None, status, frames,
+                     timings.get('listing'), timings.get('fetch'), timings.get('encode'), timings.get('total'))])
+
+    def frames(self, station, product, start_time=None, end_time=None):
+        '''
+        :param start_time: datetime, first time. None for no lower limit.
+        :param end_time: datetime, last time. None for no upper limit.
+        :return: list of dicts, one per frame, oldest first.
+        '''
+        sql = 'SELECT * FROM frames WHERE station=? AND product=?'
+        args = [station, product]
+        if start_time is not None:
+            sql += ' AND time >= ?'
+            args.append(start_time.strftime(TIME_FORMAT))
+        if end_time is not None:
+            sql += ' AND time <= ?'
+            args.append(end_time.strftime(TIME_FORMAT))
+        with self.lock:
+            cursor = self.db.execute(sql + ' ORDER BY time', args)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def latest(self, station, product, count):
+        '''
+        :return: RIDGE filenames of the newest count frames, oldest first.
+        '''
+        rows = self.query('SELECT name FROM frames WHERE station=? AND product=? ORDER BY time DESC LIMIT ?',
+                          (station, product, count))
+        return [row[0] for row in reversed(rows)]
+
+    def cached(self, station, product, count=CACHED_FRAMES):
+        '''
+        :param count: number of the newest frames with a cache location that are checked.
+        :return: RIDGE filenames of the frames whose cache file is still there, oldest first.
+        '''
+        rows = self.query('''SELECT name, location FROM frames WHERE station=? AND product=? AND location IS NOT NULL
+                             ORDER BY time DESC LIMIT ?''', (station, product, count))
+        return [name for name, location in reversed(rows) if os.path.exists(location)]
+
+    def fetch_stats(self, station, product, since=None):
+        '''
+        :param since: time.time() of the oldest download counted. None for all.
+        :return: dict with count, mean_ms and max_ms of the downloads, and bytes downloaded.
+        '''
+        row = self.query('''SELECT COUNT(*), AVG(fetch_ms), MAX(fetch_ms), SUM(size) FROM frames
+                            WHERE station=? AND product=? AND fetch_ms IS NOT NULL AND fetched_at >= ?''',
+                         (station, product, since or 0))[0]
+        return {'count': row[0], 'mean_ms': row[1], 'max_ms': row[2], 'bytes': row[3] or 0}
+
+    def builds(self, station, product, count=20):
+        '''
+        :return: list of dicts of the last count builds, oldest first.
+        '''
+        with self.lock:
+            cursor = self.db.execute('SELECT * FROM builds WHERE station=? AND product=? ORDER BY started DESC LIMIT ?',
+                                     (station, product, count))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in reversed(cursor.fetchall())]
+
+class CatalogBatch(FrameCatalog):
+    '''
+    Writes to a FrameCatalog collected in memory, e.g., for one build. flush() writes them all
+    in one transaction. Queries go to the catalog at once.
+    '''
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.db_path = catalog.db_path
+        self.lock = catalog.lock
+        self.db = catalog.db
+        self.pending = []   # list of (sql, rows)
+        self.pending_lock = threading.Lock()
+
+    def write(self, sql, rows):
+        with self.pending_lock:
+            self.pending.append((sql, list(rows)))
+
+    def flush(self):
+        '''
+        Write the collected rows. Safe to call from a worker thread.
+        '''
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with self.lock, self.db:
+            for sql, rows in pending:
+                self.db.executemany(sql, rows)
+
+    def close(self):
+        self.flush()
+
+def main(station='MUX', product='N0R', db_path=CATALOG_DB, count=10, build_count=10):
+    catalog = FrameCatalog(db_path)
+    for row in catalog.frames(station, product)[-count:]:
+        print('%s %8s %8s  %s' %(row['name'], row['size'] or '-', '%.0f ms' %(row['fetch_ms']) if row['fetch_ms'] else '-',
+                                 row['location'] or ''))
+    stats = catalog.fetch_stats(station, product)
+    if stats['count']:
+        print('%d downloads, %d bytes, mean %.0f ms, max %.0f ms' %(stats['count'], stats['bytes'], stats['mean_ms'], stats['max_ms']))
+    for row in catalog.builds(station, product, build_count):
+        print('%s %-10s %4s frames  total %.2f s' %(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['started'])),
+              row['status'], row['frames'], row['total'] or 0))
+    catalog.close()
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hs:p:n:b:d:'
+    longOpts  = ['help', 'station=', 'product=', 'frames=', 'builds=', 'db=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    station = 'MUX'
+    product = 'N0R'
+    count = 10
+    build_count = 10
+    db_path = CATALOG_DB
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-s','--station'):
+            station = val.upper()
+        elif arg in ('-p','--product'):
+            product = val.upper()
+        elif arg in ('-n','--frames'):
+            count = int(val)
+        elif arg in ('-b','--builds'):
+            build_count = int(val)
+        elif arg in ('-d','--db'):
+            db_path = val
+    main(station=station, product=product, db_path=db_path, count=count, build_count=build_count)
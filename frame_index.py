@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Compact index of the frames of one radar station and product.
+
+The list of (datetime, datetime-string, filename) tuples was rebuilt from the listing on every
+run and filtered by a linear scan. FrameIndex keeps the frames in NumPy arrays sorted by time:
+timestamps (datetime64[m]), filenames, byte sizes, content hashes and the cache path of each frame.
+* time range queries are binary searches, O(log n),
+* a new frame is appended at the end, O(1) amortized (the arrays grow by doubling),
+* old frames are evicted by moving the start of the live part; the arrays are compacted once
+  the dead part is larger than the live part.
+One index per station and product is shared in the process (get_frame_index), so RadarAnimator,
+the async engine, the batch and scheduler, and the archive all see the same frames.
+'''
+
+INDEX_MAX_AGE=24*60     # minutes of frames kept in the index, counted back from the newest
+INDEX_CAPACITY=64       # initial number of slots
+NAME_WIDTH=40           # longest RIDGE filename, e.g., KMUX_20201214_2339_N0R.gif is 26
+DIGEST_SIZE=16          # bytes of the blake2b content hash
+
+import hashlib
+import threading
+import datetime as dt
+
+import numpy as np
+
+from frame_times import FrameTuples, parse_frame_times
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def frame_digest(img_bytes):
+    '''
+    :param img_bytes: GIF bytes of a frame.
+    :return: content hash, DIGEST_SIZE bytes.
+    '''
+    return hashlib.blake2b(img_bytes, digest_size=DIGEST_SIZE).digest()
+
+class FrameIndex:
+    '''
+    Frames of one station and product, sorted by time.
+    Positions returned by the methods are relative to the live part: 0 is the oldest frame.
+    '''
+    def __init__(self, station, product, max_age=INDEX_MAX_AGE, capacity=INDEX_CAPACITY):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param product: product code, e.g., "N0R"
+        :param max_age: minutes of history kept. None to keep every frame.
+        :param capacity: initial number of slots.
+        '''
+        self.station = station.upper()
+        self.product = product.upper()
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.times = np.zeros(capacity, dtype='datetime64[m]')
+        self.names = np.zeros(capacity, dtype='U%d' %(NAME_WIDTH))
+        self.sizes = np.zeros(capacity, dtype=np.int64)         # 0 until the frame has been fetched
+        self.digests = np.zeros(capacity, dtype='S%d' %(DIGEST_SIZE))
+        self.paths = np.empty(capacity, dtype=object)           # cache path, or None
+        self.head = 0       # first live slot
+        self.tail = 0       # one past the last live slot
+        self.serial = {}    # filename -> head + position + self.base
+        self.base = 0       # slots removed by compaction
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def __contains__(self, imgfile):
+        return imgfile in self.serial
+
+    def __repr__(self):
+        return 'FrameIndex(%s %s, %d frames)' %(self.station, self.product, len(self))
+
+    def position(self, imgfile):
+        '''
+        :return: position of imgfile in the live part, or None.
+        '''
+        with self.lock:
+            serial = self.serial.get(imgfile)
+            return None if serial is None else serial - self.base - self.head
+
+    def newest(self):
+        '''
+        :return: datetime of the newest frame, or None if the index is empty.
+        '''
+        with self.lock:
+            return self.times[self.tail - 1].astype(object) if self.tail > self.head else None
+
+    def make_room(self, count):
+        '''
+        Make sure count more frames fit at the end.
+        '''
+        if self.tail + count <= len(self.times):
+            return
+        live = self.tail - self.head
+        capacity = len(self.times)
+        while capacity < live + count:
+            capacity *= 2
+        for field in ('times', 'names', 'sizes', 'digests', 'paths'):
+            old = getattr(self, field)
+            new = np.zeros(capacity, dtype=old.dtype) if field != 'paths' else np.empty(capacity, dtype=object)
+            new[:live] = old[self.head:self.tail]
+            setattr(self, field, new)
+        self.base += self.head
+        self.tail = live
+        self.head = 0
+
+    def append(self, imgfile, size=0, digest=b'', path=None, frame_time=None):
+        '''
+        Add one frame. A frame older than the newest one is inserted in its place, which is O(n).
+        :param imgfile: RIDGE filename.
+        :param frame_time: datetime of the frame. Default is parsed from imgfile.
+        :return: False if the frame was already in the index.
+        '''
+        if frame_time is None:
+            frame_time = parse_frame_times([imgfile])[0]
+        return self.extend([imgfile], np.array([frame_time], dtype='datetime64[m]'),
+                           sizes=[size], digests=[digest], paths=[path]) > 0
+
+    def extend(self, img_list, times=None, sizes=None, digests=None, paths=None):
+        '''
+        Add the frames that are not in the index yet, e.g., the names of a new listing.
+        :param img_list: list of RIDGE filenames.
+        :param times: their datetime64[m] array. Default is parsed from img_list.
+        :return: number of frames added.
+        '''
+        with self.lock:
+            new = [idx for idx, name in enumerate(img_list) if name not in self.serial]
+            if not new:
+                return 0
+            times = np.asarray(times, dtype='datetime64[m]') if times is not None else None
+            if len(new) < len(img_list):
+                img_list = [img_list[idx] for idx in new]
+                times = times[new] if times is not None else None
+                sizes = [sizes[idx] for idx in new] if sizes is not None else None
+                digests = [digests[idx] for idx in new] if digests is not None else None
+                paths = [paths[idx] for idx in new] if paths is not None else None
+            times = parse_frame_times(img_list) if times is None else times
+            order = np.argsort(times, kind='stable')
+            count = len(img_list)
+            self.make_room(count)
+            newest = self.times[self.tail - 1] if self.tail > self.head else None
+            if newest is None or times[order[0]] >= newest:
+                # the usual case: the new frames are newer than every frame in the index
+                lo, hi = self.tail, self.tail + count
+                self.times[lo:hi] = times[order]
+                self.names[lo:hi] = [img_list[idx] for idx in order]
+                self.sizes[lo:hi] = [sizes[idx] for idx in order] if sizes is not None else 0
+                self.digests[lo:hi] = [digests[idx] for idx in order] if digests is not None else b''
+                self.paths[lo:hi] = [paths[idx] for idx in order] if paths is not None else None
+                for pos in range(lo, hi):
+                    self.serial[str(self.names[pos])] = self.base + pos
+                self.tail = hi
+            else:
+                for idx in order:
+                    self.insert(img_list[idx], times[idx], sizes[idx] if sizes is not None else 0,
+                                digests[idx] if digests is not None else b'', paths[idx] if paths is not None else None)
+            if self.max_age is not None:
+                self.evict_before(self.newest() - dt.timedelta(minutes=self.max_age))
+            return count
+
+    def insert(self, imgfile, frame_time, size, digest, path):
+        '''
+        Insert one frame in time order. Slots after it move up by one.
+        '''
+        pos = self.head + int(np.searchsorted(self.times[self.head:self.tail], frame_time, side='right'))
+        for field in ('times', 'names', 'sizes', 'digests', 'paths'):
+            arr = getattr(self, field)
+            arr[pos + 1:self.tail + 1] = arr[pos:self.tail].copy()
+        self.times[pos] = frame_time
+        self.names[pos] = imgfile
+        self.sizes[pos] = size
+        self.digests[pos] = digest
+        self.paths[pos] = path
+        self.tail += 1
+        for p in range(pos, self.tail):
+            self.serial[str(self.names[p])] = self.base + p
+
+    def update(self, imgfile, img_bytes=None, path=None):
+        '''
+        Record the size, content hash and cache path of a frame once it has been fetched.
+        :return: False if imgfile is not in the index.
+        '''
+        with self.lock:
+            pos = self.position(imgfile)
+            if pos is None:
+                return False
+            if img_bytes is not None:
+                self.sizes[self.head + pos] = len(img_bytes)
+                self.digests[self.head + pos] = frame_digest(img_bytes)
+            if path is not None:
+                self.paths[self.head + pos] = path
+            return True
+
+    def info(self, imgfile):
+        '''
+        :return: dict with time, size, digest and path of a frame, or None.
+        '''
+        with self.lock:
+            pos = self.position(imgfile)
+            if pos is None:
+                return None
+            slot = self.head + pos
+            return {'name': imgfile, 'time': self.times[slot].astype(object), 'size': int(self.sizes[slot]),
+                    'digest': bytes(self.digests[slot]), 'path': self.paths[slot]}
+
+    def evict_before(self, oldest):
+        '''
+        Drop the frames older than oldest.
+        :param oldest: datetime.
+        :return: number of frames dropped.
+        '''
+        with self.lock:
+            cut = self.head + int(np.searchsorted(self.times[self.head:self.tail], np.datetime64(oldest, 'm'), side='left'))
+            for pos in range(self.head, cut):
+                self.serial.pop(str(self.names[pos]), None)
+                self.paths[pos] = None
+            dropped = cut - self.head
+            self.head = cut
+            if self.head > len(self.times) // 2:
+                self.make_room(len(self.times) - (self.tail - self.head))
+            return dropped
+
+    def range_bounds(self, start_time, end_time):
+        '''
+        :param start_time: datetime, first time of the range.
+        :param end_time: datetime, last time of the range.
+        :return: tuple (lo, hi) of positions, the frames in [start_time, end_time] are lo to hi-1.
+        '''
+        with self.lock:
+            times = self.times[self.head:self.tail]
+            lo = int(np.searchsorted(times, np.datetime64(start_time, 'm'), side='left'))
+            hi = int(np.searchsorted(times, np.datetime64(end_time, 'm'), side='right'))
+            return (lo, max(lo, hi))
+
+    def window(self, start_time, end_time):
+        '''
+        :return: FrameTuples of the frames in [start_time, end_time], for RadarAnimator.img_tuples
+        '''
+        with self.lock:
+            lo, hi = self.range_bounds(start_time, end_time)
+            return FrameTuples(self.names[self.head + lo:self.head + hi].copy(),
+                               self.times[self.head + lo:self.head + hi].copy())
+
+    def last(self, minutes):
+        '''
+        :return: FrameTuples of the frames in the last minutes before the newest frame.
+        '''
+        newest = self.newest()
+        if newest is None:
+            return FrameTuples([], np.array([], dtype='datetime64[m]'))
+        return self.window(newest - dt.timedelta(minutes=minutes), newest)
+
+frame_indexes = {}
+frame_indexes_lock = threading.Lock()
+
+def get_frame_index(station, product):
+    '''
+    :return: the FrameIndex shared by everything in this process for station and product.
+    '''
+    key = (station.upper(), product.upper())
+    with frame_indexes_lock:
+        index = frame_indexes.get(key)
+        if index is None:
+            index = FrameIndex(station, product)
+            frame_indexes[key] = index
+        return index
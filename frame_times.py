@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Batch parsing of RIDGE frame timestamps with NumPy.
+
+RadarAnimator.img_name_tuple splits each filename, builds a datetime and formats it with
+strftime, one frame at a time, and filter_img_tuples scans the whole list. That is fine for the
+dozen frames of one hour, not for long listings or an archive with thousands of frames.
+parse_frame_times reads the digits of all names at once into a datetime64[m] array, and the
+time window is found with a binary search (np.searchsorted). FrameTuples looks like the old list
+of (datetime, datetime-string, image_filename) tuples, but a tuple, and its display string, is
+only made for a frame that is actually used.
+'''
+
+DISPLAY_FORMAT='%Y-%m-%d %H:%M'     # same as img_name_tuple
+
+import numpy as np
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+# digit positions after the first '_' of STATION_YYYYMMDD_HHMM_PRODUCT.gif
+DIGIT_FIELDS = {'year': (1, 5), 'month': (5, 7), 'day': (7, 9), 'hour': (10, 12), 'minute': (12, 14)}
+
+def parse_frame_times(img_list):
+    '''
+    Parse the timestamps of RIDGE filenames, e.g., MUX_20201214_2339_N0R.gif
+    :param img_list: list of filenames, normally all of one station and product.
+    :return: numpy datetime64[m] array, one per filename.
+    '''
+    count = len(img_list)
+    if count == 0:
+        return np.array([], dtype='datetime64[m]')
+    width = len(img_list[0])
+    sep = img_list[0].find('_')
+    if sep < 0 or any([len(name) != width for name in img_list]):
+        # names of different lengths: one at a time
+        return np.array([key_to_iso(name[name.find('_') + 1:]) for name in img_list], dtype='datetime64[m]')
+    chars = np.frombuffer(''.join(img_list).encode('ascii'), dtype=np.uint8).reshape(count, width)
+    if not ((chars[:, sep] == ord('_')).all() and (chars[:, sep + 9] == ord('_')).all()):
+        raise ValueError('parse_frame_times: not RIDGE filenames, e.g., %s' %(img_list[0]))
+    digits = chars.astype(np.int64) - ord('0')
+    fields = {}
+    for field, (lo, hi) in DIGIT_FIELDS.items():
+        value = np.zeros(count, dtype=np.int64)
+        for col in range(sep + lo, sep + hi):
+            value = value * 10 + digits[:, col]
+        fields[field] = value
+    months = (fields['year'] - 1970) * 12 + fields['month'] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (fields['day'] - 1).astype('timedelta64[D]')
+    return days.astype('datetime64[m]') + (fields['hour'] * 60 + fields['minute']).astype('timedelta64[m]')
+
+def key_to_iso(stamp):
+    '''
+    :param stamp: 'YYYYMMDD_HHMM...' part of a RIDGE filename.
+    :return: 'YYYY-MM-DDTHH:MM', which numpy parses.
+    '''
+    return '%s-%s-%sT%s:%s' %(stamp[0:4], stamp[4:6], stamp[6:8], stamp[9:11], stamp[11:13])
+
+class FrameTuples:
+    '''
+    Read-only sequence of image tuples (datetime, datetime-string, image_filename), sorted by time.
+    Indexing makes the tuple of one frame; slicing and window() return another FrameTuples
+    without making any tuple.
+    '''
+    def __init__(self, img_list, times=None):
+        '''
+        :param img_list: list of RIDGE filenames.
+        :param times: their datetime64[m] array, if already parsed.
+        '''
+        names = np.array(img_list, dtype=object)
+        times = parse_frame_times(img_list) if times is None else times
+        if len(times) > 1 and (times[1:] < times[:-1]).any():
+            order = np.argsort(times, kind='stable')
+            names = names[order]
+            times = times[order]
+        self.names = names
+        self.times = times
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return FrameTuples(self.names[idx], self.times[idx])
+        dtobj = self.times[idx].astype(object)
+        return (dtobj, dtobj.strftime(DISPLAY_FORMAT), str(self.names[idx]))
+
+    def __iter__(self):
+        for idx in range(len(self.names)):
+            yield self[idx]
+
+    def __repr__(self):
+        if not len(self.names):
+            return 'FrameTuples([])'
+        return 'FrameTuples(%d frames, %s to %s)' %(len(self.names), self.names[0], self.names[-1])
+
+    def window_bounds(self, start_time, end_time):
+        '''
+        :param start_time: datetime, first time in the window.
+        :param end_time: datetime, last time in the window.
+        :return: tuple (lo, hi), the frames in [start_time, end_time] are self[lo:hi]
+        '''
+        lo = np.searchsorted(self.times, np.datetime64(start_time, 'm'), side='left')
+        hi = np.searchsorted(self.times, np.datetime64(end_time, 'm'), side='right')
+        return (int(lo), int(max(lo, hi)))
+
+    def window(self, start_time, end_time):
+        '''
+        :return: FrameTuples of the frames in [start_time, end_time]
+        '''
+        lo, hi = self.window_bounds(start_time, end_time)
+        return self[lo:hi]
+
+    def img_list(self):
+        '''
+        :return: list of the filenames.
+        '''
+        return [str(name) for name in self.names]
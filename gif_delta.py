@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Animated GIF that stores only the changed rectangle of every frame.
+
+Consecutive RIDGE frames differ only where the echoes moved, but create_anim_gif (imageio) and
+splice_gif write every frame at the full 600x550. delta_gif:
+* decodes the frames to palette indices and maps them to one palette shared by all frames, with
+  the transparent color at index 0. The frames of one hour can have two palettes, with the
+  transparent color at index 8 in one and 9 in the other, so the raw indices can not be compared.
+* compares every frame with the previous one, all frames at once with NumPy, and keeps the
+  bounding box of the pixels that changed,
+* writes only that rectangle, with the pixels that did not change made transparent so that the
+  previous frame shows through (disposal 1, leave the frame in place).
+Drawing over the previous frame can not make a pixel transparent again, e.g., where an echo went
+away. When a frame has such pixels, the previous frame is cleared to the background instead
+(disposal 2). Its rectangle is grown to cover those pixels, and the frame draws all of that area
+again. The last frame is cleared the same way before the first frame of the next loop.
+Identical consecutive frames become one frame that is shown longer. Every frame shown has the
+pixels of its source GIF. The rectangles are LZW encoded by Pillow. The palette has only the
+colors in use, so the LZW codes start with fewer bits than with the 256 color RIDGE palette.
+
+Usage: python gif_delta.py [-o radar_delta.gif] frame.gif ...
+'''
+
+DELTA_OUT='radar_delta.gif'
+DELTA_MAX_COLORS=256    # colors of a GIF palette, including the transparent one
+
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+from gif_splice import GifFrame, gif_header, frame_block, table_bits
+from gif_splice import SPLICE_LOOP, DISPOSE_NONE, DISPOSE_BACKGROUND
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def decode_indices(img_bytes):
+    '''
+    :param img_bytes: GIF bytes of a frame.
+    :return: tuple (uint8 array of palette indices of shape (height, width), list of (r, g, b)
+        of the palette, transparent index or None)
+    '''
+    im = Image.open(io.BytesIO(bytes(img_bytes)))
+    if im.mode != 'P':
+        raise ValueError('decode_indices: not a palette image, mode %s' %(im.mode))
+    palette = im.getpalette() or []
+    return (np.asarray(im), [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)], im.info.get('transparency'))
+
+def shared_palette(frames):
+    '''
+    Map the frames to one palette of the colors they use.
+    :param frames: list of tuples from decode_indices.
+    :return: tuple (uint8 array of shape (frames, height, width), palette bytes, transparent index or None)
+    '''
+    shape = frames[0][0].shape
+    transparency = None
+    colors = []
+    position = {}
+    for indices, palette, trans in frames:
+        if trans is not None:
+            # the transparent color goes first, with the RGB of the first frame that has one
+            transparency = 0
+            colors = [palette[trans] if trans < len(palette) else (0, 0, 0)]
+            break
+    stack = np.empty((len(frames),) + shape, dtype=np.uint8)
+    for n, (indices, palette, trans) in enumerate(frames):
+        if indices.shape != shape:
+            raise ValueError('shared_palette: frame %d is %s, not %s' %(n, str(indices.shape), str(shape)))
+        lut = np.zeros(256, dtype=np.uint8)
+        for idx in np.flatnonzero(np.bincount(indices.ravel(), minlength=256)):
+            if idx == trans:
+                continue
+            rgb = palette[idx] if idx < len(palette) else (0, 0, 0)
+            if rgb not in position:
+                if len(colors) >= DELTA_MAX_COLORS:
+                    raise ValueError('shared_palette: more than %d colors' %(DELTA_MAX_COLORS))
+                position[rgb] = len(colors)
+                colors.append(rgb)
+            lut[idx] = position[rgb]
+        stack[n] = lut[indices]
+    return (stack, b''.join([bytes(rgb) for rgb in colors]), transparency)
+
+def merge_identical(stack, durations):
+    '''
+    Make one longer frame of consecutive identical frames.
+    :param stack: frames from shared_palette.
+    :param durations: list of seconds, one per frame.
+    :return: tuple (stack without the repeated frames, list of seconds per frame)
+    '''
+    same = ~(stack[1:] != stack[:-1]).any(axis=(1, 2))
+    keep = [0]
+    secs = [durations[0]]
+    for i in range(1, len(stack)):
+        if same[i - 1]:
+            secs[-1] += durations[i]
+        else:
+            keep.append(i)
+            secs.append(durations[i])
+    return (stack[keep], secs)
+
+def bounding_box(rows, cols):
+    '''
+    :param rows: bool array, True for the rows with a changed pixel.
+    :param cols: bool array, True for the columns with a changed pixel.
+    :return: tuple (left, top, right, bottom), right and bottom exclusive, or None if nothing changed.
+    '''
+    r = np.flatnonzero(rows)
+    c = np.flatnonzero(cols)
+    if not len(r):
+        return None
+    return (int(c[0]), int(r[0]), int(c[-1]) + 1, int(r[-1]) + 1)
+
+def mask_box(mask):
+    '''
+    :return: bounding box of the True pixels of a 2D bool array, or None.
+    '''
+    return bounding_box(mask.any(axis=1), mask.any(axis=0))
+
+def union_box(a, b):
+    '''
+    :return: the smallest box that holds boxes a and b, either of them may be None.
+    '''
+    if a is None or b is None:
+        return a or b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def plan_frames(stack, transparency):
+    '''
+    Choose the rectangle and the disposal method of every frame.
+    :param stack: frames of palette indices, no two consecutive ones identical.
+    :param transparency: transparent index, or None.
+    :return: tuple (list of boxes, list of disposal methods), one per frame.
+    '''
+    count, height, width = stack.shape
+    boxes = [(0, 0, width, height)] + [None] * (count - 1)
+    disposals = [DISPOSE_NONE] * count
+    changed = stack[1:] != stack[:-1]
+    rows = changed.any(axis=2)
+    cols = changed.any(axis=1)
+    if transparency is not None:
+        # pixels that become transparent can only be cleared by the disposal of the previous frame
+        cleared = changed & (stack[1:] == transparency)
+        needs_clear = cleared.any(axis=(1, 2))
+    for i in range(1, count):
+        if transparency is None or not needs_clear[i - 1]:
+            boxes[i] = bounding_box(rows[i - 1], cols[i - 1])
+            continue
+        disposals[i - 1] = DISPOSE_BACKGROUND
+        boxes[i - 1] = union_box(boxes[i - 1], mask_box(cleared[i - 1]))
+        # the frame may be all transparent over the cleared area and the same elsewhere
+        boxes[i] = mask_box(stack[i] != disposed_base(stack[i - 1], boxes[i - 1], transparency)) or (0, 0, 1, 1)
+    if transparency is not None:
+        cleared = (stack[0] == transparency) & (stack[-1] != transparency)
+        if cleared.any():
+            disposals[-1] = DISPOSE_BACKGROUND
+            boxes[-1] = union_box(boxes[-1], mask_box(cleared))
+    return (boxes, disposals)
+
+def disposed_base(previous, box, transparency):
+    '''
+    :return: the canvas after previous was shown and its box cleared to the background.
+    '''
+    base = previous.copy()
+    left, top, right, bottom = box
+    base[top:bottom, left:right] = transparency
+    return base
+
+def mask_unchanged(indices, base, marker):
+    '''
+    :param indices: palette indices of a rectangle of a frame.
+    :param base: palette indices of the same rectangle before the frame is drawn.
+    :param marker: transparent index of the frame.
+    :return: indices with the pixels that do not change set to marker, except those with the
+        same color on both sides, so that the runs of one color that LZW codes well stay whole.
+    '''
+    left = np.empty_like(indices)
+    left[:, 1:] = indices[:, :-1]
+    left[:, 0] = marker
+    right = np.empty_like(indices)
+    right[:, :-1] = indices[:, 1:]
+    right[:, -1] = marker
+    inside_run = (left == indices) & (right == indices)
+    return np.where((indices == base) & ~inside_run, np.uint8(marker), indices)
+
+def encode_indices(indices, bits):
+    '''
+    LZW encode palette indices with the GIF encoder of Pillow.
+    :param indices: 2D uint8 array.
+    :param bits: LZW minimum code size, enough bits for the largest index.
+    :return: image data: LZW minimum code size, data sub-blocks and block terminator.
+    '''
+    im = Image.frombytes('P', (indices.shape[1], indices.shape[0]), np.ascontiguousarray(indices).tobytes())
+    # Image.save always codes with 8 bits; the encoder itself takes the code size
+    return bytes([bits]) + im.tobytes('gif', 'P', bits, 0) + b'\x00'
+
+def delta_gif(ims_bytes, duration, loop=SPLICE_LOOP):
+    '''
+    Assemble an animated GIF with the changed rectangle of every frame.
+    :param ims_bytes: list of GIF bytes of the frames, in display order.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :param loop: number of loops, 0 for ever.
+    :return: bytes of the animated GIF.
+    '''
+    if not ims_bytes:
+        raise ValueError('delta_gif: no frames')
+    durations = list(duration) if isinstance(duration, (list, tuple)) else [duration] * len(ims_bytes)
+    stack, palette, transparency = shared_palette([decode_indices(img_bytes) for img_bytes in ims_bytes])
+    stack, secs = merge_identical(stack, durations)
+    return delta_frames(stack, palette, transparency, secs, loop)
+
+def delta_frames(stack, palette, transparency, secs, loop=SPLICE_LOOP):
+    '''
+    The work of delta_gif, on frames that are already decoded.
+    :param stack: frames from shared_palette, no two consecutive ones identical (merge_identical).
+    :param palette: palette bytes from shared_palette.
+    :param transparency: transparent index, or None.
+    :param secs: list of seconds, one per frame.
+    :return: bytes of the animated GIF.
+    '''
+    # the pixels that do not change may be written with the transparent index, or with a spare one
+    marker = transparency
+    if marker is None and len(palette) < 3 * DELTA_MAX_COLORS:
+        marker = len(palette) // 3
+        palette += b'\x00\x00\x00'
+    palette += b'\x00' * (3 * (2 << table_bits(palette)) - len(palette))
+    bits = max(2, table_bits(palette) + 1)
+    boxes, disposals = plan_frames(stack, transparency)
+    height, width = stack.shape[1:]
+    frames = []
+    for i, (left, top, right, bottom) in enumerate(boxes):
+        indices = stack[i, top:bottom, left:right]
+        image_data = encode_indices(indices, bits)
+        if i and marker is not None:
+            # radar echoes change in scattered pixels, so masking them does not always pay: keep the shorter
+            base = stack[i - 1]
+            if disposals[i - 1] == DISPOSE_BACKGROUND:
+                base = disposed_base(base, boxes[i - 1], transparency)
+            masked = mask_unchanged(indices, base[top:bottom, left:right], marker)
+            if (masked != indices).any():
+                masked_data = encode_indices(masked, bits)
+                if len(masked_data) < len(image_data):
+                    image_data = masked_data
+        descriptor = struct.pack('<BHHHHB', 0x2c, left, top, right - left, bottom - top, 0)
+        frames.append(GifFrame(width, height, palette, transparency if i == 0 else marker, descriptor, image_data))
+    out = [gif_header(frames, loop)]
+    for frame, frame_secs, disposal in zip(frames, secs, disposals):
+        out.append(frame_block(frame, int(round(frame_secs * 100)), palette, disposal))
+    out.append(b'\x3b')
+    pixels = sum([(b[2] - b[0]) * (b[3] - b[1]) for b in boxes])
+    logger.debug('delta_frames: %d frames, %.0f%% of the pixels, %d colors' %(
+                 len(frames), 100.0 * pixels / (len(frames) * width * height), len(palette) // 3))
+    return b''.join(out)
+
+def main(files, gif_out=DELTA_OUT, duration=0.5):
+    ims_bytes = []
+    for fname in files:
+        with open(fname, 'rb') as f:
+            ims_bytes.append(f.read())
+    gif_bytes = delta_gif(ims_bytes, duration)
+    with open(gif_out, 'wb') as f:
+        f.write(gif_bytes)
+    print('%s: %d frames, %d bytes (frames %d bytes)' %(gif_out, len(files), len(gif_bytes), sum([len(b) for b in ims_bytes])))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'ho:'
+    longOpts  = ['help', 'out=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    gif_out = DELTA_OUT
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-o','--out'):
+            gif_out = val
+    if not values:
+        print(__doc__)
+        sys.exit(2)
+    main(values, gif_out)
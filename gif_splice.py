@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Animated GIF assembly by splicing the bytes of the RIDGE frames, without decoding them.
+
+create_anim_gif decodes every frame to an RGBA array and imageio (GIF-PIL) quantizes and LZW
+encodes them all again, and qtradar.py decodes the frames a second time from the QByteArrays.
+A RIDGE frame is already an 8 bit palette GIF: a logical screen with a 256 color table, a
+graphic control extension with the transparent color, and one image. splice_gif copies the
+LZW image data of every frame as it is, and only writes around it:
+* the header and logical screen of the first frame, with its color table as the global table,
+* a NETSCAPE2.0 application extension for the loop count,
+* one graphic control extension per frame with its delay and transparent color. Every frame
+  is a whole picture, so each one is cleared before the next (disposal 2); else the transparent
+  pixels of a frame would show the previous frame.
+A frame whose color table differs from the global one keeps its table as a local color table.
+There is no pixel decode or encode, so the cost is copying bytes, and every frame of the
+animation has exactly the pixels of its source GIF.
+
+RollingGif refreshes a published animation in place of rebuilding it. Next to the GIF it keeps
+an index (anim_out + '.idx.json') with the byte offset, length, digest and frame names of every
+frame block. A refresh copies the blocks of the frames that stay in the window out of the old
+file, with only their delay rewritten, and parses and splices only the new frames, so its cost
+depends on the frames that changed, not on the length of the window. The index records the
+size and mtime of the GIF it describes; if the GIF was written by something else, it is not
+used and the animation is built from all the frames.
+'''
+
+SPLICE_LOOP=0           # NETSCAPE loop count, 0 loops forever
+DISPOSE_NONE=1          # GIF disposal method: leave the frame for the next one to draw over
+DISPOSE_BACKGROUND=2    # GIF disposal method: clear the frame before the next one
+ROLLING_INDEX='.idx.json'   # suffix of the frame block index of a rolling animation
+
+import os
+import json
+import mmap
+import struct
+
+from frame_index import frame_digest
+from radar_publish import publish_atomic
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+class GifFrame:
+    '''
+    The parts of a single-image GIF that splice_gif needs, as byte strings.
+    '''
+    def __init__(self, width, height, color_table, transparency, descriptor, image_data):
+        '''
+        :param color_table: color table bytes that apply to the image, local or else global.
+        :param transparency: transparent color index, or None.
+        :param descriptor: the 10 bytes of the image descriptor, from the 0x2c separator.
+        :param image_data: LZW minimum code size, data sub-blocks and the block terminator.
+        '''
+        self.width = width
+        self.height = height
+        self.color_table = color_table
+        self.transparency = transparency
+        self.descriptor = descriptor
+        self.image_data = image_data
+
+def table_size(packed):
+    '''
+    :param packed: packed field of a logical screen or image descriptor.
+    :return: bytes of the color table, 0 if there is none.
+    '''
+    return 3 * (2 << (packed & 7)) if packed & 0x80 else 0
+
+def skip_sub_blocks(data, pos):
+    '''
+    :return: position after the data sub-blocks that start at pos, including the terminator.
+    '''
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+def parse_gif(data):
+    '''
+    Split a GIF into its parts. Only the first image is used.
+    :param data: GIF bytes, e.g., a RIDGE frame.
+    :return: GifFrame
+    '''
+    data = bytes(data)
+    if data[:3] != b'GIF':
+        raise ValueError('parse_gif: not a GIF')
+    width, height, packed = struct.unpack('<HHB', data[6:11])
+    pos = 13 + table_size(packed)
+    global_table = data[13:pos]
+    transparency = None
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:
+            if data[pos + 1] == 0xf9 and data[pos + 3] & 1:
+                transparency = data[pos + 6]
+            pos = skip_sub_blocks(data, pos + 2)
+        elif block == 0x2c:
+            descriptor = data[pos:pos + 10]
+            start = pos + 10 + table_size(descriptor[9])
+            color_table = data[pos + 10:start] or global_table
+            end = skip_sub_blocks(data, start + 1)
+            # the local table, if any, goes back in at assembly
+            return GifFrame(width, height, color_table, transparency, descriptor[:9] + bytes([descriptor[9] & 0x40]),
+                            data[start:end])
+        else:
+            break
+    raise ValueError('parse_gif: no image')
+
+def graphic_control(delay_cs, transparency, disposal=DISPOSE_BACKGROUND):
+    '''
+    :param delay_cs: delay in hundredths of a second.
+    :param disposal: what is done with the frame before the next one is drawn.
+    :return: graphic control extension bytes.
+    '''
+    if transparency is None:
+        return struct.pack('<BBBBHBB', 0x21, 0xf9, 4, disposal << 2, delay_cs, 0, 0)
+    return struct.pack('<BBBBHBB', 0x21, 0xf9, 4, (disposal << 2) | 1, delay_cs, transparency, 0)
+
+def table_bits(color_table):
+    '''
+    :return: size field of the packed byte for a color table of len(color_table) bytes.
+    '''
+    bits = 0
+    while 3 * (2 << bits) < len(color_table):
+        bits += 1
+    return bits
+
+def gif_header(frames, loop=SPLICE_LOOP):
+    '''
+    :param frames: list of GifFrame. The first one gives the global color table.
+    :return: bytes of the header, logical screen, global color table and loop extension.
+    '''
+    global_table = frames[0].color_table
+    width = max([f.width for f in frames])
+    height = max([f.height for f in frames])
+    bits = table_bits(global_table)
+    # decoders that clear to the background color, not to transparent, then clear to the transparent color
+    background = frames[0].transparency or 0
+    return b''.join([b'GIF89a', struct.pack('<HHBBB', width, height, 0x80 | (bits << 4) | bits, background, 0),
+                     global_table, b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00'])
+
+def header_table(header):
+    '''
+    :param header: bytes from gif_header.
+    :return: the global color table in it.
+    '''
+    return header[13:13 + table_size(header[10])]
+
+def frame_block(frame, delay_cs, global_table, disposal=DISPOSE_BACKGROUND):
+    '''
+    :param frame: GifFrame.
+    :param delay_cs: delay in hundredths of a second.
+    :param global_table: global color table of the animation.
+    :param disposal: GIF disposal method of the frame.
+    :return: bytes of the frame in the animation, starting with its graphic control extension.
+    '''
+    control = graphic_control(delay_cs, frame.transparency, disposal)
+    if frame.color_table == global_table:
+        return control + frame.descriptor + frame.image_data
+    descriptor = frame.descriptor[:9] + bytes([frame.descriptor[9] | 0x80 | table_bits(frame.color_table)])
+    return control + descriptor + frame.color_table + frame.image_data
+
+def splice_frames(frames, duration, loop=SPLICE_LOOP):
+    '''
+    :param frames: list of GifFrame.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :param loop: number of loops, 0 for ever.
+    :return: bytes of the animated GIF.
+    '''
+    if not frames:
+        raise ValueError('splice_frames: no frames')
+    durations = duration if isinstance(duration, (list, tuple)) else [duration] * len(frames)
+    global_table = frames[0].color_table
+    out = [gif_header(frames, loop)]
+    for frame, secs in zip(frames, durations):
+        out.append(frame_block(frame, int(round(secs * 100)), global_table))
+    out.append(b'\x3b')
+    local = len([f for f in frames if f.color_table != global_table])
+    if local:
+        logger.debug('splice_frames: %d of %d frames with a local color table' %(local, len(frames)))
+    return b''.join(out)
+
+def splice_gif(ims_bytes, duration, loop=SPLICE_LOOP):
+    '''
+    Assemble an animated GIF from the bytes of single-frame GIFs.
+    :param ims_bytes: list of GIF bytes (or QByteArray), in display order.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :return: bytes of the animated GIF.
+    '''
+    return splice_frames([parse_gif(img_bytes) for img_bytes in ims_bytes], duration, loop)
+
+class RollingGif:
+    '''
+    A published animated GIF with the index of its frame blocks, refreshed by copying the
+    blocks it keeps and splicing in the new frames.
+    Consecutive identical frames share one block that is shown longer, as in create_anim_gif.
+    '''
+    def __init__(self, anim_out, duration, loop=SPLICE_LOOP):
+        '''
+        :param anim_out: GIF filename.
+        :param duration: seconds each frame is shown.
+        :param loop: number of loops, 0 for ever.
+        '''
+        self.anim_out = anim_out
+        self.index_path = anim_out + ROLLING_INDEX
+        self.delay_cs = int(round(duration * 100))
+        self.loop = loop
+        self.copied = 0     # frame blocks copied from the old file by the last update
+        self.added = 0      # frame blocks spliced from new frames by the last update
+        self.index = self.load_index()
+
+    def load_index(self):
+        '''
+        :return: the index of the published animation, or None if there is none or it is stale.
+        '''
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            st = os.stat(self.anim_out)
+        except (OSError, ValueError):
+            return None
+        if index.get('size') != st.st_size or index.get('mtime_ns') != st.st_mtime_ns:
+            logger.debug('RollingGif: %s changed since its index was written' %(self.anim_out))
+            return None
+        return index
+
+    def retained(self, names):
+        '''
+        :param names: RIDGE filenames of the next animation.
+        :return: set of those that are in the published animation, whose bytes are not needed.
+        '''
+        if self.index is None:
+            return set()
+        published = set([name for block in self.index['blocks'] for name in block['names']])
+        return set(names) & published
+
+    def update(self, names, ims_bytes):
+        '''
+        Write the animation of names and its index.
+        :param names: RIDGE filenames of the frames, in display order.
+        :param ims_bytes: dict of GIF bytes by filename, at least for the names not in retained(names).
+        :return: size of the animation in bytes.
+        '''
+        if not names:
+            raise ValueError('RollingGif.update: no frames')
+        old_blocks = {}
+        for block in (self.index['blocks'] if self.index else []):
+            for name in block['names']:
+                old_blocks[name] = block
+        # runs of identical frames: [names, digest, old block or GifFrame]
+        runs = []
+        for name in names:
+            if name in old_blocks:
+                source = old_blocks[name]
+                digest = source['digest']
+            elif name in ims_bytes:
+                source = parse_gif(ims_bytes[name])
+                digest = frame_digest(bytes(ims_bytes[name])).hex()
+            else:
+                raise ValueError('RollingGif.update: no bytes for %s' %(name))
+            if runs and runs[-1][1] == digest:
+                runs[-1][0].append(name)
+            else:
+                runs.append([[name], digest, source])
+        new_frames = [source for n, d, source in runs if isinstance(source, GifFrame)]
+        if self.index:
+            with open(self.anim_out, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                gif_bytes, blocks = self.assemble(data, runs, new_frames)
+        else:
+            gif_bytes, blocks = self.assemble(b'', runs, new_frames)
+        publish_atomic(self.anim_out, gif_bytes)
+        st = os.stat(self.anim_out)
+        self.index = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'blocks': blocks}
+        publish_atomic(self.index_path, json.dumps(self.index).encode())
+        logger.debug('RollingGif: %s copied %d blocks, added %d' %(self.anim_out, self.copied, self.added))
+        return len(gif_bytes)
+
+    def assemble(self, data, runs, new_frames):
+        '''
+        :param data: bytes (or mmap) of the published animation, empty if there is no index.
+        :return: tuple (GIF bytes, list of block dicts for the index)
+        '''
+        if self.index:
+            header = bytearray(data[:self.index['blocks'][0]['offset']])
+            width, height = struct.unpack('<HH', header[6:10])
+            if new_frames:
+                # a bigger frame grows the logical screen
+                struct.pack_into('<HH', header, 6, max([width] + [f.width for f in new_frames]),
+                                 max([height] + [f.height for f in new_frames]))
+            # the background is the transparent color of the first frame, as in gif_header
+            first = runs[0][2]
+            if isinstance(first, GifFrame):
+                header[11] = first.transparency or 0
+            else:
+                control = data[first['offset']:first['offset'] + 8]
+                header[11] = control[6] if control[3] & 1 else 0
+        else:
+            header = gif_header(new_frames, self.loop)
+        global_table = header_table(header)
+        pieces = [bytes(header)]
+        pos = len(header)
+        blocks = []
+        self.copied = 0
+        self.added = 0
+        for run_names, digest, source in runs:
+            delay_cs = self.delay_cs * len(run_names)
+            start = pos
+            if isinstance(source, GifFrame):
+                block = frame_block(source, delay_cs, global_table)
+                pieces.append(block)
+                pos += len(block)
+                self.added += 1
+            else:
+                # the delay is at bytes 4 and 5 of the graphic control extension that starts the block
+                offset, length = source['offset'], source['length']
+                pieces += [data[offset:offset + 4], struct.pack('<H', delay_cs), data[offset + 6:offset + length]]
+                pos += length
+                self.copied += 1
+            blocks.append({'names': run_names, 'digest': digest, 'offset': start, 'length': pos - start})
+        pieces.append(b'\x3b')
+        return (b''.join(pieces), blocks)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Per-host rate limiting and circuit breaking for requests to radar.weather.gov.
+
+When animations are built for many stations in one process, every RadarAnimator sends its
+requests to the same host. During an NWS slowdown the timeouts and retries pile up and make it
+worse. One HostGuard per host is shared by every fetcher in the process (FrameFetcher and
+AsyncRadarEngine get it with get_host_guard):
+* a token bucket limits the request rate to the host, and counts the time callers were throttled,
+* the latencies of recent successful requests are kept, e.g., to decide when to hedge a request,
+* a circuit breaker opens after several consecutive failures. While it is open, requests fail at
+  once with HostUnavailable instead of opening more stalled sockets. After a cool-down, one
+  request is let through to test the host, and the breaker closes again if it succeeds.
+  A test request that is cancelled, or that never reports back within the cool-down, does not
+  keep the circuit shut: the next request becomes the test.
+'''
+
+HOST_RATE=10.0          # requests per second to one host
+HOST_BURST=10           # requests that may be sent at once before throttling starts
+BREAKER_FAILURES=5      # consecutive failures that open the circuit
+BREAKER_RESET=60.0      # seconds the circuit stays open before a test request
+LATENCY_SAMPLES=100     # recent request latencies kept per host
+
+import time
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+class HostUnavailable(IOError):
+    '''
+    Raised instead of sending a request while the circuit for the host is open.
+    '''
+    pass
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket. Callers reserve a token and sleep for the returned delay,
+    with time.sleep in threads or asyncio.sleep in coroutines.
+    '''
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        '''
+        :param rate: tokens added per second.
+        :param burst: maximum number of tokens.
+        '''
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        '''
+        Take one token, going into debt if there is none.
+        :return: seconds to wait before the request may be sent.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1.0
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class CircuitBreaker:
+    '''
+    Counts consecutive failures of a host. States are 'closed' (normal), 'open' (fail fast)
+    and 'half-open' (one test request in flight).
+    '''
+    def __init__(self, max_failures=BREAKER_FAILURES, reset_time=BREAKER_RESET):
+        '''
+        :param max_failures: consecutive failures that open the circuit.
+        :param reset_time: seconds before an open circuit lets a test request through.
+        '''
+        self.max_failures = max_failures
+        self.reset_time = reset_time
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0    # when the circuit opened, or when the test request was let through
+        self.lock = threading.Lock()
+
+    def allow(self):
+        '''
+        :return: True if a request may be sent now.
+        '''
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            # a test request that has not reported back after reset_time is given up on
+            if now - self.opened_at >= self.reset_time:
+                self.state = 'half-open'
+                self.opened_at = now
+                return True     # this is the test request
+            return False
+
+    def record_cancel(self):
+        '''
+        A request was cancelled before it had an answer. If it was the test request, the
+        host is still untested: let the next request test it.
+        '''
+        with self.lock:
+            if self.state == 'half-open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_time
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.max_failures:
+                if self.state != 'open':
+                    logger.debug('CircuitBreaker: open after %d failures' %(self.failures))
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class HostGuard:
+    '''
+    Token bucket and circuit breaker of one host, with counters.
+    '''
+    def __init__(self, host, rate=HOST_RATE, burst=HOST_BURST,
+                 max_failures=BREAKER_FAILURES, reset_time=BREAKER_RESET):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(max_failures, reset_time)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.throttled_secs = 0.0
+        self.rejected = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def check(self):
+        '''
+        Raise HostUnavailable if the circuit is open, else reserve a token.
+        :return: seconds the caller must wait before sending the request.
+        '''
+        if not self.breaker.allow():
+            with self.lock:
+                self.rejected += 1
+            raise HostUnavailable('%s is unavailable, circuit open' %(self.host))
+        delay = self.bucket.reserve()
+        with self.lock:
+            self.requests += 1
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_secs += delay
+        return delay
+
+    def acquire(self):
+        '''
+        Blocking version of check, for threads.
+        '''
+        delay = self.check()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        '''
+        Version of check for coroutines.
+        '''
+        delay = self.check()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.record_cancel()
+                raise
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+        self.breaker.record_failure()
+
+    def record_cancel(self):
+        self.breaker.record_cancel()
+
+    def record_latency(self, secs):
+        with self.lock:
+            self.latencies.append(secs)
+
+    def latency_percentile(self, percentile, min_samples=1):
+        '''
+        :param percentile: 0 to 100, e.g., 95
+        :param min_samples: number of latencies needed for a useful answer.
+        :return: seconds, or None if fewer than min_samples latencies have been recorded.
+        '''
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples or len(samples) < min_samples:
+            return None
+        idx = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+    def stats(self):
+        '''
+        :return: dict of counters, e.g., for logging after a batch of builds.
+        '''
+        with self.lock:
+            return {'host': self.host, 'state': self.breaker.state, 'requests': self.requests,
+                    'throttled': self.throttled, 'throttled_secs': round(self.throttled_secs, 3),
+                    'rejected': self.rejected, 'failures': self.failures}
+
+host_guards = {}
+host_guards_lock = threading.Lock()
+
+def get_host_guard(url):
+    '''
+    :param url: any URL on the host.
+    :return: the HostGuard shared by all fetchers in this process for the host of url.
+    '''
+    host = urlsplit(url).netloc.lower()
+    with host_guards_lock:
+        guard = host_guards.get(host)
+        if guard is None:
+            guard = HostGuard(host)
+            host_guards[host] = guard
+        return guard
+
+def set_host_limits(url, rate=HOST_RATE, burst=HOST_BURST):
+    '''
+    Change the request rate allowed to the host of url, e.g., for a mirror or a local test server.
+    '''
+    get_host_guard(url).bucket = TokenBucket(rate, burst)
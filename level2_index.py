@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Persistent index of NEXRAD Level II volume keys in the noaa-nexrad-level2 bucket.
+
+nexradaws/Tutorial.py asks the bucket for the available years, months, days, radars and scans
+one call after another, and every call is a listing round trip to S3. A historical job repeats
+all of them, although a past day never changes. Level2Index keeps what the bucket listed in
+an SQLite file:
+* the sub-directories of a prefix (years, months, days, radars of a day),
+* the volume keys of a radar and day, with their scan times and sizes.
+It fills lazily: a prefix or a day is listed the first time it is asked for. A listing of a
+period that is over (plus SETTLE_SECS for late uploads) is complete and never asked again.
+The current day is refreshed incrementally: at most every REFRESH_SECS, and only for the keys
+after the last one seen (S3 StartAfter). Range queries then run locally on the scans table.
+The bucket is either S3Bucket (boto3, anonymous access) or LocalBucket, a directory with the
+same layout, e.g., a copy of some days of the bucket:
+    <root>/YYYY/MM/DD/RADAR/RADARYYYYMMDD_HHMMSS_V06
+
+Usage: python level2_index.py -r KMUX -s 2019-05-15T07:00 -e 2019-05-15T14:00 [-b bucket_dir] [-d level2_index.sqlite]
+'''
+
+LEVEL2_BUCKET='noaa-nexrad-level2'
+LEVEL2_URL='https://noaa-nexrad-level2.s3.amazonaws.com/'
+INDEX_DB='level2_index.sqlite'
+REFRESH_SECS=60         # shortest time between two listings of an incomplete prefix or day
+SETTLE_SECS=3600        # a period is complete this long after its end; uploads can be late
+
+import os
+import re
+import time
+import sqlite3
+import calendar
+import datetime as dt
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+# RADARYYYYMMDD_HHMMSS..., e.g., KMUX20190515_070226_V06 or KMUX20100515_070226_V03.gz
+SCAN_KEY_RE = re.compile(r'([A-Z0-9]{4})(\d{8})_(\d{6})')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS prefixes (
+    prefix TEXT PRIMARY KEY,    -- e.g., '2019/05/', '' for the top
+    listed_at REAL NOT NULL,
+    complete INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS children (
+    prefix TEXT NOT NULL,
+    child TEXT NOT NULL,        -- e.g., '15' for the day 2019/05/15/
+    PRIMARY KEY (prefix, child)
+);
+CREATE TABLE IF NOT EXISTS days (
+    radar TEXT NOT NULL,
+    day TEXT NOT NULL,          -- YYYY/MM/DD
+    listed_at REAL NOT NULL,
+    complete INTEGER NOT NULL,
+    last_key TEXT,              -- StartAfter for the next incremental listing
+    PRIMARY KEY (radar, day)
+);
+CREATE TABLE IF NOT EXISTS scans (
+    key TEXT PRIMARY KEY,
+    radar TEXT NOT NULL,
+    day TEXT NOT NULL,
+    scan_time TEXT NOT NULL,    -- YYYY-MM-DD HH:MM:SS UTC
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_radar_time ON scans (radar, scan_time);
+'''
+
+def scan_time_of(key):
+    '''
+    :param key: bucket key or filename of a volume scan.
+    :return: 'YYYY-MM-DD HH:MM:SS' scan time, or None if key is not a volume scan (e.g., an MDM file).
+    '''
+    name = key.rsplit('/', 1)[-1]
+    match = SCAN_KEY_RE.match(name)
+    if not match or name.endswith('_MDM'):
+        return None
+    d, t = match.group(2), match.group(3)
+    return '%s-%s-%s %s:%s:%s' %(d[0:4], d[4:6], d[6:8], t[0:2], t[2:4], t[4:6])
+
+def to_utc(dtobj):
+    '''
+    :param dtobj: datetime. A naive datetime is taken as UTC, like nexradaws does.
+    :return: naive datetime in UTC.
+    '''
+    if dtobj.tzinfo is not None:
+        dtobj = dtobj.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return dtobj
+
+def scan_url(key):
+    '''
+    :return: public HTTPS URL of a key in the bucket, for downloading without boto3.
+    '''
+    return LEVEL2_URL + key
+
+class LocalBucket:
+    '''
+    A directory laid out like the bucket, for tests and for days copied from S3.
+    '''
+    def __init__(self, root, latency=0.0):
+        '''
+        :param root: top directory, holding the YYYY directories.
+        :param latency: seconds added to every listing, to simulate the S3 round trip.
+        '''
+        self.root = root
+        self.latency = latency
+        self.requests = 0
+
+    def list(self, prefix, delimiter=True, start_after=None):
+        '''
+        :param prefix: key prefix ending with '/', or ''.
+        :param delimiter: True to list the sub-directories, False to list the keys.
+        :param start_after: only keys after this one.
+        :return: sorted list of child names (delimiter) or of tuples (key, size).
+        '''
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.root, *prefix.strip('/').split('/')) if prefix else self.root
+        if not os.path.isdir(path):
+            return []
+        with os.scandir(path) as entries:
+            if delimiter:
+                return sorted([e.name for e in entries if e.is_dir()])
+            keys = [(prefix + e.name, e.stat().st_size) for e in entries if e.is_file()]
+        return sorted([k for k in keys if start_after is None or k[0] > start_after])
+
+class S3Bucket:
+    '''
+    The public NEXRAD bucket on S3, read anonymously with boto3.
+    '''
+    def __init__(self, bucket=LEVEL2_BUCKET):
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.config import Config
+        self.bucket = bucket
+        self.client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        self.requests = 0
+
+    def list(self, prefix, delimiter=True, start_after=None):
+        '''
+        Same as LocalBucket.list; every page is one request.
+        '''
+        args = {'Bucket': self.bucket, 'Prefix': prefix}
+        if delimiter:
+            args['Delimiter'] = '/'
+        if start_after:
+            args['StartAfter'] = start_after
+        result = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(**args):
+            self.requests += 1
+            if delimiter:
+                result.extend([p['Prefix'][len(prefix):].rstrip('/') for p in page.get('CommonPrefixes', [])])
+            else:
+                result.extend([(o['Key'], o['Size']) for o in page.get('Contents', [])])
+        return sorted(result)
+
+class Level2Index:
+    '''
+    SQLite index of the bucket, with the query methods of nexradaws.NexradAwsInterface.
+    Scan queries return bucket keys, oldest first; scan_url(key) is the download URL.
+    '''
+    def __init__(self, db_path=INDEX_DB, bucket=None, refresh=REFRESH_SECS, settle=SETTLE_SECS):
+        '''
+        :param db_path: SQLite file, created if it does not exist. ':memory:' for a throwaway index.
+        :param bucket: LocalBucket or S3Bucket. Default is S3Bucket().
+        :param refresh: seconds between two listings of an incomplete prefix or day.
+        :param settle: seconds after the end of a period before its listing is complete.
+        '''
+        self.bucket = bucket if bucket is not None else S3Bucket()
+        self.refresh = refresh
+        self.settle = settle
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self.listings = 0   # bucket listings made by this index
+
+    def close(self):
+        self.db.close()
+
+    def is_over(self, start, days=0, months=0, years=0):
+        '''
+        :param start: datetime, start of a period in UTC.
+        :return: True if the period ended more than settle seconds ago.
+        '''
+        if years:
+            end = start.replace(year=start.year + years)
+        elif months:
+            month = start.month + months - 1
+            end = start.replace(year=start.year + month // 12, month=month % 12 + 1)
+        else:
+            end = start + dt.timedelta(days=days)
+        return calendar.timegm(end.timetuple()) + self.settle < time.time()
+
+    def children(self, prefix, complete):
+        '''
+        :param prefix: key prefix ending with '/', or ''.
+        :param complete: True if the listing of prefix can no longer change.
+        :return: sorted child names of prefix, listed from the bucket only when needed.
+        '''
+        row = self.db.execute('SELECT listed_at, complete FROM prefixes WHERE prefix=?', (prefix,)).fetchone()
+        if row is None or not (row[1] or time.time() - row[0] < self.refresh):
+            names = self.bucket.list(prefix, delimiter=True)
+            self.listings += 1
+            with self.db:
+                self.db.execute('DELETE FROM children WHERE prefix=?', (prefix,))
+                self.db.executemany('INSERT INTO children (prefix, child) VALUES (?, ?)',
+                                    [(prefix, name) for name in names])
+                self.db.execute('INSERT OR REPLACE INTO prefixes (prefix, listed_at, complete) VALUES (?, ?, ?)',
+                                (prefix, time.time(), int(complete)))
+            logger.debug('children: listed %s, %d entries' %(prefix or '/', len(names)))
+            return names
+        return [r[0] for r in self.db.execute('SELECT child FROM children WHERE prefix=? ORDER BY child', (prefix,))]
+
+    def get_avail_years(self):
+        return self.children('', False)
+
+    def get_avail_months(self, year):
+        year = '%04d' %(int(year))
+        return self.children(year + '/', self.is_over(dt.datetime(int(year), 1, 1), years=1))
+
+    def get_avail_days(self, year, month):
+        start = dt.datetime(int(year), int(month), 1)
+        return self.children(start.strftime('%Y/%m/'), self.is_over(start, months=1))
+
+    def get_avail_radars(self, year, month, day):
+        start = dt.datetime(int(year), int(month), int(day))
+        return self.children(start.strftime('%Y/%m/%d/'), self.is_over(start, days=1))
+
+    def index_day(self, radar, day_start):
+        '''
+        Make sure the scans of a radar and day are in the index. A past day is listed once;
+        the current day is listed again after refresh seconds, from the last key seen.
+        :param radar: radar name, e.g., KMUX
+        :param day_start: datetime of 00:00 UTC of the day.
+        :return: number of keys added.
+        '''
+        day = day_start.strftime('%Y/%m/%d')
+        row = self.db.execute('SELECT listed_at, complete, last_key FROM days WHERE radar=? AND day=?',
+                              (radar, day)).fetchone()
+        if row is not None and (row[1] or time.time() - row[0] < self.refresh):
+            return 0
+        complete = self.is_over(day_start, days=1)
+        start_after = row[2] if row is not None else None
+        keys = self.bucket.list('%s/%s/' %(day, radar), delimiter=False, start_after=start_after)
+        self.listings += 1
+        rows = []
+        for key, size in keys:
+            scan_time = scan_time_of(key)
+            if scan_time is not None:
+                rows.append((key, radar, day, scan_time, size))
+        # resume after the last volume scan: an MDM file can be listed before a later scan arrives
+        last_key = rows[-1][0] if rows else start_after
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO scans (key, radar, day, scan_time, size) VALUES (?, ?, ?, ?, ?)', rows)
+            self.db.execute('INSERT OR REPLACE INTO days (radar, day, listed_at, complete, last_key) VALUES (?, ?, ?, ?, ?)',
+                            (radar, day, time.time(), int(complete), last_key))
+        logger.debug('index_day: %s %s +%d scans%s' %(radar, day, len(rows), ' (complete)' if complete else ''))
+        return len(rows)
+
+    def get_avail_scans(self, year, month, day, radar):
+        '''
+        :return: keys of all scans of radar on the day, oldest first.
+        '''
+        start = dt.datetime(int(year), int(month), int(day))
+        return self.get_avail_scans_in_range(start, start + dt.timedelta(days=1) - dt.timedelta(seconds=1), radar)
+
+    def get_avail_scans_in_range(self, start, end, radar):
+        '''
+        :param start: datetime, first scan time. Naive datetimes are UTC.
+        :param end: datetime, last scan time.
+        :param radar: radar name, e.g., KMUX
+        :return: keys of the scans of radar in [start, end], oldest first.
+        '''
+        start, end = to_utc(start), to_utc(end)
+        radar = radar.upper()
+        day = dt.datetime(start.year, start.month, start.day)
+        while day <= end:
+            self.index_day(radar, day)
+            day += dt.timedelta(days=1)
+        rows = self.db.execute('SELECT key FROM scans WHERE radar=? AND scan_time BETWEEN ? AND ? ORDER BY scan_time',
+                               (radar, start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')))
+        return [r[0] for r in rows]
+
+def main(radar='KMUX', start=None, end=None, bucket_dir=None, db_path=INDEX_DB):
+    bucket = LocalBucket(bucket_dir) if bucket_dir else S3Bucket()
+    index = Level2Index(db_path, bucket)
+    end = end or dt.datetime.utcnow()
+    start = start or end - dt.timedelta(hours=1)
+    t0 = time.perf_counter()
+    keys = index.get_avail_scans_in_range(start, end, radar)
+    print('%d scans of %s from %s to %s in %.3f s, %d listings' %(len(keys), radar, start, end,
+          time.perf_counter() - t0, index.listings))
+    for key in keys:
+        print(scan_url(key))
+    index.close()
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hr:s:e:b:d:'
+    longOpts  = ['help', 'radar=', 'start=', 'end=', 'bucket=', 'db=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    radar = 'KMUX'
+    start = None
+    end = None
+    bucket_dir = None
+    db_path = INDEX_DB
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-r','--radar'):
+            radar = val
+        elif arg in ('-s','--start'):
+            start = dt.datetime.fromisoformat(val)
+        elif arg in ('-e','--end'):
+            end = dt.datetime.fromisoformat(val)
+        elif arg in ('-b','--bucket'):
+            bucket_dir = val
+        elif arg in ('-d','--db'):
+            db_path = val
+    main(radar=radar, start=start, end=end, bucket_dir=bucket_dir, db_path=db_path)
@@ -18,7 +18,12 @@ to fetch the data and process it into images on my desktop system: this will nev
 GIF_FORMAT='GIF-PIL'    # You must install Pillow, not PIL for Python 2.7
 #GIF_FORMAT='GIF-FI'    # FreeImage does not write correct anim GIF in Python 2.7
 RADAR_STATION='MUX'     # Mt. Umunhum, Los Gatos, CA
+RADAR_PRODUCT='N0R'     # base reflectivity; N0V velocity, NCR composite reflectivity, N1P one-hour precipitation...
 ANIM_FILE_OUT='radar_anim.gif'
+FRAME_DURATION=0.5      # seconds each frame is shown
+RUN_DEADLINE=60         # seconds by which the animation must be written, None to wait for every frame
+FETCH_TIMEOUT=10        # seconds for each urlopen request
+FETCH_ENGINE='async'    # 'threads' for RadarAnimator with FrameFetcher, 'async' for radar_async.AsyncRadarEngine
 
 import os
 import numpy as np
@@ -30,8 +35,23 @@ import imageio
 #imageio.plugins.freeimage.download()
 import time
 from array2gif import write_gif
+from frame_cache import FrameCache, CACHE_DIR
+from radar_fetch import FrameFetcher, FETCH_WORKERS
+from host_guard import get_host_guard, HostUnavailable
+from radar_publish import publish_atomic, is_file_output, BuildLock, build_settings, LOCK_WAIT
+from ridge_listing import ListingParser, LISTING_CHUNK
+from frame_times import FrameTuples
+from frame_index import get_frame_index, frame_digest
+from frame_archive import FrameArchive, archive_frames
+from radar_sites import get_site_catalog
+from gif_splice import splice_gif, RollingGif
+from gif_delta import delta_gif
+from anim_formats import encode_anim, anim_filename, ANIM_FORMATS
+from frame_catalog import FrameCatalog
+from radar_outputs import write_outputs, check_outputs, output_paths
 
 from urllib.request import urlopen,Request
+from urllib.error import HTTPError
 from html.parser import HTMLParser
 
 import logging
@@ -39,6 +59,51 @@ import my_logger
 logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
 logger.debug('start')
 
+def guarded_urlopen(url, timeout=FETCH_TIMEOUT):
+    '''
+    urlopen through the HostGuard of the host (host_guard.py), as FrameFetcher.get does.
+    :return: the response. Raises host_guard.HostUnavailable while the circuit of the host is open.
+    '''
+    guard = get_host_guard(url)
+    guard.acquire()
+    try:
+        response = urlopen(url, timeout=timeout)
+    except HTTPError as err:
+        if err.code >= 500 or err.code == 429:
+            guard.record_failure()
+        else:
+            guard.record_success()  # the host answered, the URL is wrong
+        raise
+    except OSError:
+        # URLError, timeouts, refused connections
+        guard.record_failure()
+        raise
+    guard.record_success()
+    return response
+
+def merge_repeated_frames(ims, duration=FRAME_DURATION, keys=None):
+    '''
+    Make one longer frame of consecutive identical frames.
+    :param ims: list of frames as numpy arrays.
+    :param duration: seconds each input frame is shown.
+    :param keys: optional content hashes of the frames. Default is to compare the arrays.
+    :return: tuple (list of frames, list of durations in seconds)
+    '''
+    frames = []
+    durations = []
+    for idx, im in enumerate(ims):
+        if frames:
+            if keys is not None:
+                same = keys[idx] == keys[idx - 1]
+            else:
+                same = im is frames[-1] or np.array_equal(im, frames[-1])
+            if same:
+                durations[-1] += duration
+                continue
+        frames.append(im)
+        durations.append(duration)
+    return (frames, durations)
+
 # to use HTMLParser I need to implement my own class?
 class MyHTMLParser(HTMLParser):
     '''
@@ -84,9 +149,54 @@ class MyHTMLParser(HTMLParser):
 
 class RadarAnimator:
     global GIF_FORMAT
-    img_root_url = 'https://radar.weather.gov/ridge/RadarImg/N0R/'
-    def __init__(self, station, twindow=70):
+    img_base_url = 'https://radar.weather.gov/ridge/RadarImg/'
+    product = RADAR_PRODUCT
+    def __init__(self, station, twindow=70, cache=None, fetcher=None, index=None, archive=None, product=None,
+                 catalog=None, splice=False, rolling=False, delta=False, anim_format='gif', outputs=None):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param product: RIDGE product, e.g., "N0V". Default is RADAR_PRODUCT.
+        :param twindow: time window in minutes.
+        :param cache: optional FrameCache. Frames found in the cache are not downloaded again.
+        :param fetcher: optional FrameFetcher to download frames concurrently. Default is one at a time.
+        :param index: FrameIndex of the station. Default is the one shared in the process.
+        :param archive: optional FrameArchive. New frames are added to it as they are fetched.
+        :param catalog: optional FrameCatalog, which records the frames seen, fetched, archived and encoded.
+        :param splice: assemble the animation from the GIF bytes of the frames (gif_splice.py),
+            without decoding and encoding them. self.img_gifs are then GIF bytes, not arrays.
+        :param rolling: refresh a GIF file output with gif_splice.RollingGif, which copies the frames
+            already in the published animation and splices only the new ones. Implies splice.
+        :param delta: write only the rectangle of each frame that changed (gif_delta.py).
+            self.img_gifs are then GIF bytes, as with splice.
+        :param anim_format: 'gif', or 'webp' or 'apng' (anim_formats.py), written from the GIF bytes of the frames.
+        :param outputs: optional list of outputs written together to a file output, e.g., ['gif', 'webp', 'mp4']
+            (radar_outputs.py). The frames are decoded once and each output is encoded in its own process.
+            anim_out must then be a filename (check_anim_out).
+        '''
+        if anim_format not in ANIM_FORMATS:
+            raise ValueError('RadarAnimator: unknown format %s' %(anim_format))
+        if rolling and anim_format != 'gif':
+            raise ValueError('RadarAnimator: rolling output is only for GIF')
+        # fail before fetching anything if an output cannot be written here
+        check_outputs(outputs or [])
+        if rolling and outputs:
+            raise ValueError('RadarAnimator: rolling output is only for a single GIF')
         self.station = station.upper()
+        if product:
+            self.product = product.upper()
+        self.img_root_url = self.img_base_url + self.product + '/'
+        self.cache = cache
+        self.fetcher = fetcher
+        self.index = index if index is not None else get_frame_index(self.station, self.product)
+        self.archive = archive
+        self.catalog = catalog
+        self.splice = splice or rolling
+        self.rolling = rolling
+        self.delta = delta
+        self.anim_format = anim_format
+        self.outputs = list(outputs or [])
+        self.output_executor = None     # ProcessPoolExecutor for the outputs, default is a new pool per build
+        self.frame_bytes = self.splice or delta or anim_format != 'gif' or bool(self.outputs)    # self.img_gifs are GIF bytes, not arrays
         self.img_dir_url = self.img_root_url + self.station.upper() + '/'
         self.twindow = twindow
         self.start_time = -1
@@ -96,6 +206,7 @@ class RadarAnimator:
         self.img_list = []
         self.img_tuples = []
         self.img_gifs = []
+        self.failed = []    # RIDGE filenames left out of the last fetch because the host was unavailable
         self.start_img_list = False
         self.has_img_list = False
         self.has_img_tuples = False
@@ -229,18 +340,29 @@ class RadarAnimator:
     def fetch_img_gifs(self, image_list):
         '''
         Fetch all images in list by requesting from URL (HTTP).
+        If there is a frame cache, it is checked first and only the missing frames are requested.
         When imageio is used, the image is returned as a Numpy array with RGBA channels.
-        :return: list of GIFs
+        While the host is unavailable (host_guard.py) the frames that are not cached are left out,
+        with their names in self.failed, and self.img_tuples is reduced to the frames returned.
+        :return: list of GIFs. Raises HostUnavailable if no frame could be had.
         '''
         # read from URL and store images
         ims_gif = []
         if True:    # use imageio to read
-            for f in image_list:
-                url = self.img_dir_url + '/' + f[2]
-                logger.debug('fetch_img_gifs: '+url)
-                # reading from HTTP stream does not allow seek (which Pillow uses)
-                img = imageio.imread(imageio.core.urlopen(url).read(), format=self.gif_format)   # it's a numpy array
-                ims_gif.append(img)     
+            ims_bytes = self.fetch_img_bytes_list([f[2] for f in image_list])
+            if self.archive is not None:
+                archive_frames(self.archive, image_list, ims_bytes, self.catalog)
+            if self.cache and image_list:
+                self.cache.evict(self.station, self.product, newest=image_list[-1][0], catalog=self.catalog)
+            self.failed = [f[2] for f, img_bytes in zip(image_list, ims_bytes) if img_bytes is None]
+            if self.failed:
+                logger.debug('fetch_img_gifs: host unavailable, left out %s' %(str(self.failed)))
+                if len(self.failed) == len(image_list):
+                    raise HostUnavailable('fetch_img_gifs: no frames for %s, host unavailable' %(self.station))
+                image_list = [f for f, img_bytes in zip(image_list, ims_bytes) if img_bytes is not None]
+                ims_bytes = [img_bytes for img_bytes in ims_bytes if img_bytes is not None]
+                self.img_tuples = image_list
+            ims_gif = ims_bytes if self.frame_bytes else self.decode_img_bytes(ims_bytes)
         else:   # use Request and Image classes
             for f in image_list:
                 url = self.img_dir_url + '/' + f[2]
@@ -256,6 +378,97 @@ class RadarAnimator:
                     ims_gif.append(pil_im)
         return ims_gif
 
+    def decode_img_bytes(self, ims_bytes):
+        '''
+        Decode GIF bytes with imageio. Identical frames are decoded once and share one array.
+        :param ims_bytes: list of GIF bytes.
+        :return: list of numpy arrays with RGBA channels.
+        '''
+        decoded = {}
+        ims_gif = []
+        for img_bytes in ims_bytes:
+            digest = frame_digest(img_bytes)
+            if digest not in decoded:
+                decoded[digest] = imageio.imread(img_bytes, format=self.gif_format)   # it's a numpy array
+            ims_gif.append(decoded[digest])
+        if len(decoded) < len(ims_bytes):
+            logger.debug('decode_img_bytes: %d identical frames' %(len(ims_bytes) - len(decoded)))
+        return ims_gif
+
+    def fetch_img_bytes_list(self, imgfiles):
+        '''
+        Get the GIF bytes of all frames. Cached frames are read from the cache. The others are
+        fetched concurrently if there is a FrameFetcher, else one after another.
+        :param imgfiles: list of RIDGE filenames.
+        :return: list of GIF bytes, in the same order as imgfiles. None for a frame that was not
+            requested because the host is unavailable.
+        '''
+        if self.fetcher is None:
+            ims_bytes = []
+            for imgfile in imgfiles:
+                try:
+                    ims_bytes.append(self.fetch_img_bytes(imgfile))
+                except HostUnavailable as err:
+                    logger.debug('fetch_img_bytes_list: giving up on %s (%s)' %(imgfile, repr(err)))
+                    ims_bytes.append(None)
+            return ims_bytes
+        ims_bytes = [None] * len(imgfiles)
+        missing = []
+        for idx,imgfile in enumerate(imgfiles):
+            if self.cache:
+                ims_bytes[idx] = self.cache.get(self.station, self.product, imgfile)
+            if ims_bytes[idx] is None:
+                missing.append(idx)
+            else:
+                self.record_frame(imgfile, ims_bytes[idx], self.cache.frame_path(self.station, self.product, imgfile))
+        logger.debug('fetch_img_bytes_list: fetch %d of %d frames' %(len(missing), len(imgfiles)))
+        urls = [self.img_dir_url + '/' + imgfiles[idx] for idx in missing]
+        for idx,url,img_bytes in zip(missing, urls, self.fetcher.fetch_all(urls, skip_unavailable=True)):
+            if img_bytes is None:
+                continue
+            ims_bytes[idx] = img_bytes
+            fpath = None
+            if self.cache:
+                fpath = self.cache.put(self.station, self.product, imgfiles[idx], img_bytes)
+            self.record_frame(imgfiles[idx], img_bytes, fpath, self.fetcher.latencies.get(url))
+        return ims_bytes
+
+    def fetch_img_bytes(self, imgfile):
+        '''
+        Get the GIF bytes of one frame, from the cache if possible, else from NWS.
+        :param imgfile: RIDGE filename of the frame.
+        :return: GIF bytes. Raises HostUnavailable while the circuit of the host is open.
+        '''
+        if self.cache:
+            img_bytes = self.cache.get(self.station, self.product, imgfile)
+            if img_bytes is not None:
+                logger.debug('fetch_img_bytes: cached '+imgfile)
+                self.record_frame(imgfile, img_bytes, self.cache.frame_path(self.station, self.product, imgfile))
+                return img_bytes
+        url = self.img_dir_url + '/' + imgfile
+        logger.debug('fetch_img_bytes: '+url)
+        t0 = time.perf_counter()
+        # reading from HTTP stream does not allow seek (which Pillow uses)
+        with guarded_urlopen(url) as response:
+            img_bytes = response.read()
+        fetch_secs = time.perf_counter() - t0
+        fpath = None
+        if self.cache:
+            fpath = self.cache.put(self.station, self.product, imgfile, img_bytes)
+        self.record_frame(imgfile, img_bytes, fpath, fetch_secs)
+        return img_bytes
+
+    def record_frame(self, imgfile, img_bytes, path=None, fetch_secs=None):
+        '''
+        Record a frame that was fetched or read from the cache in the index and the catalog.
+        :param path: cache path of the frame, or None.
+        :param fetch_secs: seconds the download took, None if the frame came from the cache.
+        '''
+        self.index.update(imgfile, img_bytes, path)
+        if self.catalog is not None:
+            self.catalog.fetched(self.station, self.product, imgfile, img_bytes, path,
+                                 fetch_secs * 1000 if fetch_secs is not None else None)
+
     def calc_time_bounds(self, img_tuples):
         '''
         :param img_tuples: list of image names from NWS.
@@ -279,42 +492,66 @@ class RadarAnimator:
         Images are 600x550 8 bit GIF with RGBA channels.
         Generally we get 1 to three hours, images every 10 minutes.
         :param station: radar station name from NWS.
-        :return: list of GIF filenames available.
+        :return: list of GIF filenames available. Raises HostUnavailable while the host is failing
+            or cannot be reached; an HTTP error status is raised as HTTPError.
         '''
         logger.debug('get_nws_img_list: %s' %(self.img_dir_url))
-        with urlopen(self.img_dir_url) as response:
-            html = response.read()
-        logger.debug('get_nws_img_list: {}'.format(str(html)))
-        self.handle_img_list(html.decode('utf-8'))
+        hparse = ListingParser(self.station, self.product, twindow=self.twindow)
+        try:
+            with guarded_urlopen(self.img_dir_url) as response:
+                # stops reading once the parser has the whole time window
+                while not hparse.done:
+                    chunk = response.read(LISTING_CHUNK)
+                    if not chunk:
+                        break
+                    hparse.feed(chunk)
+        except (HostUnavailable, HTTPError):
+            raise
+        except OSError as err:
+            raise HostUnavailable('get_nws_img_list: %s listing failed (%s)' %(self.station, repr(err))) from err
+        logger.debug('get_nws_img_list: read %d bytes' %(hparse.nbytes))
+        self.handle_img_names(hparse.get_img_list())
 
     def handle_img_list(self, html):
         '''
         Process reply to img_list request.
-        Sets self.img_list. If there was an error, self.img_list=None.
+        :param html: the listing, bytes or str.
         '''
         logger.debug('handle_img_list: start')
-        hparse = MyHTMLParser(self.station)
+        hparse = ListingParser(self.station, self.product, twindow=self.twindow)
         hparse.feed(html)
-        self.img_list = hparse.get_img_list()
+        self.handle_img_names(hparse.get_img_list())
+
+    def handle_img_names(self, img_list):
+        '''
+        Add the frames to the index and take the image tuples of the time window from it.
+        Sets self.img_list and self.img_tuples.
+        :param img_list: GIF filenames from the listing, oldest first.
+        '''
+        self.img_list = img_list
         self.has_img_list = True
 
         if self.has_img_list:
             logger.debug("img_list len=%d" %(len(self.img_list)))
             # TODO: should really go back to an event handler loop
-            img_tuples = self.make_img_tuples(self.img_list)
+            self.index.extend(self.img_list)
+            if self.catalog is not None:
+                self.catalog.seen(self.station, self.product, self.img_list)
+            # the index may remember older frames that NWS no longer has
+            img_tuples = self.index.window(self.index.info(self.img_list[0])['time'], self.index.newest())
             self.calc_time_bounds(img_tuples)
             self.img_tuples = self.filter_img_tuples(img_tuples)
             logger.debug("img_tuples = %s" %(str(self.img_tuples)))
             # fire event to ask for image GIFs
     
     def make_img_tuples(self, img_list):
-        img_tuples = []
-        # Generate list of all images returned by HTML. It may go back a few hours.
-        for img in img_list:
-            img_tup = self.img_name_tuple(img)
-            #print(img_tup[1])
-            img_tuples.append(img_tup)
-        return img_tuples
+        '''
+        Generate list of all images returned by HTML. It may go back a few hours.
+        The timestamps are parsed all at once; a tuple is only made when a frame is used.
+        :param img_list: list of GIF filenames.
+        :return: frame_times.FrameTuples, a sequence of tuples like img_name_tuple returns.
+        '''
+        return FrameTuples(img_list)
     
     def get_img_tuples(self):
         # Fetch current GIF list from NOAA RIDGE system
@@ -337,24 +574,77 @@ class RadarAnimator:
         :param img_tuples: a list of tuples
         :return: filtered list of tuples
         '''
+        if isinstance(img_tuples, FrameTuples):
+            return img_tuples.window(self.start_time, self.end_time)
         imgs = [a for a in img_tuples if a[0] >= self.start_time and a[0] <= self.end_time]
         return imgs
         
+    def check_anim_out(self, anim_out):
+        '''
+        Raise ValueError if the animation can not be written to anim_out: outputs are files, not bytes.
+        '''
+        if self.outputs and not is_file_output(anim_out):
+            raise ValueError('RadarAnimator: outputs %s are written to files, not returned as bytes' %(','.join(self.outputs)))
+
     def create_anim_gif(self, anim_out):
         '''
         :param img_dir_url: NWS for the radar GIFs
         :param img_tuples: list of tuples that specify the GIF filenames.
         :param anim_out: either a GIF filename or imageio.RETURN_BYTES.
+            A file is written under a temporary name and renamed when complete.
+            Consecutive identical frames are written as one frame that is shown longer.
         :return: None (if writing file) or byte array
         '''
         logger.debug('create_anim_gif: start')
-        if True:
-            new_gifs = []
-            for img in self.img_gifs:
+        self.check_anim_out(anim_out)
+        if self.outputs:
+            write_outputs(self.img_gifs, anim_out, self.outputs, FRAME_DURATION, self.output_executor)
+            if self.catalog is not None:
+                self.catalog.encoded(self.station, self.product, [t[2] for t in self.img_tuples])
+            return None
+        elif self.anim_format != 'gif':
+            anim_bytes = encode_anim(self.img_gifs, self.anim_format, FRAME_DURATION)
+            retval = publish_atomic(anim_out, anim_bytes) if is_file_output(anim_out) else anim_bytes
+            if self.catalog is not None:
+                self.catalog.encoded(self.station, self.product, [t[2] for t in self.img_tuples])
+            return retval
+        elif self.rolling and is_file_output(anim_out):
+            names = [t[2] for t in self.img_tuples]
+            RollingGif(anim_out, FRAME_DURATION).update(names, dict(zip(names, self.img_gifs)))
+            if self.catalog is not None:
+                self.catalog.encoded(self.station, self.product, names)
+            return None
+        elif self.splice or self.delta:
+            # self.img_gifs are the GIF bytes of the frames
+            if self.delta:
+                gif_bytes = delta_gif(self.img_gifs, FRAME_DURATION)
+            else:
+                new_gifs, durations = merge_repeated_frames(self.img_gifs, FRAME_DURATION,
+                                                            [frame_digest(img) for img in self.img_gifs])
+                gif_bytes = splice_gif(new_gifs, durations)
+            if is_file_output(anim_out):
+                retval = publish_atomic(anim_out, gif_bytes)
+            else:
+                retval = gif_bytes
+            if self.catalog is not None:
+                self.catalog.encoded(self.station, self.product, [t[2] for t in self.img_tuples])
+            return retval
+        elif True:
+            new_gifs, durations = merge_repeated_frames(self.img_gifs, FRAME_DURATION)
+            for img in new_gifs:
                 logger.debug('create_anim_gif: img len=%d' %(len(bytes(img))))
-                new_gifs.append(img)
+            if len(new_gifs) == len(self.img_gifs):
+                durations = FRAME_DURATION
+            else:
+                logger.debug('create_anim_gif: merged %d repeated frames' %(len(self.img_gifs) - len(new_gifs)))
 
-            return imageio.mimwrite(anim_out, new_gifs, loop=0, duration=0.5, format=self.gif_format)
+            if is_file_output(anim_out):
+                retval = publish_atomic(anim_out, lambda tmp_out: imageio.mimwrite(tmp_out, new_gifs, loop=0, duration=durations, format=self.gif_format))
+            else:
+                retval = imageio.mimwrite(anim_out, new_gifs, loop=0, duration=durations, format=self.gif_format)
+            if self.catalog is not None:
+                self.catalog.encoded(self.station, self.product, [t[2] for t in self.img_tuples])
+            return retval
         else:
             # self.img_gifs was read with imageio.imread, hence the GIFs are numpy arrays
             logger.debug('create_anim_gif: array shape: {}'.format(self.img_gifs[0].shape))
@@ -388,16 +678,106 @@ class RadarAnimator:
         except Exception:
             pass
     
-def main(station=RADAR_STATION, gif_out=ANIM_FILE_OUT):
+def main(station=RADAR_STATION, gif_out=ANIM_FILE_OUT, cache_dir=CACHE_DIR, workers=FETCH_WORKERS, engine=FETCH_ENGINE,
+         deadline=RUN_DEADLINE, hedge=False, mirror_url=None, lock_wait=LOCK_WAIT, archive_dir=None, product=RADAR_PRODUCT,
+         catalog_path=None, splice=False, rolling=False, delta=False, anim_format='gif', outputs=None):
+    '''
+    :param product: RIDGE product. radar_batch.py builds several products at once.
+    :param splice: assemble the animation from the frame bytes without decoding them (gif_splice.py).
+    :param rolling: refresh gif_out by copying the frames it already has and adding the new ones.
+    :param delta: write only the changed rectangle of every frame (gif_delta.py).
+    :param anim_format: 'gif', 'webp' or 'apng' (anim_formats.py).
+    :param outputs: list of outputs written from one decode, e.g., ['gif', 'webp', 'thumb'] (radar_outputs.py).
+        Their filenames are made from gif_out.
+    :param catalog_path: SQLite file of the frame catalog (frame_catalog.py). None for no catalog.
+    :param cache_dir: directory of the frame cache. None to always download every frame.
+    :param archive_dir: directory of the frame archive, which keeps frames longer than NWS. None for no archive.
+    :param workers: number of concurrent frame downloads. 1 fetches one frame at a time with urlopen.
+    :param engine: 'threads' or 'async'.
+    :param deadline: seconds by which the animation must be written ('async' engine only).
+        Frames that have not arrived by then are left out.
+    :param hedge: send a duplicate of slow requests ('async' engine only), to mirror_url if given.
+    :param mirror_url: base URL of a mirror of RadarImg/, with a directory per product and station.
+    :param lock_wait: seconds to wait for another run that is building the same station.
+        Its output is used instead of building again if it was built with the same settings.
+        If that run is still building after lock_wait, TimeoutError is raised; a lock older
+        than LOCK_STALE is taken over instead.
+    '''
     logger.debug('fetch station=%s'%(station))
-    rad_anim = RadarAnimator(station)
+    settings = build_settings(anim_format, splice, rolling, delta, outputs)
+    output_files = (lambda out: list(output_paths(out, outputs).values())) if outputs else None
+    with BuildLock(station, product, cache_dir, gif_out, wait=lock_wait, settings=settings) as lock:
+        while not lock.acquired:
+            if lock.timed_out:
+                raise TimeoutError('pid %s is still building %s %s after %.0f s, %s not changed' %(
+                    str(lock.other.get('pid')), station.upper(), product.upper(), lock_wait, gif_out))
+            if lock.reuse_output(output_files):
+                print('another run built %s, reusing its output' %(station.upper()))
+                return None
+            # the other run wrote another format or other outputs: build ours
+            logger.debug('main: not reusing the output of pid %s' %(str(lock.other.get('pid'))))
+            lock.acquire()
+        return build(station, gif_out, cache_dir, workers, engine, deadline, hedge, mirror_url, archive_dir, product,
+                     catalog_path, splice, rolling, delta, anim_format, outputs)
+
+def build(station, gif_out, cache_dir, workers, engine, deadline, hedge, mirror_url, archive_dir=None, product=RADAR_PRODUCT,
+          catalog_path=None, splice=False, rolling=False, delta=False, anim_format='gif', outputs=None):
+    '''
+    Build the animation for main, with the build lock held.
+    '''
+    cache = FrameCache(cache_dir) if cache_dir else None
+    archive = FrameArchive(station, product, archive_dir) if archive_dir else None
+    catalog = FrameCatalog(catalog_path) if catalog_path else None
+    if engine == 'async':
+        from radar_async import AsyncRadarEngine
+        engine = AsyncRadarEngine(station, cache=cache, concurrency=workers, deadline=deadline,
+                                  hedge=hedge, mirror_url=mirror_url, archive=archive, product=product, catalog=catalog,
+                                  splice=splice, rolling=rolling, delta=delta, anim_format=anim_format,
+                                  outputs=outputs)
+        retval = engine.run(gif_out)
+        if engine.host_down:
+            print('radar host unavailable, %s not changed' %(gif_out))
+        elif engine.unchanged:
+            logger.debug('no new frames for %s, %s not changed' %(station, gif_out))
+        elif engine.skipped:
+            print('skipped frames: ' + ', '.join(engine.skipped))
+        logger.debug('host stats: {}'.format(str(get_host_guard(engine.anim.img_dir_url).stats())))
+        if hedge:
+            logger.debug('hedges=%d, hedge wins=%d' %(engine.hedges, engine.hedge_wins))
+        return retval
+    fetcher = FrameFetcher(workers) if workers > 1 else None
+    rad_anim = RadarAnimator(station, cache=cache, fetcher=fetcher, archive=archive, product=product, catalog=catalog,
+                             splice=splice, rolling=rolling, delta=delta, anim_format=anim_format, outputs=outputs)
     img_dir_url = rad_anim.get_img_dir_url()
-    img_gifs = rad_anim.fetch_gifs()
+    t0 = time.perf_counter()
+    try:
+        img_gifs = rad_anim.fetch_gifs()
+    except HostUnavailable as err:
+        # as the async engine: keep the published animation while the host is down
+        if not (is_file_output(gif_out) and os.path.exists(gif_out)):
+            raise
+        logger.debug('build: %s, keeping %s' %(str(err), gif_out))
+        print('radar host unavailable, %s not changed' %(gif_out))
+        if catalog is not None:
+            catalog.record_build(rad_anim.station, rad_anim.product, gif_out, 'host down', 0,
+                                 {'fetch': time.perf_counter() - t0})
+        return None
+    finally:
+        if fetcher:
+            fetcher.close()
+    t1 = time.perf_counter()
+    if rad_anim.failed:
+        print('skipped frames: ' + ', '.join(rad_anim.failed))
     # must wait until rad_anim.has_img_list == True
     #time.sleep(15)
     start_time,end_time = rad_anim.get_time_bounds()
     logger.debug('end_time = %s, start = %s' %(end_time.strftime('%Y-%m-%d %H:%M'),start_time.strftime('%Y-%m-%d %H:%M')))
-    return rad_anim.create_anim_gif(gif_out)
+    retval = rad_anim.create_anim_gif(gif_out)
+    if catalog is not None:
+        t2 = time.perf_counter()
+        catalog.record_build(rad_anim.station, rad_anim.product, gif_out, 'ok', len(rad_anim.img_tuples),
+                             {'fetch': t1 - t0, 'encode': t2 - t1, 'total': t2 - t0})
+    return retval
 
 if __name__== "__main__":
     import sys
@@ -406,17 +786,73 @@ if __name__== "__main__":
 
     print('argv: '+str(cmdArgs))
     argsList = cmdArgs[1:]  # '0' is the program name itself
-    shortOpts = 'hs:o:'
-    longOpts  = ['help', 'station=', 'out=']
+    shortOpts = 'hs:o:c:w:e:d:a:p:L:C:f:O:'
+    longOpts  = ['help', 'station=', 'out=', 'cache=', 'workers=', 'engine=', 'deadline=', 'hedge', 'mirror=', 'wait=',
+                 'archive=', 'product=', 'location=', 'catalog=', 'splice', 'rolling', 'delta', 'format=',
+                 'outputs=']
     try:
         args,values = getopt.getopt(argsList, shortOpts, longOpts)
     except getopt.error as err:
         print('ERROR unknown arg: '+str(err))
         sys.exit(2)
     station = RADAR_STATION
+    cache_dir = CACHE_DIR
+    workers = FETCH_WORKERS
+    engine = FETCH_ENGINE
+    deadline = RUN_DEADLINE
+    hedge = False
+    mirror_url = None
+    lock_wait = LOCK_WAIT
+    archive_dir = None
+    product = RADAR_PRODUCT
+    catalog_path = None
+    splice = False
+    rolling = False
+    delta = False
+    anim_format = 'gif'
+    outputs = None
     for arg,val in args:
         print('arg=%s, value=%s' %(arg,val))
         if arg in ('-s','--station'):
             station = val
-    main(station=station)
+        elif arg in ('-c','--cache'):
+            cache_dir = val if val.lower() != 'none' else None
+        elif arg in ('-w','--workers'):
+            workers = int(val)
+        elif arg in ('-e','--engine'):
+            engine = val
+        elif arg in ('-d','--deadline'):
+            deadline = float(val) if val.lower() != 'none' else None
+        elif arg == '--hedge':
+            hedge = True
+        elif arg == '--mirror':
+            hedge = True
+            mirror_url = val
+        elif arg == '--wait':
+            lock_wait = float(val)
+        elif arg in ('-a','--archive'):
+            archive_dir = val
+        elif arg in ('-p','--product'):
+            product = val
+        elif arg in ('-L','--location'):
+            # lat,lon: use the nearest radar
+            lat, lon = [float(v) for v in val.split(',')]
+            station = get_site_catalog().nearest_station(lat, lon)
+            print('location %s: station %s' %(val, station))
+        elif arg in ('-C','--catalog'):
+            catalog_path = val
+        elif arg == '--splice':
+            splice = True
+        elif arg == '--rolling':
+            rolling = True
+        elif arg == '--delta':
+            delta = True
+        elif arg in ('-f','--format'):
+            anim_format = val.lower()
+        elif arg in ('-O','--outputs'):
+            outputs = val.lower().split(',')
+    main(gif_out=anim_filename(ANIM_FILE_OUT, anim_format), station=station, cache_dir=cache_dir, workers=workers, engine=engine, deadline=deadline,
+         hedge=hedge, mirror_url=mirror_url, lock_wait=lock_wait, archive_dir=archive_dir, product=product,
+         catalog_path=catalog_path, splice=splice, rolling=rolling, delta=delta, anim_format=anim_format,
+         outputs=outputs)
     
\ No newline at end of file
@@ -31,6 +31,7 @@ import imageio
 import time
 
 from PyQt5 import QtCore, QtGui, QtNetwork, QtWidgets
+from gif_splice import splice_gif
 
 try:    # Python 2.7
     from urllib2 import urlopen,Request
@@ -354,11 +355,12 @@ class RadarAnimator:
         :return: None (if writing file) or byte array
         '''
         #print("createAnimGIF: images=%d" %len(img_tuples))
-        new_gifs = []
-        for img in self.img_gifs:
-            new_gifs.append(imageio.imread(bytes(img),format=self.gif_format))
-            
-        return imageio.mimwrite(anim_out, new_gifs, loop=0, duration=0.5, format=self.gif_format)
+        # the frames are spliced as they are, no decode and encode
+        gif_bytes = splice_gif([bytes(img) for img in self.img_gifs], 0.5)
+        if anim_out == imageio.RETURN_BYTES:
+            return gif_bytes
+        with open(anim_out, 'wb') as f:
+            f.write(gif_bytes)
         
     def create_qmovie(self):
         self.giffy = self.create_anim_gif(imageio.RETURN_BYTES)
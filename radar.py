@@ -27,6 +27,7 @@ import os
 import numpy as np
 import datetime as dt
 import requests
+from radar_fetch import FrameFetcher, FETCH_WORKERS
 #from BeautifulSoup import BeautifulSoup as bs
 import imageio
 # Run once only if you use 'GIF-FI' (does not generate correct anim-gif with Python 2.7)
@@ -86,8 +87,14 @@ class MyHTMLParser(HTMLParser):
 class RadarAnimator:
     global GIF_FORMAT
     img_root_url = 'https://radar.weather.gov/ridge/RadarImg/N0R/'
-    def __init__(self, station, twindow=70):
+    def __init__(self, station, twindow=70, fetcher=None):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param twindow: time window in minutes.
+        :param fetcher: optional FrameFetcher to download frames concurrently.
+        '''
         self.station = station.upper()
+        self.fetcher = fetcher
         self.img_dir_url = self.img_root_url + self.station.upper()
         self.twindow = twindow
         self.start_time = -1
@@ -125,7 +132,11 @@ class RadarAnimator:
     def fetch_img_gifs(self, image_list):
         # read from URL and store images
         ims_gif = []
-        if True:    # use imageio to read
+        if self.fetcher:    # concurrent requests on a pooled session, returned in list order
+            urls = [self.img_dir_url + '/' + f[2] for f in image_list]
+            for img_bytes in self.fetcher.fetch_all(urls):
+                ims_gif.append(imageio.imread(img_bytes, format=self.gif_format))
+        elif True:    # use imageio to read
             for f in image_list:
                 url = self.img_dir_url + '/' + f[2]
                 print('fetch: '+url)
@@ -218,11 +229,15 @@ class RadarAnimator:
     def get_img_dir_url(self):
         return self.img_dir_url
     
-def main(station=RADAR_STATION, gif_out=ANIM_FILE_OUT):
+def main(station=RADAR_STATION, gif_out=ANIM_FILE_OUT, workers=FETCH_WORKERS):
     print('fetch station=%s'%(station))
-    rad_anim = RadarAnimator(station)
+    fetcher = FrameFetcher(workers)
+    rad_anim = RadarAnimator(station, fetcher=fetcher)
     img_dir_url = rad_anim.get_img_dir_url()
-    img_gifs = rad_anim.fetch_gifs()
+    try:
+        img_gifs = rad_anim.fetch_gifs()
+    finally:
+        fetcher.close()
     start_time,end_time = rad_anim.get_time_bounds()
     print('end_time = %s, start = %s' %(end_time.strftime('%Y-%m-%d %H:%M'),start_time.strftime('%Y-%m-%d %H:%M')))
     return rad_anim.create_anim_gif(gif_out, img_gifs)
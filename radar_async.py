@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+asyncio engine for building radar animations, an alternative to the urllib (nws_radar_gif.py),
+requests (radar.py) and PyQt5 (qtradar.py) versions of RadarAnimator.
+
+The stages are the same as RadarAnimator: fetch the RIDGE directory listing, filter the image
+names to the time window, fetch the GIF frames, encode the animation. The difference is that all
+frame requests are in flight at the same time (up to a concurrency limit), each request has its
+own timeout and is retried with exponential backoff, so a slow or failed frame never blocks the
+rest. A frame that still fails after the retries is left out of the animation.
+Encoding is CPU work, so it runs in a worker thread (or the executor given to the engine, e.g.,
+a process pool shared by a batch of stations) and does not stall the event loop.
+engine.timings has the seconds spent in each stage of the last build.
+
+The listing request is conditional: the ETag and Last-Modified of the previous listing are sent
+back as If-None-Match and If-Modified-Since. If the server answers 304 Not Modified, or the newest
+frame in the listing is the one the previous build ended with, nothing has changed and the build
+stops there, without fetching, decoding or encoding anything. The listing state is kept in the
+FrameCache, so it carries over between cron runs.
+
+With rolling=True a GIF file output is refreshed with gif_splice.RollingGif: the frames that are
+already in the published animation are neither fetched nor read from the cache, their blocks
+are copied from the old file, and only the new frames are fetched and spliced in.
+
+Usage:
+    From a script:  AsyncRadarEngine('mux').run('radar_anim.gif')
+    From a server or any coroutine:  await engine.build('radar_anim.gif')
+    From a GUI event loop:  engine.build_in_thread('radar_anim.gif', callback)
+        callback is called from the worker thread; with PyQt emit a signal from it.
+'''
+
+ASYNC_CONCURRENCY=4     # frame requests in flight
+ASYNC_TIMEOUT=10        # seconds for each request
+ASYNC_RETRIES=2         # retries after the first attempt
+ASYNC_BACKOFF=0.5       # seconds before the first retry, doubled for each retry
+ASYNC_DEADLINE=None     # seconds for a whole build, None for no limit
+ENCODE_RESERVE=2.0      # seconds of the deadline kept for decoding and encoding
+HEDGE_PERCENTILE=95     # hedge a request that is slower than this percentile of recent requests
+HEDGE_DEFAULT=1.0       # seconds before hedging, until enough latencies have been seen
+HEDGE_MIN_SAMPLES=8     # latencies needed before the percentile is used
+
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from nws_radar_gif import RadarAnimator, FRAME_DURATION
+from host_guard import get_host_guard, HostUnavailable
+from radar_publish import SingleFlight, is_file_output, build_settings
+from frame_archive import archive_frames
+from gif_splice import RollingGif
+from frame_catalog import CatalogBatch
+from radar_outputs import write_outputs
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+build_flights = SingleFlight()
+
+def encode_animation(station, ims_bytes, anim_out, splice=False, delta=False, anim_format='gif'):
+    '''
+    Decode the GIF frames and write the animation.
+    This is a module function so that it can also run in a process pool.
+    :param ims_bytes: list of GIF bytes in timestamp order.
+    :param anim_out: either a GIF filename or imageio.RETURN_BYTES.
+    :param splice: splice the GIF bytes into the animation, without decoding them.
+    :param delta: write only the changed rectangle of every frame (gif_delta.py).
+    :param anim_format: 'gif', 'webp' or 'apng' (anim_formats.py).
+    '''
+    anim = RadarAnimator(station, splice=splice, delta=delta, anim_format=anim_format)
+    anim.img_gifs = ims_bytes if anim.frame_bytes else anim.decode_img_bytes(ims_bytes)
+    return anim.create_anim_gif(anim_out)
+
+class AsyncRadarEngine:
+    '''
+    Builds the animation for one radar station with asyncio and aiohttp.
+    The parsing, filtering and encoding are done by a RadarAnimator, only the network part is here.
+    '''
+    def __init__(self, station, twindow=70, cache=None, concurrency=ASYNC_CONCURRENCY,
+                 timeout=ASYNC_TIMEOUT, retries=ASYNC_RETRIES, backoff=ASYNC_BACKOFF,
+                 deadline=ASYNC_DEADLINE, encode_reserve=ENCODE_RESERVE,
+                 hedge=False, hedge_percentile=HEDGE_PERCENTILE, hedge_default=HEDGE_DEFAULT, mirror_url=None,
+                 executor=None, archive=None, product=None, catalog=None, splice=False, rolling=False, delta=False,
+                 anim_format='gif', outputs=None):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param twindow: time window in minutes.
+        :param cache: optional FrameCache. Frames found in the cache are not downloaded again.
+        :param concurrency: maximum number of frame requests in flight.
+        :param timeout: seconds allowed for each request, including reading the body.
+        :param retries: number of times a failed request is repeated.
+        :param backoff: seconds to wait before the first retry, doubled for each following retry.
+        :param deadline: seconds allowed for a whole build. None means wait for every frame.
+        :param encode_reserve: seconds of the deadline kept for decoding and encoding.
+        :param hedge: send a duplicate of a request that is slower than usual, and use the first reply.
+        :param hedge_percentile: percentile of recent latencies after which a request is hedged.
+        :param hedge_default: seconds before hedging while there are too few latencies.
+        :param mirror_url: optional base URL of a mirror for the duplicates, like img_base_url: the
+            product and station directories are added to it.
+        :param executor: concurrent.futures executor for encoding. Default is the loop's thread pool.
+        :param archive: optional FrameArchive. New frames are added to it after they are fetched.
+        :param product: RIDGE product, e.g., "N0V". Default is RadarAnimator.product.
+        :param catalog: optional FrameCatalog. Frames and builds are recorded in it, and the cached
+            frames are looked up in it when the listing fails. The rows of a build are written
+            together at its end, in a worker thread.
+        :param splice: assemble the animation from the frame bytes without decoding them (gif_splice.py).
+            This is cheap, so it is done on the event loop, not in the executor.
+        :param rolling: refresh a GIF file output by copying the frames it already has (gif_splice.RollingGif),
+            and fetch only the frames that are new. Implies splice.
+        :param delta: write only the changed rectangle of every frame (gif_delta.py), in the executor.
+        :param anim_format: 'gif', or 'webp' or 'apng' (anim_formats.py), encoded in the executor.
+        :param outputs: list of outputs written from one decode to a file output (radar_outputs.py),
+            e.g., ['gif', 'webp', 'thumb']. Their encoders run in the executor if it is a process pool,
+            otherwise in a new process pool.
+        '''
+        self.anim = RadarAnimator(station, twindow=twindow, cache=cache, archive=archive, product=product,
+                                  catalog=catalog, splice=splice, rolling=rolling, delta=delta,
+                                  anim_format=anim_format, outputs=outputs)
+        self.station = self.anim.station
+        self.product = self.anim.product
+        self.cache = cache
+        self.catalog = catalog
+        self.rolling = rolling
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.encode_reserve = encode_reserve
+        self.deadline_at = None     # loop time when fetching must stop
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default = hedge_default
+        self.mirror_url = mirror_url
+        self.executor = executor
+        self.timings = {}   # seconds per stage of the last build
+        self.hedges = 0     # duplicate requests sent in the last build
+        self.hedge_wins = 0 # duplicates that answered first in the last build
+        self.failed = []    # RIDGE filenames that could not be fetched in the last build
+        self.late = []      # RIDGE filenames dropped at the deadline in the last build
+        self.unchanged = False  # True if the last build found no new frames
+        self.host_down = False  # True if the last build stopped because the host is unavailable
+        self.listed_times = []  # datetimes of the frames the listing of the last build showed, also when it skipped
+        self.listing_states = {}    # listing state of each output built, by output_key
+        self.listing_key = None     # output_key of the current build, None for a bytes output
+        self.listing_state = {}
+        self.new_listing_state = {}
+
+    async def request(self, session, url, headers=None):
+        '''
+        GET one URL with timeout, retries and, if enabled, hedging.
+        :param headers: optional dict of request headers.
+        :return: tuple (status, response headers, body bytes). Raises the last error if all attempts fail.
+        '''
+        for attempt in range(self.retries + 1):
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError('deadline passed before %s' %(url))
+            timeout = aiohttp.ClientTimeout(total=self.timeout if remaining is None else min(self.timeout, remaining))
+            try:
+                if self.hedge:
+                    return await self.request_hedged(session, url, headers, timeout)
+                return await self.request_once(session, url, headers, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                delay = self.backoff * (2 ** attempt)
+                remaining = self.remaining()
+                if attempt >= self.retries or (remaining is not None and remaining <= delay):
+                    raise
+                logger.debug('get_url: %s failed (%s), retry in %.1f s' %(url, repr(err), delay))
+                await asyncio.sleep(delay)
+
+    async def request_once(self, session, url, headers, timeout):
+        '''
+        One GET through the HostGuard of the host, no retries.
+        :return: tuple (status, response headers, body bytes)
+        '''
+        guard = get_host_guard(url)
+        await guard.acquire_async()     # raises HostUnavailable while the circuit is open
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as resp:
+                resp.raise_for_status()
+                body = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if isinstance(err, aiohttp.ClientResponseError) and err.status < 500 and err.status != 429:
+                guard.record_success()  # the host answered, the URL is wrong
+            else:
+                guard.record_failure()
+            raise
+        except BaseException:
+            # cancelled at the deadline, or the other request of a hedge answered first
+            guard.record_cancel()
+            raise
+        guard.record_success()
+        guard.record_latency(loop.time() - t0)
+        return (resp.status, resp.headers, body)
+
+    def hedge_delay(self, url):
+        '''
+        :return: seconds to wait for a request before sending a duplicate, the hedge_percentile
+            of the recent latencies of the host, or hedge_default before there are enough of them.
+        '''
+        delay = get_host_guard(url).latency_percentile(self.hedge_percentile, HEDGE_MIN_SAMPLES)
+        return self.hedge_default if delay is None else delay
+
+    def hedge_url(self, url):
+        '''
+        :return: URL for the duplicate request, on the mirror if there is one.
+        '''
+        if self.mirror_url and url.startswith(self.anim.img_dir_url):
+            return self.mirror_url + self.product + '/' + self.station + '/' + url[len(self.anim.img_dir_url):]
+        return url
+
+    async def request_hedged(self, session, url, headers, timeout):
+        '''
+        Send the request, and if it is slower than usual send a duplicate (to the mirror, if any).
+        The first successful reply is used and the other request is cancelled.
+        :return: tuple (status, response headers, body bytes)
+        '''
+        primary = asyncio.ensure_future(self.request_once(session, url, headers, timeout))
+        pending = set([primary])
+        error = None
+        # the requests still pending are cancelled however this returns, also if it is cancelled
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay(url))
+            if done:
+                return primary.result()
+            self.hedges += 1
+            hedge_url = self.hedge_url(url)
+            logger.debug('request_hedged: %s is slow, hedge with %s' %(url, hedge_url))
+            second = asyncio.ensure_future(self.request_once(session, hedge_url, headers, timeout))
+            pending = set([primary, second])
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def remaining(self):
+        '''
+        :return: seconds left for network requests before the deadline, or None if there is no deadline.
+        '''
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - asyncio.get_running_loop().time()
+
+    @property
+    def skipped(self):
+        '''
+        RIDGE filenames left out of the last build, because they failed or were too late.
+        '''
+        return sorted(self.failed + self.late)
+
+    async def get_url(self, session, url):
+        '''
+        GET one URL with timeout and retries.
+        :return: body of the reply as bytes.
+        '''
+        status, headers, body = await self.request(session, url)
+        return body
+
+    def output_key(self, anim_out):
+        '''
+        :param anim_out: a file output.
+        :return: string that identifies what a build writes: the absolute filename and the settings
+            of its format and outputs. The listing state is kept per output, so that a build of
+            another output of the station (batch, scheduler, -f or -O) does not make this one look done.
+        '''
+        anim = self.anim
+        return json.dumps([os.path.abspath(anim_out),
+                           build_settings(anim.anim_format, anim.splice, anim.rolling, anim.delta, anim.outputs)],
+                          sort_keys=True)
+
+    def load_listing_state(self, anim_out):
+        '''
+        Set self.listing_key and self.listing_state for a build of anim_out.
+        '''
+        self.listing_key = self.output_key(anim_out) if is_file_output(anim_out) else None
+        if self.listing_key is None:
+            self.listing_state = {}
+        elif self.listing_key in self.listing_states:
+            self.listing_state = self.listing_states[self.listing_key]
+        elif self.cache:
+            self.listing_state = self.cache.load_listing_state(self.station, self.product, self.listing_key)
+        else:
+            self.listing_state = {}
+
+    def can_skip(self, anim_out):
+        '''
+        A build may stop early only if the previous animation is still there to be used.
+        '''
+        return is_file_output(anim_out) and os.path.exists(anim_out) and 'newest' in self.listing_state
+
+    async def get_img_tuples(self, session, anim_out=None):
+        '''
+        Fetch the RIDGE directory listing and filter the frames to the time window.
+        :param anim_out: output of the build. If it exists, the listing is requested conditionally.
+        :return: list of image tuples (datetime, datetime-string, image_filename),
+            or None if nothing changed since the previous build.
+        '''
+        headers = {}
+        self.new_listing_state = {}
+        self.listed_times = []
+        self.load_listing_state(anim_out)
+        skip_ok = self.can_skip(anim_out)
+        if skip_ok:
+            if self.listing_state.get('etag'):
+                headers['If-None-Match'] = self.listing_state['etag']
+            if self.listing_state.get('last_modified'):
+                headers['If-Modified-Since'] = self.listing_state['last_modified']
+        try:
+            status, resp_headers, html = await self.request(session, self.anim.img_dir_url, headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if self.deadline is None or not self.cache:
+                raise
+            logger.debug('get_img_tuples: %s listing failed (%s), using cached frames' %(self.station, repr(err)))
+            return self.get_cached_img_tuples(skip_ok)
+        if status == 304:
+            logger.debug('get_img_tuples: %s listing not modified' %(self.station))
+            # the newest frame is still the one of the previous build
+            self.listed_times = [self.anim.img_name_tuple(self.listing_state['newest'])[0]]
+            return None
+        self.anim.handle_img_list(html)
+        self.listed_times = [t[0] for t in self.anim.img_tuples]
+        newest = self.anim.img_tuples[-1][2] if self.anim.img_tuples else None
+        if skip_ok and newest == self.listing_state.get('newest'):
+            logger.debug('get_img_tuples: %s newest frame %s already done' %(self.station, newest))
+            return None
+        self.new_listing_state = {
+            'etag': resp_headers.get('ETag'),
+            'last_modified': resp_headers.get('Last-Modified'),
+            'newest': newest}
+        return self.anim.img_tuples
+
+    def get_cached_img_tuples(self, skip_ok=False):
+        '''
+        Make the image tuples from the frames in the cache, when the listing is not available.
+        :return: list of image tuples, or None if the cache has nothing newer than the previous build.
+        '''
+        if self.catalog is not None:
+            img_list = self.catalog.cached(self.station, self.product)
+        else:
+            img_list = self.cache.list_frames(self.station, self.product)
+        if not img_list:
+            raise IOError('get_cached_img_tuples: no listing and no cached frames for %s' %(self.station))
+        if skip_ok and img_list[-1] == self.listing_state.get('newest'):
+            return None
+        self.anim.handle_img_names(img_list)
+        self.new_listing_state = {}
+        return self.anim.img_tuples
+
+    def save_listing_state(self):
+        '''
+        Remember the listing of a build of a file output that completed with every frame.
+        '''
+        if self.listing_key is None:
+            return
+        self.listing_state = self.new_listing_state
+        self.listing_states[self.listing_key] = self.listing_state
+        if self.cache:
+            self.cache.save_listing_state(self.station, self.product, self.listing_key, self.listing_state)
+
+    async def fetch_img_bytes(self, session, semaphore, imgfile):
+        '''
+        Get the GIF bytes of one frame, from the cache if possible, else from NWS.
+        :return: GIF bytes, or None if the frame could not be fetched.
+        '''
+        if self.cache:
+            img_bytes = self.cache.get(self.station, self.product, imgfile)
+            if img_bytes is not None:
+                self.anim.record_frame(imgfile, img_bytes, self.cache.frame_path(self.station, self.product, imgfile))
+                return img_bytes
+        url = self.anim.img_dir_url + imgfile
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                img_bytes = await self.get_url(session, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, HostUnavailable) as err:
+                logger.debug('fetch_img_bytes: giving up on %s (%s)' %(url, repr(err)))
+                remaining = self.remaining()
+                if remaining is not None and remaining <= 0:
+                    self.late.append(imgfile)
+                else:
+                    self.failed.append(imgfile)
+                return None
+        fpath = None
+        if self.cache:
+            fpath = self.cache.put(self.station, self.product, imgfile, img_bytes)
+        self.anim.record_frame(imgfile, img_bytes, fpath, time.perf_counter() - t0)
+        return img_bytes
+
+    async def fetch_img_bytes_list(self, session, img_tuples):
+        '''
+        Fetch all frames concurrently. The newest frames are requested first, so that they are
+        the ones that have arrived if the deadline cuts the fetch short.
+        :return: list of GIF bytes in the order of img_tuples. Frames that failed or were too late are None.
+        '''
+        self.failed = []
+        self.late = []
+        if not img_tuples:
+            return []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [None] * len(img_tuples)
+        for idx in reversed(range(len(img_tuples))):
+            tasks[idx] = asyncio.ensure_future(self.fetch_img_bytes(session, semaphore, img_tuples[idx][2]))
+        done, pending = await asyncio.wait(tasks, timeout=self.remaining())
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        ims_bytes = []
+        for idx,task in enumerate(tasks):
+            if task in pending:
+                self.late.append(img_tuples[idx][2])
+                ims_bytes.append(None)
+            else:
+                ims_bytes.append(task.result())
+        if self.cache and img_tuples:
+            self.cache.evict(self.station, self.product, newest=img_tuples[-1][0], catalog=self.anim.catalog)
+        return ims_bytes
+
+    async def build(self, anim_out, session=None):
+        '''
+        Run all stages: listing, filter, fetch, encode.
+        :param anim_out: either a GIF filename or imageio.RETURN_BYTES.
+        :param session: optional aiohttp.ClientSession to share with other engines.
+        :return: None (if writing file or nothing changed) or byte array
+        '''
+        self.anim.check_anim_out(anim_out)
+        if is_file_output(anim_out):
+            key = (self.station, self.product, os.path.abspath(anim_out))
+            return await build_flights.do(key, lambda: self.build_once(anim_out, session))
+        return await self.build_once(anim_out, session)
+
+    async def build_once(self, anim_out, session=None):
+        '''
+        The work of build, without single-flight.
+        '''
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timings = {}
+        t0 = time.perf_counter()
+        if self.deadline is not None:
+            self.deadline_at = asyncio.get_running_loop().time() + self.deadline - self.encode_reserve
+        status = 'error'
+        # the frames, archive and build rows of this build, written in one transaction at the end
+        batch = CatalogBatch(self.catalog) if self.catalog is not None else None
+        self.anim.catalog = batch
+        try:
+            if session is None:
+                connector = aiohttp.TCPConnector(limit=self.concurrency)
+                async with aiohttp.ClientSession(connector=connector) as session:
+                    retval = await self.build_stages(anim_out, session)
+            else:
+                retval = await self.build_stages(anim_out, session)
+            status = 'host down' if self.host_down else 'unchanged' if self.unchanged else 'ok'
+            return retval
+        finally:
+            self.deadline_at = None
+            self.timings['total'] = time.perf_counter() - t0
+            self.anim.catalog = self.catalog
+            if batch is not None:
+                frames = len(self.anim.img_tuples) if status == 'ok' else 0
+                batch.record_build(self.station, self.product, anim_out, status, frames, self.timings)
+                await asyncio.get_running_loop().run_in_executor(None, batch.flush)
+
+    async def build_stages(self, anim_out, session):
+        '''
+        The stages of build, on an open session.
+        '''
+        self.host_down = False
+        t0 = time.perf_counter()
+        try:
+            img_tuples = await self.get_img_tuples(session, anim_out)
+        except HostUnavailable as err:
+            if not (is_file_output(anim_out) and os.path.exists(anim_out)):
+                raise
+            logger.debug('build: %s, keeping %s' %(str(err), anim_out))
+            self.host_down = True
+            img_tuples = None
+        self.unchanged = img_tuples is None
+        self.timings['listing'] = time.perf_counter() - t0
+        if self.unchanged:
+            return None
+        rolling = RollingGif(anim_out, FRAME_DURATION) if self.rolling and is_file_output(anim_out) else None
+        retained = rolling.retained([t[2] for t in img_tuples]) if rolling else set()
+        fetch_tuples = [t for t in img_tuples if t[2] not in retained]
+        t0 = time.perf_counter()
+        ims_bytes = await self.fetch_img_bytes_list(session, fetch_tuples)
+        self.timings['fetch'] = time.perf_counter() - t0
+        fetched = dict([(t[2], b) for t, b in zip(fetch_tuples, ims_bytes) if b is not None])
+        kept = [(t, fetched.get(t[2])) for t in img_tuples if t[2] in retained or t[2] in fetched]
+        if self.skipped:
+            logger.debug('build: %s skipped frames %s' %(self.station, str(self.skipped)))
+        if not kept:
+            raise IOError('build: no frames could be fetched for %s' %(self.station))
+        self.anim.img_tuples = [t for t, b in kept]
+        loop = asyncio.get_running_loop()
+        if self.anim.archive is not None:
+            # decoding the new frames is CPU work, keep it off the event loop
+            await loop.run_in_executor(None, archive_frames, self.anim.archive, fetch_tuples, ims_bytes, self.anim.catalog)
+        t0 = time.perf_counter()
+        if rolling is not None:
+            logger.debug('build: %s %d frames retained, %d fetched' %(self.station, len(retained), len(fetched)))
+            rolling.update([t[2] for t, b in kept], fetched)
+            retval = None
+        elif self.anim.outputs and is_file_output(anim_out):
+            # write_outputs only waits for the encoder processes, a thread is enough for it
+            executor = self.executor if isinstance(self.executor, ProcessPoolExecutor) else None
+            await loop.run_in_executor(None, write_outputs, [b for t, b in kept], anim_out, self.anim.outputs,
+                                       FRAME_DURATION, executor)
+            retval = None
+        elif self.anim.splice and self.anim.anim_format == 'gif':
+            retval = encode_animation(self.station, [b for t, b in kept], anim_out, splice=True)
+        else:
+            retval = await loop.run_in_executor(self.executor, encode_animation, self.station, [b for t, b in kept], anim_out,
+                                                False, self.anim.delta, self.anim.anim_format)
+        self.timings['encode'] = time.perf_counter() - t0
+        if self.anim.catalog is not None:
+            self.anim.catalog.encoded(self.station, self.product, [t[2] for t, b in kept])
+        if not self.skipped and self.new_listing_state:
+            self.save_listing_state()
+        return retval
+
+    def run(self, anim_out):
+        '''
+        Build the animation from a plain script, blocking until done.
+        '''
+        return asyncio.run(self.build(anim_out))
+
+    def build_in_thread(self, anim_out, callback=None):
+        '''
+        Build the animation in a background thread with its own event loop,
+        e.g., when the caller is a GUI event loop that must not block.
+        :param callback: called with the result of build, or with the exception if it failed.
+        :return: the started thread.
+        '''
+        def worker():
+            try:
+                result = self.run(anim_out)
+            except Exception as err:
+                result = err
+            if callback:
+                callback(result)
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Builds animations for many radar stations, and several products of each station, in one process.
+
+Running nws_radar_gif once per station starts the interpreter and imports numpy and imageio
+every time, and the stations are built one after another. Here all stations are built
+concurrently by AsyncRadarEngine in one event loop:
+* one aiohttp session, so the connection pool to radar.weather.gov is shared,
+* one FrameCache and the per-host limiter and circuit breaker (host_guard.py) are shared,
+* the encoding, which is CPU work, is spread over a process pool.
+The total time is then close to the time of the slowest station, not the sum of all of them.
+Each product (N0R reflectivity, N0V velocity, NCR composite, N1P precipitation...) has its own
+RIDGE directory, so its listing is a separate request, but all the products of all the stations
+are built at the same time on the shared pool: a dashboard with three products of a station
+takes about as long as one product.
+A build that is already running in another process is skipped (radar_publish.BuildLock).
+At the end a timing report with one line per station and product is printed.
+
+Usage: python radar_batch.py -s MUX,ATX,RTX [-P N0R,N0V] [-o radar_{station}_{product}.gif] [-p processes] [-d deadline] [-C frame_catalog.sqlite] [--splice] [--rolling] [--delta] [-f gif|webp|apng] [-O gif,webp,mp4,thumb]
+'''
+
+BATCH_STATIONS='MUX'
+BATCH_PRODUCTS='N0R'
+BATCH_OUT='radar_{station}.gif'     # use radar_{station}_{product}.gif for several products
+BATCH_CONNECTIONS=16    # connections to radar.weather.gov shared by all stations
+BATCH_DEADLINE=60       # seconds for each station
+
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from frame_cache import FrameCache, CACHE_DIR
+from frame_catalog import FrameCatalog
+from radar_async import AsyncRadarEngine
+from radar_publish import BuildLock, build_settings
+from anim_formats import anim_filename
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+async def build_station(engine, anim_out, session, lock_dir):
+    '''
+    Build one station of the batch.
+    :return: dict for the timing report.
+    '''
+    row = {'station': engine.station, 'product': engine.product, 'out': anim_out, 'status': 'ok', 'frames': 0}
+    anim = engine.anim
+    lock = BuildLock(engine.station, engine.product, lock_dir, anim_out, wait=0,
+                     settings=build_settings(anim.anim_format, anim.splice, anim.rolling, anim.delta, anim.outputs))
+    if not lock.try_acquire():
+        row['status'] = 'busy'
+        return row
+    try:
+        await engine.build(anim_out, session)
+        if engine.host_down:
+            row['status'] = 'host down'
+        elif engine.unchanged:
+            row['status'] = 'unchanged'
+        else:
+            row['frames'] = len(engine.anim.img_tuples)
+            if engine.skipped:
+                row['status'] = 'skipped %d' %(len(engine.skipped))
+    except Exception as err:
+        logger.debug('build_station: %s failed (%s)' %(engine.station, repr(err)))
+        row['status'] = 'error: %s' %(err.__class__.__name__)
+    finally:
+        lock.release()
+    row.update(engine.timings)
+    return row
+
+async def build_batch(stations, anim_out=BATCH_OUT, cache=None, processes=None,
+                      connections=BATCH_CONNECTIONS, products=None, **engine_args):
+    '''
+    Build all stations and products concurrently.
+    :param stations: list of radar station names.
+    :param anim_out: output filename template with {station} and {product}.
+    :param cache: optional FrameCache shared by all stations.
+    :param processes: size of the encoding process pool. Default is the number of CPUs.
+    :param connections: size of the shared connection pool.
+    :param products: list of RIDGE products. Default is RadarAnimator.product only.
+    :param engine_args: more arguments for AsyncRadarEngine, e.g., deadline.
+    :return: list of report rows, one per station and product, in the order of stations and products.
+    '''
+    products = products or [None]
+    if len(stations) > 1 and '{station}' not in anim_out:
+        raise ValueError('build_batch: anim_out needs {station} for several stations')
+    if len(products) > 1 and '{product}' not in anim_out:
+        raise ValueError('build_batch: anim_out needs {product} for several products')
+    lock_dir = cache.cache_dir if cache else None
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            for station in stations:
+                for product in products:
+                    engine = AsyncRadarEngine(station, cache=cache, executor=pool, product=product, **engine_args)
+                    out = anim_out.format(station=engine.station, product=engine.product)
+                    tasks.append(build_station(engine, out, session, lock_dir))
+            return await asyncio.gather(*tasks)
+
+def print_report(rows, wall_secs):
+    '''
+    Print one line per station and product with the seconds spent in each stage.
+    '''
+    print('%-8s %-8s %-12s %6s %8s %8s %8s %8s' %('station', 'product', 'status', 'frames', 'listing', 'fetch', 'encode', 'total'))
+    for row in rows:
+        print('%-8s %-8s %-12s %6d %8.2f %8.2f %8.2f %8.2f' %(row['station'], row['product'], row['status'], row['frames'],
+              row.get('listing', 0), row.get('fetch', 0), row.get('encode', 0), row.get('total', 0)))
+    slowest = max([row.get('total', 0) for row in rows] or [0])
+    print('wall time %.2f s, slowest build %.2f s, sum of builds %.2f s' %(
+          wall_secs, slowest, sum([row.get('total', 0) for row in rows])))
+
+def main(stations=BATCH_STATIONS, anim_out=BATCH_OUT, cache_dir=CACHE_DIR, processes=None, deadline=BATCH_DEADLINE,
+         products=BATCH_PRODUCTS, catalog_path=None, splice=False, rolling=False, delta=False,
+         anim_format='gif', outputs=None):
+    '''
+    :param catalog_path: SQLite file of the frame catalog, which keeps the frames and the timings of every build.
+    :param splice: assemble the animations from the frame bytes without decoding them (gif_splice.py).
+    :param rolling: refresh each animation by copying the frames it already has and adding the new ones.
+    :param delta: write only the changed rectangle of every frame (gif_delta.py).
+    :param anim_format: 'gif', 'webp' or 'apng' (anim_formats.py).
+    :param outputs: list of outputs written from one decode of each animation (radar_outputs.py), encoded on
+        the shared process pool.
+    '''
+    cache = FrameCache(cache_dir) if cache_dir else None
+    catalog = FrameCatalog(catalog_path) if catalog_path else None
+    t0 = time.perf_counter()
+    rows = asyncio.run(build_batch(stations.split(','), anim_out, cache=cache, processes=processes, deadline=deadline,
+                                   products=products.split(','), catalog=catalog, splice=splice, rolling=rolling, delta=delta,
+                                   anim_format=anim_format, outputs=outputs))
+    print_report(rows, time.perf_counter() - t0)
+    return rows
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hs:P:o:c:p:d:C:f:O:'
+    longOpts  = ['help', 'stations=', 'products=', 'out=', 'cache=', 'processes=', 'deadline=', 'catalog=', 'splice', 'rolling', 'delta', 'format=',
+                 'outputs=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    stations = BATCH_STATIONS
+    products = BATCH_PRODUCTS
+    anim_out = BATCH_OUT
+    cache_dir = CACHE_DIR
+    processes = None
+    deadline = BATCH_DEADLINE
+    catalog_path = None
+    splice = False
+    rolling = False
+    delta = False
+    anim_format = 'gif'
+    outputs = None
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-s','--stations'):
+            stations = val
+        elif arg in ('-P','--products'):
+            products = val
+        elif arg in ('-o','--out'):
+            anim_out = val
+        elif arg in ('-c','--cache'):
+            cache_dir = val if val.lower() != 'none' else None
+        elif arg in ('-p','--processes'):
+            processes = int(val)
+        elif arg in ('-d','--deadline'):
+            deadline = float(val) if val.lower() != 'none' else None
+        elif arg in ('-C','--catalog'):
+            catalog_path = val
+        elif arg == '--splice':
+            splice = True
+        elif arg == '--rolling':
+            rolling = True
+        elif arg == '--delta':
+            delta = True
+        elif arg in ('-f','--format'):
+            anim_format = val.lower()
+        elif arg in ('-O','--outputs'):
+            outputs = val.lower().split(',')
+    if ',' in products and anim_out == BATCH_OUT:
+        anim_out = 'radar_{station}_{product}.gif'
+    if anim_format != 'gif':
+        anim_out = anim_filename(anim_out, anim_format)
+    main(stations=stations, anim_out=anim_out, cache_dir=cache_dir, processes=processes, deadline=deadline,
+         products=products, catalog_path=catalog_path, splice=splice, rolling=rolling, delta=delta,
+         anim_format=anim_format, outputs=outputs)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Concurrent fetching of radar GIF frames over a pooled keep-alive HTTP session.
+
+urlopen opens a new connection for every frame, so every frame pays for its own TCP and TLS
+handshake, and the frames are fetched one after another.
+FrameFetcher keeps one requests.Session whose connection pool is shared by a small pool of
+worker threads. The frames of one animation are requested in parallel, and the results are
+returned in the same order as the URLs, no matter which request finishes first.
+Every request goes through the HostGuard of its host (host_guard.py), which is shared with
+every other fetcher in the process.
+'''
+
+FETCH_WORKERS=4     # concurrent requests to radar.weather.gov
+FETCH_TIMEOUT=10    # seconds, for connect and for each read
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from host_guard import get_host_guard, HostUnavailable
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+class FrameFetcher:
+    '''
+    Bounded-concurrency HTTP fetcher. One instance can be shared by several RadarAnimators.
+    '''
+    def __init__(self, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT):
+        '''
+        :param workers: maximum number of requests in flight, also the size of the connection pool.
+        :param timeout: seconds to wait for the server, passed to requests.
+        '''
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.latencies = {}     # url -> seconds of the last successful get
+
+    def get(self, url):
+        '''
+        Fetch one URL on the shared session.
+        :return: body of the reply as bytes. Raises requests.HTTPError if the reply is not OK,
+            host_guard.HostUnavailable if the host has been failing.
+        '''
+        logger.debug('get: '+url)
+        guard = get_host_guard(url)
+        guard.acquire()
+        t0 = time.perf_counter()
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
+            guard.record_failure()
+            raise
+        if r.status_code >= 500 or r.status_code == 429:
+            guard.record_failure()
+        else:
+            guard.record_success()
+        r.raise_for_status()
+        self.latencies[url] = time.perf_counter() - t0
+        return r.content
+
+    def get_available(self, url):
+        '''
+        Like get, but None instead of HostUnavailable while the circuit of the host is open.
+        '''
+        try:
+            return self.get(url)
+        except HostUnavailable as err:
+            logger.debug('get_available: giving up on %s (%s)' %(url, repr(err)))
+            return None
+
+    def fetch_all(self, urls, skip_unavailable=False):
+        '''
+        Fetch all URLs, at most self.workers at a time.
+        :param urls: list of URLs, e.g., the GIF frames of one animation in timestamp order.
+        :param skip_unavailable: return None for the URLs not requested because the host is
+            unavailable, instead of raising HostUnavailable.
+        :return: list of bytes, in the same order as urls.
+        '''
+        return list(self.executor.map(self.get_available if skip_unavailable else self.get, urls))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Several outputs of the radar frames from one decode: GIF for legacy displays, WebP or APNG for
+browsers, MP4 for archiving, and a small thumbnail GIF.
+
+Running nws_radar_gif once per output format fetches and decodes every frame again each time.
+write_outputs decodes the frames once, to palette indices in one shared palette
+(anim_formats.palette_frames), and puts that stack in shared memory. One worker process per
+output attaches to it by name, without a copy or pickling of the frames, encodes its output
+and publishes it atomically (radar_publish.publish_atomic). The encoders run in parallel, so
+with a core per output the total is about the decode plus the slowest encoder, not the sum.
+Outputs and their files, from anim_out = radar_anim.gif:
+    gif     radar_anim.gif          changed rectangles only (gif_delta.py)
+    webp    radar_anim.webp         lossless animated WebP
+    apng    radar_anim.png          animated PNG
+    mp4     radar_anim.mp4          H.264, transparent pixels on black; needs imageio-ffmpeg
+    thumb   radar_anim_thumb.gif    every THUMB_STEP-th pixel, so the palette colors stay exact
+
+Usage: python radar_outputs.py [-O gif,webp,mp4,thumb] [-o radar_anim.gif] frame.gif ...
+'''
+
+OUTPUTS='gif,webp'
+OUTPUT_FILES={'gif': '.gif', 'webp': '.webp', 'apng': '.png', 'mp4': '.mp4', 'thumb': '_thumb.gif'}
+THUMB_STEP=4            # thumbnail pixel step: 150x138 for the 600x550 RIDGE frames
+MP4_QUALITY=8           # imageio ffmpeg quality, 0 to 10
+
+import os
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import numpy as np
+from PIL import features
+
+from anim_formats import palette_frames, webp_frames, apng_frames, rgba_palette
+from gif_delta import delta_frames, merge_identical
+from radar_publish import publish_atomic
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def output_paths(anim_out, outputs):
+    '''
+    :param anim_out: main output filename, e.g., radar_anim.gif
+    :param outputs: list of output names, e.g., ['gif', 'webp']
+    :return: dict of filenames by output name.
+    '''
+    base = os.path.splitext(anim_out)[0]
+    return dict([(output, base + OUTPUT_FILES[output]) for output in outputs])
+
+def thumb_frames(stack, palette, transparency, secs):
+    '''
+    :return: bytes of an animated GIF of every THUMB_STEP-th pixel of the frames.
+    '''
+    thumbs, thumb_secs = merge_identical(np.ascontiguousarray(stack[:, ::THUMB_STEP, ::THUMB_STEP]), secs)
+    return delta_frames(thumbs, palette, transparency, thumb_secs)
+
+def mp4_frames(stack, palette, transparency, secs):
+    '''
+    :return: function that writes an H.264 MP4 to a filename, for publish_atomic.
+        A frame shown longer is repeated, at the frame rate of the shortest frame.
+    '''
+    import imageio
+    rgb = rgba_palette(palette, None)[:, :3]
+    if transparency is not None:
+        rgb[transparency] = 0
+    frame_secs = min(secs)
+    repeats = [max(1, int(round(s / frame_secs))) for s in secs]
+    def write(tmp_out):
+        with imageio.get_writer(tmp_out, format='FFMPEG', fps=1.0 / frame_secs, quality=MP4_QUALITY,
+                                macro_block_size=2) as writer:
+            for indices, count in zip(stack, repeats):
+                frame = rgb[indices]
+                for n in range(count):
+                    writer.append_data(frame)
+    return write
+
+OUTPUT_ENCODERS = {
+    'gif': delta_frames,
+    'webp': webp_frames,
+    'apng': apng_frames,
+    'mp4': mp4_frames,
+    'thumb': thumb_frames,
+}
+
+def check_outputs(outputs):
+    '''
+    Check that every output can be written here, before any frame is fetched or decoded.
+    Raises ValueError for an unknown output, RuntimeError if its encoder is not installed.
+    '''
+    for output in outputs:
+        if output not in OUTPUT_ENCODERS:
+            raise ValueError('check_outputs: unknown output %s' %(output))
+    if 'webp' in outputs and not features.check('webp'):
+        raise RuntimeError('check_outputs: Pillow was built without WebP support')
+    if 'mp4' in outputs:
+        try:
+            import imageio_ffmpeg
+            imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError) as err:
+            raise RuntimeError('check_outputs: mp4 needs imageio-ffmpeg (pip install imageio[ffmpeg]): %s' %(str(err)))
+
+class SharedStack:
+    '''
+    A copy of the decoded frames in shared memory, for the encoder processes.
+    Only this process unlinks it.
+    '''
+    def __init__(self, stack):
+        self.shape = stack.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, stack.nbytes))
+        np.ndarray(stack.shape, dtype=np.uint8, buffer=self.shm.buf)[:] = stack
+        # the resource tracker the segment is registered with (None where there is none, e.g., Windows)
+        self.tracker_pid = resource_tracker._resource_tracker._pid
+
+    @property
+    def spec(self):
+        '''
+        What a worker needs to attach: tuple (shared memory name, shape, resource tracker pid)
+        '''
+        return (self.shm.name, self.shape, self.tracker_pid)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def attach_stack(spec):
+    '''
+    :param spec: SharedStack.spec
+    :return: tuple (SharedMemory, uint8 array of the frames). Close the SharedMemory when done.
+    '''
+    name, shape, tracker_pid = spec
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        # A worker started before the creator's resource tracker launches its own tracker, which would
+        # report the segment as leaked and unlink it at exit. A tracker inherited from the creator
+        # (same pid after fork, no pid after spawn) is shared: unregistering would drop the creator's entry.
+        own_pid = resource_tracker._resource_tracker._pid
+        if own_pid is not None and own_pid != tracker_pid:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+    return (shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+
+def encode_output(output, spec, palette, transparency, secs, out_path):
+    '''
+    Encode one output from the shared frames and publish it. Runs in a worker process.
+    :return: dict with output, path, size in bytes and seconds.
+    '''
+    t0 = time.perf_counter()
+    shm, stack = attach_stack(spec)
+    try:
+        data = OUTPUT_ENCODERS[output](stack, palette, transparency, secs)
+        publish_atomic(out_path, data)
+    finally:
+        del stack
+        shm.close()
+    return {'output': output, 'path': out_path, 'size': os.path.getsize(out_path), 'secs': time.perf_counter() - t0}
+
+def write_outputs(ims_bytes, anim_out, outputs, duration, executor=None):
+    '''
+    Decode the frames once and write every output in parallel.
+    :param ims_bytes: list of GIF bytes of the frames, in display order.
+    :param anim_out: main output filename; the outputs are named after it (output_paths).
+    :param outputs: list of output names, keys of OUTPUT_ENCODERS.
+    :param duration: seconds per frame, or a list of seconds, one per frame.
+    :param executor: ProcessPoolExecutor to run the encoders in. Default is a new pool with a
+        process per output.
+    :return: list of dicts from encode_output, in the order of outputs. If an encoder failed,
+        the others are still written and then its exception is raised.
+    '''
+    check_outputs(outputs)
+    if not len(ims_bytes):
+        raise ValueError('write_outputs: no frames')
+    t0 = time.perf_counter()
+    stack, palette, transparency, secs = palette_frames(ims_bytes, duration)
+    decode_secs = time.perf_counter() - t0
+    paths = output_paths(anim_out, outputs)
+    pool = executor or ProcessPoolExecutor(max_workers=len(outputs))
+    try:
+        with SharedStack(stack) as shared:
+            futures = [pool.submit(encode_output, output, shared.spec, palette, transparency, secs, paths[output])
+                       for output in outputs]
+            wait(futures)
+    finally:
+        if executor is None:
+            pool.shutdown()
+    for output, future in zip(outputs, futures):
+        if future.exception() is not None:
+            logger.debug('write_outputs: %s failed (%s)' %(output, repr(future.exception())))
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+    results = [future.result() for future in futures]
+    logger.debug('write_outputs: decode %.3f s, %s' %(decode_secs, ', '.join(['%s %.3f s' %(r['output'], r['secs']) for r in results])))
+    return results
+
+def main(files, anim_out='radar_anim.gif', outputs=OUTPUTS, duration=0.5):
+    ims_bytes = []
+    for fname in files:
+        with open(fname, 'rb') as f:
+            ims_bytes.append(f.read())
+    t0 = time.perf_counter()
+    results = write_outputs(ims_bytes, anim_out, outputs.split(','), duration)
+    for r in results:
+        print('%-6s %-28s %8d bytes %6.3f s' %(r['output'], r['path'], r['size'], r['secs']))
+    print('total %.3f s' %(time.perf_counter() - t0))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hO:o:'
+    longOpts  = ['help', 'outputs=', 'out=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    outputs = OUTPUTS
+    anim_out = 'radar_anim.gif'
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-O','--outputs'):
+            outputs = val.lower()
+        elif arg in ('-o','--out'):
+            anim_out = val
+    if not values:
+        print(__doc__)
+        sys.exit(2)
+    main(values, anim_out, outputs)
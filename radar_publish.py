@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Publishing radar animations safely when builds overlap.
+
+If a run of nws_radar_gif is slow, the next cron tick starts a second identical run: both would
+download the same frames and race to write radar_anim.gif.
+* publish_atomic writes the output under a temporary name in the same directory and renames it,
+  so readers (web server, desktop app) never see a half-written file.
+* BuildLock is a lock file per station and product, shared by all processes. A run that finds
+  a build in progress waits for it and reuses its output instead of repeating the work.
+  The lock file is created with O_EXCL, which works on Windows as well as Linux. A lock left
+  behind by a crashed run is taken over once it is older than LOCK_STALE seconds.
+  The lock records the settings that change the output (format, splice, outputs...), and a
+  waiting run only reuses an output built with the same settings; otherwise it builds its own.
+* SingleFlight does the same for coroutines in one process, e.g., the scheduler and a batch
+  asking for the same station at the same time.
+'''
+
+LOCK_WAIT=120       # seconds to wait for another build of the same station
+LOCK_STALE=600      # seconds after which a lock file is considered left over from a crash
+LOCK_POLL=0.5       # seconds between checks of the lock file
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+
+import imageio
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def is_file_output(anim_out):
+    '''
+    :param anim_out: output argument of create_anim_gif, a filename or imageio.RETURN_BYTES.
+    :return: True if anim_out is a filename.
+    '''
+    return isinstance(anim_out, str) and anim_out != imageio.RETURN_BYTES
+
+def publish_atomic(out_path, data):
+    '''
+    Write data to out_path so that readers only ever see the old or the new file.
+    :param out_path: output filename.
+    :param data: bytes, or a function that is called with a temporary filename and writes it.
+    '''
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    suffix = os.path.splitext(out_path)[1]
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix=suffix, dir=out_dir)
+    try:
+        if callable(data):
+            os.close(fd)
+            data(tmp_path)
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        # mkstemp makes the file private; keep the mode of the file being replaced
+        mode = os.stat(out_path).st_mode & 0o777 if os.path.exists(out_path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def build_settings(anim_format='gif', splice=False, rolling=False, delta=False, outputs=None):
+    '''
+    :return: dict of the RadarAnimator options that change the files written, for BuildLock.
+    '''
+    return {'format': anim_format, 'splice': bool(splice or rolling), 'rolling': bool(rolling),
+            'delta': bool(delta), 'outputs': sorted(outputs or [])}
+
+class BuildLock:
+    '''
+    Lock file for the build of one station and product.
+    Use as a context manager, then check 'acquired' and 'timed_out':
+        with BuildLock('MUX', 'N0R', 'radar_cache', 'radar_anim.gif') as lock:
+            if lock.acquired:
+                build...
+            elif not lock.timed_out and not lock.reuse_output():
+                lock.acquire()... and build
+    '''
+    def __init__(self, station, product, lock_dir=None, anim_out=None, wait=LOCK_WAIT, stale=LOCK_STALE, settings=None):
+        '''
+        :param lock_dir: directory for the lock file, e.g., the cache directory. Default is the temp directory.
+        :param anim_out: output file of this run, recorded in the lock for runs that wait for it.
+        :param settings: dict from build_settings, recorded in the lock. Default is build_settings().
+        :param wait: seconds to wait for a build in progress. 0 to give up at once.
+        :param stale: seconds after which another run's lock is ignored.
+        '''
+        lock_dir = lock_dir or tempfile.gettempdir()
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock_path = os.path.join(lock_dir, '%s_%s.lock' %(station.upper(), product.upper()))
+        self.anim_out = anim_out
+        self.wait = wait
+        self.stale = stale
+        self.settings = settings or build_settings()
+        self.acquired = False
+        self.timed_out = False  # True if the other build was still running when the wait ended
+        self.other = {}     # contents of the lock file of the build we waited for
+
+    def read(self):
+        try:
+            with open(self.lock_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def try_acquire(self):
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(),
+                       'out': os.path.abspath(self.anim_out) if is_file_output(self.anim_out) else None,
+                       'settings': self.settings}, f)
+        self.acquired = True
+        return True
+
+    def acquire(self):
+        '''
+        Take the lock, or wait for the build that holds it to finish.
+        :return: True if this run holds the lock and should build,
+            False if another run built the animation, or is still building it after the wait
+            (then self.timed_out is True, and its output is not ready to be reused).
+        '''
+        if self.try_acquire():
+            return True
+        self.other = self.read()
+        t_end = time.time() + self.wait
+        while os.path.exists(self.lock_path):
+            try:
+                age = time.time() - os.path.getmtime(self.lock_path)
+            except OSError:
+                continue    # released just now
+            if age > self.stale:
+                logger.debug('acquire: taking over stale lock %s' %(self.lock_path))
+                try:
+                    os.remove(self.lock_path)
+                except OSError:
+                    pass
+                return self.try_acquire()
+            if time.time() >= t_end:
+                logger.debug('acquire: gave up waiting for %s' %(self.lock_path))
+                self.timed_out = True
+                return False
+            time.sleep(LOCK_POLL)
+        logger.debug('acquire: build of pid %s finished' %(str(self.other.get('pid'))))
+        return False
+
+    def release(self):
+        if self.acquired:
+            self.acquired = False
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                pass
+
+    def reuse_output(self, output_files=None):
+        '''
+        After waiting for another build: make its output available as our output.
+        The other build must have had the same settings, else its files are not what this run writes.
+        :param output_files: optional function of an output filename that returns the list of all
+            the files a build writes for it, e.g., the outputs of radar_outputs.output_paths.
+            Default is the output file alone.
+        :return: True if all our files are there, copied from the other build if it wrote elsewhere.
+            False if this run has to build them itself.
+        '''
+        other_out = self.other.get('out')
+        if not is_file_output(self.anim_out) or not other_out:
+            return False
+        if self.other.get('settings') != self.settings:
+            logger.debug('reuse_output: the other build had settings %s, not %s' %(
+                str(self.other.get('settings')), str(self.settings)))
+            return False
+        output_files = output_files or (lambda out: [out])
+        ours = output_files(self.anim_out)
+        theirs = output_files(other_out)
+        if len(theirs) != len(ours):
+            return False
+        if os.path.abspath(self.anim_out) == other_out:
+            return all([os.path.exists(path) for path in ours])
+        for path, other_path in zip(ours, theirs):
+            if not os.path.exists(other_path):
+                logger.debug('reuse_output: the other build did not write %s' %(other_path))
+                return False
+            with open(other_path, 'rb') as f:
+                publish_atomic(path, f.read())
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class SingleFlight:
+    '''
+    Runs one coroutine per key at a time; callers with the same key share its result.
+    '''
+    def __init__(self):
+        self.flights = {}
+
+    async def do(self, key, coro_func):
+        '''
+        :param key: hashable, e.g., (station, product, anim_out)
+        :param coro_func: function returning the coroutine to run if no flight is in progress.
+        :return: result of the coroutine.
+        '''
+        future = self.flights.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coro_func())
+            self.flights[key] = future
+            future.add_done_callback(lambda f: self.flights.pop(key, None))
+        else:
+            logger.debug('do: joining build in progress for %s' %(str(key)))
+        return await asyncio.shield(future)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Adaptive polling of NWS RIDGE stations, an alternative to running nws_radar_gif from cron.
+
+NOAA publishes a new frame every 3 to 6 minutes when there is precipitation (precipitation mode)
+and about every 10 minutes in clear-air mode. A fixed 10 minute cron is up to 10 minutes stale
+and most of its polls find nothing new. The scheduler learns the cadence of each station from
+the frame timestamps in the listing, and polls again just after the next frame is expected:
+* gap: median of the recent intervals between frames,
+* lag: how long after its timestamp a frame shows up in the listing (the smallest lag seen).
+  It also absorbs any timezone offset of the filenames, so wall clock and frame times never
+  have to be compared directly.
+If the expected frame is not there yet, the next polls back off exponentially. A station in
+clear-air mode has a long gap, so it is polled less often.
+All the products of a station come from the same radar volume scan, so they share one cadence:
+a poll builds every product of the station at the same time.
+
+Usage: python radar_sched.py [-s MUX,ATX] [-P N0R,N0V] [-o radar_{station}_{product}.gif] [-n polls]
+'''
+
+RADAR_STATIONS='MUX'
+RADAR_PRODUCTS='N0R'
+ANIM_FILE_OUT='radar_anim.gif'      # for several stations use a template, e.g., radar_{station}_{product}.gif
+DEFAULT_GAP=300         # seconds between frames until the station's cadence is known
+CLEAR_AIR_GAP=480       # a median gap this long means the radar is in clear-air mode
+GAP_HISTORY=12          # recent frame intervals used for the median
+POLL_MARGIN=30          # seconds after the expected frame time to poll
+MIN_INTERVAL=30         # never poll a station more often than this
+MAX_BACKOFF=600         # longest wait after a poll that found nothing new
+
+import time
+import heapq
+import asyncio
+import calendar
+from collections import deque
+
+import aiohttp
+
+from frame_cache import FrameCache, CACHE_DIR
+from radar_async import AsyncRadarEngine
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def frame_epoch(dtobj):
+    '''
+    :param dtobj: naive datetime of a frame, from img_name_tuple.
+    :return: seconds since the epoch, as if dtobj were UTC.
+    '''
+    return calendar.timegm(dtobj.timetuple())
+
+class StationCadence:
+    '''
+    Learns when a station publishes frames, and when it should be polled next.
+    '''
+    def __init__(self, station, default_gap=DEFAULT_GAP, margin=POLL_MARGIN):
+        self.station = station
+        self.default_gap = default_gap
+        self.margin = margin
+        self.gaps = deque(maxlen=GAP_HISTORY)
+        self.newest = None  # datetime of the newest frame seen
+        self.lag = None     # seconds from frame time to seen time, smallest so far
+        self.misses = 0     # polls since the last new frame
+        self.polls = 0
+
+    @property
+    def gap(self):
+        '''
+        :return: median seconds between frames.
+        '''
+        if not self.gaps:
+            return self.default_gap
+        gaps = sorted(self.gaps)
+        return gaps[len(gaps) // 2]
+
+    def clear_air(self):
+        return self.gap >= CLEAR_AIR_GAP
+
+    def observe(self, frame_times, seen):
+        '''
+        Update the cadence with the result of a poll.
+        :param frame_times: sorted datetimes of the frames in the listing.
+        :param seen: wall clock time of the poll, time.time()
+        :return: True if there was a new frame.
+        '''
+        self.polls += 1
+        if not frame_times or (self.newest is not None and frame_times[-1] <= self.newest):
+            self.misses += 1
+            return False
+        if self.newest is None:
+            times = list(frame_times)
+        else:
+            times = [self.newest] + [t for t in frame_times if t > self.newest]
+        for t0,t1 in zip(times, times[1:]):
+            gap = (t1 - t0).total_seconds()
+            if gap > 0:
+                self.gaps.append(gap)
+        self.newest = frame_times[-1]
+        lag = seen - frame_epoch(self.newest)
+        self.lag = lag if self.lag is None else min(self.lag, lag)
+        self.misses = 0
+        return True
+
+    def next_poll(self, now):
+        '''
+        :param now: wall clock time, time.time()
+        :return: wall clock time of the next poll.
+        '''
+        if self.newest is None:
+            return now + (MIN_INTERVAL if self.polls else 0)
+        expected = frame_epoch(self.newest) + self.lag + self.gap + self.margin
+        if self.misses:
+            backoff = min(self.margin * (2 ** self.misses), MAX_BACKOFF)
+            expected = max(expected, now) + backoff
+        return max(expected, now + MIN_INTERVAL)
+
+class PollScheduler:
+    '''
+    Polls several stations in one event loop, each at its own learned cadence.
+    '''
+    def __init__(self, stations, anim_out=ANIM_FILE_OUT, cache=None, products=None, **engine_args):
+        '''
+        :param stations: list of radar station names.
+        :param anim_out: output filename, or template with {station} and {product}.
+        :param cache: optional FrameCache shared by the stations.
+        :param products: list of RIDGE products built for every station. Default is RadarAnimator.product only.
+        :param engine_args: more arguments for AsyncRadarEngine, e.g., deadline.
+        '''
+        products = products or [None]
+        if len(stations) > 1 and '{station}' not in anim_out:
+            raise ValueError('PollScheduler: anim_out needs {station} for several stations')
+        if len(products) > 1 and '{product}' not in anim_out:
+            raise ValueError('PollScheduler: anim_out needs {product} for several products')
+        self.engines = {}   # station -> list of AsyncRadarEngine, one per product
+        self.cadences = {}
+        self.outputs = {}   # (station, product) -> output filename
+        for station in stations:
+            station = station.upper()
+            self.engines[station] = []
+            for product in products:
+                engine = AsyncRadarEngine(station, cache=cache, product=product, **engine_args)
+                self.engines[station].append(engine)
+                self.outputs[(station, engine.product)] = anim_out.format(station=station, product=engine.product)
+            self.cadences[station] = StationCadence(station)
+
+    async def build_product(self, session, engine):
+        '''
+        :return: sorted datetimes of the frames in the listing of one product, also when the build
+            stopped early because nothing changed. Empty if there was no listing or the build failed.
+        '''
+        try:
+            await engine.build(self.outputs[(engine.station, engine.product)], session)
+            return engine.listed_times
+        except Exception as err:
+            logger.debug('poll: %s %s failed (%s)' %(engine.station, engine.product, repr(err)))
+            return []
+
+    async def poll(self, session, station):
+        '''
+        Build the animations of all products of one station and learn from their listings.
+        '''
+        cadence = self.cadences[station]
+        seen = time.time()
+        results = await asyncio.gather(*[self.build_product(session, engine) for engine in self.engines[station]])
+        # the products come from the same scans: learn from the first one that has frames
+        frame_times = next((times for times in results if times), [])
+        is_new = cadence.observe(frame_times, seen)
+        logger.debug('poll: %s new=%s gap=%ds clear_air=%s misses=%d' %(
+            station, is_new, cadence.gap, cadence.clear_air(), cadence.misses))
+        return is_new
+
+    async def run(self, polls=None):
+        '''
+        Poll forever, or until polls polls have been made.
+        Each poll runs as its own task, so a station whose build is slow does not delay the
+        polls of the other stations. A station is polled again only after its poll is done.
+        '''
+        queue = [(time.time(), station) for station in self.engines]
+        heapq.heapify(queue)
+        in_flight = {}  # task -> station
+        count = 0
+        async with aiohttp.ClientSession() as session:
+            try:
+                while queue or in_flight:
+                    can_start = queue and (polls is None or count < polls)
+                    if not can_start and not in_flight:
+                        break
+                    wait_secs = max(0, queue[0][0] - time.time()) if can_start else None
+                    if wait_secs == 0:
+                        due, station = heapq.heappop(queue)
+                        in_flight[asyncio.ensure_future(self.poll(session, station))] = station
+                        count += 1
+                        continue
+                    if not in_flight:
+                        await asyncio.sleep(wait_secs)
+                        continue
+                    done, pending = await asyncio.wait(in_flight, timeout=wait_secs, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        station = in_flight.pop(task)
+                        if task.exception() is not None:
+                            logger.debug('run: poll of %s failed (%s)' %(station, repr(task.exception())))
+                        heapq.heappush(queue, (self.cadences[station].next_poll(time.time()), station))
+            finally:
+                for task in in_flight:
+                    task.cancel()
+
+def main(stations=RADAR_STATIONS, anim_out=ANIM_FILE_OUT, cache_dir=CACHE_DIR, polls=None, products=RADAR_PRODUCTS):
+    cache = FrameCache(cache_dir) if cache_dir else None
+    sched = PollScheduler(stations.split(','), anim_out, cache=cache, products=products.split(','), deadline=60)
+    asyncio.run(sched.run(polls))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hs:P:o:c:n:'
+    longOpts  = ['help', 'stations=', 'products=', 'out=', 'cache=', 'polls=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    stations = RADAR_STATIONS
+    products = RADAR_PRODUCTS
+    anim_out = ANIM_FILE_OUT
+    cache_dir = CACHE_DIR
+    polls = None
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-s','--stations'):
+            stations = val
+        elif arg in ('-P','--products'):
+            products = val
+        elif arg in ('-o','--out'):
+            anim_out = val
+        elif arg in ('-c','--cache'):
+            cache_dir = val if val.lower() != 'none' else None
+        elif arg in ('-n','--polls'):
+            polls = int(val)
+    main(stations=stations, anim_out=anim_out, cache_dir=cache_dir, polls=polls, products=products)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Catalog of the WSR-88D radar sites, for routing a location to its radar station.
+
+ridge2-wms/radar_site.js pairs every HomeLocation with a hard-coded radar_sta, and the Python
+programs only take station codes. SiteCatalog reads the sites and their coordinates from
+radar_sites.csv and answers, for a batch of latitudes and longitudes at once:
+* nearest: the k nearest radars and their distances,
+* covering: the radars whose coverage radius includes the location.
+The sites are kept as unit vectors on the sphere. For the 160 sites a whole batch of locations
+is one matrix product with the site vectors, which is exact (great circle distances, no
+problem at the date line or the poles) and faster than walking a tree per location.
+RIDGE names the station directories without the first letter of the ICAO id, e.g., KMUX is MUX.
+
+Usage: python radar_sites.py -l 36.99,-121.97 [-k 3] [-r radius_km]
+'''
+
+SITES_CSV='radar_sites.csv'
+EARTH_RADIUS_KM=6371.0
+COVERAGE_KM=230         # range of the base reflectivity products, 124 nm
+QUERY_CHUNK=8192        # locations per matrix product, bounds the memory of a big batch
+
+import os
+import csv
+
+import numpy as np
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def unit_vectors(lats, lons):
+    '''
+    :param lats: latitudes in degrees.
+    :param lons: longitudes in degrees.
+    :return: array of shape (n, 3), points on the unit sphere.
+    '''
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+def ridge_station(icao):
+    '''
+    :param icao: ICAO id of a radar site, e.g., KMUX
+    :return: RIDGE station name, e.g., MUX
+    '''
+    return icao[1:].upper()
+
+class SiteCatalog:
+    '''
+    Radar sites with a nearest-site index.
+    '''
+    def __init__(self, sites_csv=None):
+        '''
+        :param sites_csv: CSV file with columns icao,name,state,lat,lon. Default is radar_sites.csv
+            next to this module.
+        '''
+        sites_csv = sites_csv or os.path.join(os.path.dirname(os.path.abspath(__file__)), SITES_CSV)
+        with open(sites_csv, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.icao = np.array([row['icao'].upper() for row in rows])
+        self.names = [row['name'] for row in rows]
+        self.states = [row['state'] for row in rows]
+        self.lats = np.array([float(row['lat']) for row in rows])
+        self.lons = np.array([float(row['lon']) for row in rows])
+        self.vectors = unit_vectors(self.lats, self.lons)
+        self.position = dict([(icao, pos) for pos, icao in enumerate(self.icao)])
+        # RIDGE names: MUX for KMUX, but also HKI for PHKI, AHG for PAHG, JUA for TJUA...
+        self.station_position = dict([(ridge_station(icao), pos) for pos, icao in enumerate(self.icao)])
+        logger.debug('SiteCatalog: %d sites from %s' %(len(rows), sites_csv))
+
+    def __len__(self):
+        return len(self.icao)
+
+    def site(self, icao):
+        '''
+        :param icao: ICAO id, or RIDGE station name.
+        :return: dict with icao, station, name, state, lat, lon, or None.
+        '''
+        icao = icao.upper()
+        pos = self.position.get(icao, self.station_position.get(icao))
+        if pos is None:
+            return None
+        return {'icao': str(self.icao[pos]), 'station': ridge_station(self.icao[pos]), 'name': self.names[pos],
+                'state': self.states[pos], 'lat': float(self.lats[pos]), 'lon': float(self.lons[pos])}
+
+    def cosines(self, lats, lons):
+        '''
+        :return: array of shape (n, sites), cosine of the angle between each location and each site.
+        '''
+        return np.clip(unit_vectors(lats, lons) @ self.vectors.T, -1.0, 1.0)
+
+    def nearest(self, lats, lons, k=1):
+        '''
+        The k nearest sites of each location.
+        :param lats: latitudes in degrees, a number or an array.
+        :param lons: longitudes in degrees, same shape as lats.
+        :param k: number of sites per location.
+        :return: tuple (positions, km): int array and float array of shape (n, k), nearest first.
+            Use self.icao[positions] for the ids.
+        '''
+        lats = np.atleast_1d(lats)
+        lons = np.atleast_1d(lons)
+        k = min(k, len(self))
+        positions = np.empty((len(lats), k), dtype=np.int64)
+        km = np.empty((len(lats), k))
+        for lo in range(0, len(lats), QUERY_CHUNK):
+            hi = lo + QUERY_CHUNK
+            cos = self.cosines(lats[lo:hi], lons[lo:hi])
+            if k == 1:
+                best = np.argmax(cos, axis=1)[:, None]
+            else:
+                best = np.argpartition(-cos, k - 1, axis=1)[:, :k]
+                order = np.argsort(-np.take_along_axis(cos, best, axis=1), axis=1)
+                best = np.take_along_axis(best, order, axis=1)
+            positions[lo:hi] = best
+            km[lo:hi] = EARTH_RADIUS_KM * np.arccos(np.take_along_axis(cos, best, axis=1))
+        return (positions, km)
+
+    def nearest_station(self, lat, lon):
+        '''
+        :return: RIDGE station name of the radar nearest to one location, e.g., MUX
+        '''
+        positions, km = self.nearest(lat, lon)
+        return ridge_station(self.icao[positions[0, 0]])
+
+    def covering(self, lats, lons, radius_km=COVERAGE_KM):
+        '''
+        :param radius_km: coverage radius of a radar.
+        :return: list, one per location, of lists of (icao, km) of the radars within radius_km, nearest first.
+        '''
+        lats = np.atleast_1d(lats)
+        lons = np.atleast_1d(lons)
+        min_cos = np.cos(radius_km / EARTH_RADIUS_KM)
+        result = []
+        for lo in range(0, len(lats), QUERY_CHUNK):
+            cos = self.cosines(lats[lo:lo + QUERY_CHUNK], lons[lo:lo + QUERY_CHUNK])
+            for row in cos:
+                inside = np.flatnonzero(row >= min_cos)
+                inside = inside[np.argsort(-row[inside])]
+                result.append([(str(self.icao[pos]), float(EARTH_RADIUS_KM * np.arccos(row[pos]))) for pos in inside])
+        return result
+
+site_catalog = None
+
+def get_site_catalog():
+    '''
+    :return: the SiteCatalog of radar_sites.csv, loaded once per process.
+    '''
+    global site_catalog
+    if site_catalog is None:
+        site_catalog = SiteCatalog()
+    return site_catalog
+
+def main(location, k=3, radius_km=COVERAGE_KM):
+    '''
+    :param location: 'lat,lon' in degrees.
+    '''
+    lat, lon = [float(v) for v in location.split(',')]
+    catalog = get_site_catalog()
+    positions, km = catalog.nearest(lat, lon, k)
+    for pos, dist in zip(positions[0], km[0]):
+        site = catalog.site(catalog.icao[pos])
+        print('%s %-4s %7.1f km  %s, %s' %(site['icao'], site['station'], dist, site['name'], site['state']))
+    covering = catalog.covering(lat, lon, radius_km)[0]
+    print('covered by %s' %(', '.join([icao for icao, dist in covering]) or 'no radar within %d km' %(radius_km)))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hl:k:r:'
+    longOpts  = ['help', 'location=', 'nearest=', 'radius=']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    location = '36.99283,-121.97259'
+    k = 3
+    radius_km = COVERAGE_KM
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-l','--location'):
+            location = val
+        elif arg in ('-k','--nearest'):
+            k = int(val)
+        elif arg in ('-r','--radius'):
+            radius_km = float(val)
+    main(location, k=k, radius_km=radius_km)
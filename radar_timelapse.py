@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Long-window time-lapse loops from the frame archive, e.g., the last 6 hours in 60 frames.
+
+A 6 hour window has about 70 frames, 24 hours about 300. Encoding all of them makes a big,
+slow GIF, so only the frames that are shown are picked, from the record times of the archive:
+* even: the frame nearest to each of count evenly spaced times in the window,
+* weighted: more frames where there is more precipitation. The weight of a frame is the
+  fraction of echo (not transparent) pixels on a coarse grid, computed when the frame was
+  archived and kept in its index record, so no pixels are read to pick the frames. The frames
+  are picked at even steps of the cumulative weight, so a storm gets more frames than the
+  clear hours before it.
+Only the picked frames are converted and encoded, so the encode time depends on the number of
+output frames, not on the length of the window.
+
+Usage: python radar_timelapse.py -s MUX [-a radar_archive] [-w minutes] [-n frames | -t seconds] [-e] [-o out.gif]
+'''
+
+TIMELAPSE_OUT='radar_timelapse.gif'
+TIMELAPSE_WINDOW=6*60   # minutes
+TIMELAPSE_FRAMES=60
+FRAME_DURATION=0.1      # seconds per frame when the output duration is not given
+WEIGHT_FLOOR=0.05       # weight of a frame without echoes, so clear hours still get a few frames
+
+import time
+import datetime as dt
+
+import numpy as np
+import imageio
+
+from frame_archive import FrameArchive, ARCHIVE_DIR
+from nws_radar_gif import GIF_FORMAT, merge_repeated_frames
+from radar_publish import publish_atomic, is_file_output
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+def select_even(times, count):
+    '''
+    :param times: sorted array of frame times (numbers or datetime64).
+    :param count: number of frames wanted.
+    :return: sorted array of positions in times, at most count, no duplicates.
+    '''
+    times = np.asarray(times).astype(np.int64)
+    if len(times) <= count:
+        return np.arange(len(times))
+    targets = np.linspace(times[0], times[-1], count)
+    right = np.clip(np.searchsorted(times, targets), 1, len(times) - 1)
+    left = right - 1
+    nearest = np.where(targets - times[left] <= times[right] - targets, left, right)
+    return np.unique(nearest)
+
+def select_weighted(weights, count):
+    '''
+    :param weights: array of frame weights, in time order.
+    :param count: number of frames wanted.
+    :return: sorted array of positions, at most count, no duplicates.
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) <= count:
+        return np.arange(len(weights))
+    cumulative = np.cumsum(weights)
+    targets = np.linspace(cumulative[0], cumulative[-1], count)
+    return np.unique(np.clip(np.searchsorted(cumulative, targets), 0, len(weights) - 1))
+
+class TimeLapse:
+    '''
+    Renders time-lapse loops of one station from a FrameArchive.
+    '''
+    def __init__(self, archive, catalog=None):
+        '''
+        :param archive: FrameArchive of the station and product.
+        :param catalog: optional FrameCatalog, the renders are recorded in it as builds.
+        '''
+        self.archive = archive
+        self.catalog = catalog
+        self.selected = []  # ArchiveFrame of the last render
+
+    def select(self, window, count, weighted=False):
+        '''
+        Pick the frames of a loop.
+        :param window: minutes, counted back from the newest frame in the archive.
+        :param count: number of frames wanted.
+        :param weighted: True for more frames where there is more precipitation, else evenly spaced.
+        :return: list of ArchiveFrame, oldest first.
+        '''
+        newest = self.archive.newest()
+        if newest is None:
+            return []
+        lo, hi = self.archive.range_bounds(newest - dt.timedelta(minutes=window), newest)
+        if weighted:
+            weights = np.maximum(WEIGHT_FLOOR, self.archive.echo_fractions(lo, hi))
+            picked = select_weighted(weights, count)
+        else:
+            picked = select_even(self.archive.records['time'][lo:hi], count)
+        logger.debug('select: %d of %d frames in %d minutes' %(len(picked), hi - lo, window))
+        return [self.archive.frame(lo + int(pos)) for pos in picked]
+
+    def render(self, anim_out=TIMELAPSE_OUT, window=TIMELAPSE_WINDOW, count=TIMELAPSE_FRAMES,
+               duration=None, weighted=False):
+        '''
+        Encode a time-lapse loop.
+        :param anim_out: either a GIF filename or imageio.RETURN_BYTES.
+        :param window: minutes, counted back from the newest frame in the archive.
+        :param count: number of frames.
+        :param duration: seconds for the whole loop. Default is FRAME_DURATION per frame.
+        :param weighted: pick more frames where there is more precipitation.
+        :return: None (if writing file) or byte array
+        '''
+        t0 = time.perf_counter()
+        self.selected = self.select(window, count, weighted)
+        if not self.selected:
+            raise IOError('render: no frames in the archive of %s' %(self.archive.station))
+        frame_duration = duration / float(len(self.selected)) if duration else FRAME_DURATION
+        # repeated frames are converted once and shown longer
+        keys = [frame.digest for frame in self.selected]
+        frames, durations = merge_repeated_frames(self.selected, frame_duration, keys)
+        ims = [frame.rgba() for frame in frames]
+        if is_file_output(anim_out):
+            retval = publish_atomic(anim_out, lambda tmp_out: imageio.mimwrite(tmp_out, ims, loop=0,
+                                    duration=durations, format=GIF_FORMAT))
+        else:
+            retval = imageio.mimwrite(anim_out, ims, loop=0, duration=durations, format=GIF_FORMAT)
+        if self.catalog is not None:
+            secs = time.perf_counter() - t0
+            self.catalog.record_build(self.archive.station, self.archive.product, anim_out, 'timelapse',
+                                      len(self.selected), {'encode': secs, 'total': secs})
+        return retval
+
+def main(station='MUX', product='N0R', archive_dir=ARCHIVE_DIR, anim_out=TIMELAPSE_OUT, window=TIMELAPSE_WINDOW,
+         count=TIMELAPSE_FRAMES, duration=None, weighted=False):
+    '''
+    :param duration: seconds for the whole loop. If count is None, count is duration / FRAME_DURATION.
+    '''
+    if count is None:
+        count = max(2, int(round(duration / FRAME_DURATION))) if duration else TIMELAPSE_FRAMES
+    lapse = TimeLapse(FrameArchive(station, product, archive_dir))
+    lapse.render(anim_out, window, count, duration, weighted)
+    if lapse.selected:
+        print('%s: %d frames from %s to %s' %(anim_out, len(lapse.selected), lapse.selected[0].time, lapse.selected[-1].time))
+
+if __name__== "__main__":
+    import sys
+    import getopt
+    argsList = sys.argv[1:]
+    shortOpts = 'hs:p:a:o:w:n:t:e'
+    longOpts  = ['help', 'station=', 'product=', 'archive=', 'out=', 'window=', 'frames=', 'duration=', 'events']
+    try:
+        args,values = getopt.getopt(argsList, shortOpts, longOpts)
+    except getopt.error as err:
+        print('ERROR unknown arg: '+str(err))
+        sys.exit(2)
+    station = 'MUX'
+    product = 'N0R'
+    archive_dir = ARCHIVE_DIR
+    anim_out = TIMELAPSE_OUT
+    window = TIMELAPSE_WINDOW
+    count = None
+    duration = None
+    weighted = False
+    for arg,val in args:
+        if arg in ('-h','--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg in ('-s','--station'):
+            station = val
+        elif arg in ('-p','--product'):
+            product = val
+        elif arg in ('-a','--archive'):
+            archive_dir = val
+        elif arg in ('-o','--out'):
+            anim_out = val
+        elif arg in ('-w','--window'):
+            window = int(val)
+        elif arg in ('-n','--frames'):
+            count = int(val)
+        elif arg in ('-t','--duration'):
+            duration = float(val)
+        elif arg in ('-e','--events'):
+            weighted = True
+    main(station=station, product=product, archive_dir=archive_dir, anim_out=anim_out, window=window,
+         count=count, duration=duration, weighted=weighted)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Streaming parser for NWS RIDGE directory listings.
+
+MyHTMLParser runs the whole listing through html.parser and looks at every attribute of every
+tag, although all we want are the hrefs of the GIF frames. A listing can hold several hours of
+frames, and a mirror may list several products in one directory.
+ListingParser takes the listing as bytes, chunk by chunk as it arrives, and only picks out the
+names STATION_YYYYMMDD_HHMM_PRODUCT.gif with one regular expression. The timestamps are compared
+as 'YYYYMMDDHHMM' strings, so no datetime is made for a frame outside the time window.
+If the listing is sorted newest first (e.g., Apache ?C=M;O=D), the parser sees the newest frame
+first, knows the window from it, and is done at the first frame before the window: the caller
+can stop reading the reply. A listing sorted oldest first has to be read to the end, but only
+the frames in the window are returned.
+'''
+
+LISTING_CHUNK=16*1024   # bytes read from the reply at a time
+
+import re
+import datetime as dt
+
+import logging
+import my_logger
+logger = my_logger.setup_logger(__name__,'pyradar.log', level=logging.DEBUG)
+
+TIME_KEY_FORMAT='%Y%m%d%H%M'
+NAME_MAX=64     # longest href we care about, in bytes
+
+def time_key(dtobj):
+    '''
+    :param dtobj: datetime of a frame.
+    :return: sortable key 'YYYYMMDDHHMM', as found in RIDGE filenames.
+    '''
+    return dtobj.strftime(TIME_KEY_FORMAT)
+
+class ListingParser:
+    '''
+    Extracts the frame names of one station (and product) from a RIDGE listing.
+        parser = ListingParser('MUX', 'N0R', twindow=70)
+        while not parser.done:
+            chunk = response.read(LISTING_CHUNK)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        img_list = parser.get_img_list()
+    '''
+    def __init__(self, station, product=None, twindow=None, since=None):
+        '''
+        :param station: radar station name, e.g., "mux" for Mt. Umunhum
+        :param product: product code, e.g., "N0R". None for frames of any product.
+        :param twindow: time window in minutes, counted back from the newest frame. None for all frames.
+        :param since: optional datetime; frames before it are dropped.
+        '''
+        self.station = station.upper()
+        product_re = re.escape(product.upper()).encode('ascii') if product else rb'[A-Za-z0-9]+'
+        self.pattern = re.compile(rb'''href=["']?(''' + re.escape(self.station).encode('ascii') +
+                                  rb'_(\d{8})_(\d{4})_' + product_re + rb'\.gif)')
+        self.twindow = twindow
+        self.since_key = time_key(since) if since is not None else ''
+        self.start_key = self.since_key
+        self.tail = b''
+        self.entries = []           # (key, name) in listing order
+        self.newest_first = None    # None until two frames have been seen
+        self.done = False
+        self.nbytes = 0
+
+    def feed(self, chunk):
+        '''
+        Parse the next part of the listing.
+        :param chunk: bytes (or str) of the listing, in order. Ignored once done is True.
+        '''
+        if self.done:
+            return
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self.nbytes += len(chunk)
+        buf = self.tail + chunk
+        end = 0
+        for match in self.pattern.finditer(buf):
+            end = match.end()
+            key = (match.group(2) + match.group(3)).decode('ascii')
+            if not self.add(key, match.group(1).decode('ascii')):
+                self.done = True
+                self.tail = b''
+                return
+        # keep enough of the end for a name that is split between chunks
+        self.tail = buf[max(end, len(buf) - NAME_MAX):]
+
+    def add(self, key, name):
+        '''
+        :return: False if the listing is newest first and key is before the window: stop parsing.
+        '''
+        if self.entries and self.newest_first is None and key != self.entries[-1][0]:
+            self.newest_first = key < self.entries[-1][0]
+        if not self.entries and self.twindow is not None:
+            # if the listing is newest first, this is the newest frame and the window is known
+            newest = dt.datetime.strptime(key, TIME_KEY_FORMAT)
+            self.start_key = max(self.since_key, time_key(newest - dt.timedelta(minutes=self.twindow)))
+        if self.newest_first and key < self.start_key:
+            logger.debug('add: %s is before the window, stop after %d bytes' %(name, self.nbytes))
+            return False
+        self.entries.append((key, name))
+        return True
+
+    def get_img_list(self):
+        '''
+        :return: list of GIF filenames in the time window, oldest first.
+        '''
+        entries = self.entries[::-1] if self.newest_first else self.entries
+        if entries and self.twindow is not None:
+            newest = dt.datetime.strptime(entries[-1][0], TIME_KEY_FORMAT)
+            start_key = max(self.since_key, time_key(newest - dt.timedelta(minutes=self.twindow)))
+        else:
+            start_key = self.since_key
+        return [name for key, name in entries if key >= start_key]
+
+def parse_listing(html, station, product=None, twindow=None):
+    '''
+    Parse a complete listing.
+    :param html: bytes or str of the listing.
+    :return: list of GIF filenames, oldest first.
+    '''
+    parser = ListingParser(station, product, twindow)
+    parser.feed(html)
+    return parser.get_img_list()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Checks that the animations assembled from RIDGE frame bytes show exactly the pixels of the frames:
+splice_gif, RollingGif after a window shift, and delta_gif, decoded with Pillow as a viewer does.
+
+Usage: python -m pytest -q test_gif_exact.py
+'''
+
+SAMPLE_STATION='MUX'
+SAMPLE_PRODUCT='N0R'
+DURATION=0.5        # seconds per frame of the test animations
+
+import io
+import os
+import glob
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from gif_splice import splice_gif, RollingGif
+from gif_delta import delta_gif
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))    # holds the MUX_*.gif samples
+
+def sample_files():
+    return sorted(glob.glob(os.path.join(SAMPLE_DIR, SAMPLE_STATION + '_*_' + SAMPLE_PRODUCT + '.gif')))
+
+def decode_frames(gif_bytes):
+    '''
+    :return: list of RGBA arrays, one per frame shown, repeated for the frames that are shown longer.
+    '''
+    frames = []
+    for im in ImageSequence.Iterator(Image.open(io.BytesIO(gif_bytes))):
+        frames += [np.asarray(im.convert('RGBA'))] * max(1, int(round(im.info['duration'] / (DURATION * 1000))))
+    return frames
+
+def assert_same_frames(gif_bytes, ims_bytes):
+    '''
+    Every frame of the animation has the visible pixels of its source GIF.
+    '''
+    frames = decode_frames(gif_bytes)
+    assert len(frames) == len(ims_bytes)
+    for n, (a, img_bytes) in enumerate(zip(frames, ims_bytes)):
+        b = np.asarray(Image.open(io.BytesIO(img_bytes)).convert('RGBA'))
+        assert a.shape == b.shape, 'frame %d' %(n)
+        same = (a == b).all(axis=2) | ((a[..., 3] == 0) & (b[..., 3] == 0))
+        assert same.all(), 'frame %d: %d pixels differ' %(n, (~same).sum())
+
+def test_samples():
+    assert len(sample_files()) >= 4
+
+def test_splice_gif():
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    assert_same_frames(splice_gif(ims_bytes, DURATION), ims_bytes)
+
+def test_splice_gif_repeated_frames():
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    ims_bytes = ims_bytes[:2] + ims_bytes[1:2] + ims_bytes[2:]
+    assert_same_frames(splice_gif(ims_bytes, DURATION), ims_bytes)
+
+def test_rolling_gif(tmp_path):
+    files = sample_files()
+    names = [os.path.basename(f) for f in files]
+    frames = dict([(name, open(f, 'rb').read()) for name, f in zip(names, files)])
+    anim_out = str(tmp_path / 'rolling.gif')
+    window = len(names) - 3
+    RollingGif(anim_out, DURATION).update(names[:window], frames)
+    # the window moves by 3 frames: only the new frames are given
+    rolling_gif = RollingGif(anim_out, DURATION)
+    window_names = names[3:3 + window]
+    kept = rolling_gif.retained(window_names)
+    assert len(kept) == window - 3
+    rolling_gif.update(window_names, dict([(name, frames[name]) for name in window_names if name not in kept]))
+    assert rolling_gif.copied > 0 and rolling_gif.added == 3
+    with open(anim_out, 'rb') as f:
+        assert_same_frames(f.read(), [frames[name] for name in window_names])
+
+def test_delta_gif():
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    assert_same_frames(delta_gif(ims_bytes, DURATION), ims_bytes)
+
+def test_delta_gif_repeated_frames():
+    ims_bytes = [open(f, 'rb').read() for f in sample_files()]
+    ims_bytes = ims_bytes[:3] + ims_bytes[2:3] * 2 + ims_bytes[3:]
+    assert_same_frames(delta_gif(ims_bytes, DURATION), ims_bytes)